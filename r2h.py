@@ -19,13 +19,13 @@ ASCII backspace (Ctrl-H, 0x08) and Delete/Rubout (Ctrl-?, 0x7F) can erase parts
 the rest is mostly a subset of the conversions described in https://github.com/yustier/jis-x-4063-2000
 
 some of the differences from some other romaji input methods etc.:
-1. no hiragana, since that does not exist in the halfwidth kana
+1. no hiragana, since that does not exist in the halfwidth kana (use `--form hiragana` for fullwidth hiragana output)
 2. no `wyi` and `wye`, since those do not exist in the halfwidth kana
 3. no `xwa`, since that does not exist in the halfwidth kana
 4. no `xke` and `xka`, since those do not exist in the halfwidth kana
 5. `-` is only converted when it immediately follows kana, use `^` in other places
 6. use `xaxa`/`lala`, `xyaxya`/`lyalya` etc. to repeat small `a`/`ya` etc.
-7. no visual feedback during conversion
+7. no visual feedback during conversion, except with `--interactive`
 8. no kanji input, no other punctuation or special symbol input
 9. instead of tchi etc. write cchi/tti etc.
 10. instead of `mma`, `mbu`, `mpu` etc. write `nma`, `nbu`, `npu` etc.
@@ -44,7 +44,7 @@ some of the differences from some other romaji input methods etc.:
 
 """
 
-R2K_ONE_TO_ONE_IMPLEMENTATION = (  # either "fast" or "simple" (constant, ignored after time of import)
+R2K_ONE_TO_ONE_IMPLEMENTATION = (  # either "fast" or "simple"; the default for `r2h()`, see `R2H_ENGINES` to choose per call
     "simple"
 )
 
@@ -464,7 +464,194 @@ UNUSED_R2R = chr(
 )  # used as a marker for unused/filler slots in various character buffers
 
 
-def r2h(*, ibuf, state, obuf, flags, getch):
+R2R_EXTENSION_RULES = (  # site-specific rules from `register_rules()`, replaced as a whole so that each step sees one set of them
+    {},  # lowercase romaji → romaji of their kana
+    frozenset(),  # proper prefixes of that romaji
+    frozenset(),  # those of the prefixes which the built-in rules never leave pending
+)
+
+
+def r2r_step(prefix, ch, extensions=True):
+    """
+    romaji-to-romaji rewriting, one input character at a time
+
+    - prefix is the romaji prefix pending rewriting; initially it should be "".
+    - ch is the next input character, or an empty string to indicate that the input source is exhausted (EOF).
+    - extensions is false to ignore the rules added by `register_rules()`.
+
+    the return values are prefix, out, retry.
+    - prefix is the new pending romaji prefix.
+    - out is rewritten romaji to be passed along to the romaji-to-kana phase.
+    - retry is input to be reprocessed before reading any further input.
+    """
+    lch = ch.lower()
+    lprefix = prefix.lower()
+    lprefix_ch = lprefix + lch
+    if prefix and (lch in (BACKSPACE_A, RUBOUT_A)):
+        return prefix[:-1], "", ""
+    added, added_prefixes, added_only_prefixes = R2R_EXTENSION_RULES
+    if ch and extensions and added:
+        if lprefix_ch in added:
+            return "", added[lprefix_ch], ""
+        if lprefix_ch in added_prefixes:
+            return prefix + ch, "", ""
+        if lprefix in added_only_prefixes:
+            return "", prefix[:1], prefix[1:] + ch
+
+    def cased(s):
+        if prefix != lprefix:
+            s = s.upper()
+        return s
+
+    voicing_r = ""
+    if lprefix[:1] in HAS_DAKUTEN_R_SET:
+        voicing_r = cased(DAKUTEN_R)
+    elif lprefix[:1] in HAS_HANDAKUTEN_R_SET:
+        voicing_r = cased(HANDAKUTEN_R)
+    onset_r = prefix[:1]
+    onset_r = cased(ONSET_DEVOICING_MAP.get(onset_r.lower(), "")) or onset_r
+    if lprefix_ch[:2] == "wh":
+        onset_r = cased("u")
+    elif lprefix[:1] == "c":
+        if (lprefix[1:2] or lch) in ("i", "e"):
+            onset_r = cased("s")
+        elif (lprefix[1:2] or lch) in ("h", "y"):
+            onset_r = cased("t")
+        else:
+            onset_r = cased("k")
+    onset_ch_r = onset_r + ch + voicing_r
+    onset_i_r = onset_r + cased("i") + voicing_r
+    onset_u_r = onset_r + cased("u") + voicing_r
+    onset_e_r = onset_r + cased("e") + voicing_r
+    onset_o_r = onset_r + cased("o") + voicing_r
+    small_r = cased("x")
+    small_y_r = small_r + cased("y")
+    if prefix and (lprefix != "n") and (lch == lprefix):
+        return ch, small_r + cased("tu"), ""
+    if (
+        (prefix == "" and lch in LEAD_R2R_R_SET)
+        or ((lprefix in ("x", "l")) and (lch == "t"))
+        or ((lprefix in LEAD_Y_R2R_R_SET) and (lch == "y"))
+        or ((lprefix in ("xt", "lt", "t")) and (lch == "s"))
+        or ((lprefix in LEAD_W_R2R_R_SET) and (lch == "w"))
+        or ((lprefix in LEAD_H_R2R_R_SET) and (lch == "h"))
+        or ((lprefix in ("t", "d")) and lch == "'")
+        or ((lprefix == "d") and lch == "z")
+    ):
+        return prefix + ch, "", ""
+    elif ((lprefix in ("x", "l")) and lch in AIUEO_R_SET) or (
+        (lprefix in ("xy", "ly")) and (lch in ("i", "e"))
+    ):
+        return "", small_r + ch, ""
+    elif (lprefix in ("x", "l")) and lch == "n":
+        return "", ch + "'", ""
+    elif (lprefix in ("xy", "ly")) and lch in AUO_R_SET:
+        return "", small_y_r + ch, ""
+    elif ((lprefix in ("xt", "lt")) and (lch == "u")) or (
+        (lprefix in ("xts", "lts")) and (lch == "u")
+    ):
+        return "", small_r + prefix[1:2] + ch, ""
+    elif (lprefix == "v") and (lch == "u"):
+        return "", onset_r + voicing_r, ""
+    elif (
+        ((lprefix == "v") and (lch in AIUEO_R_SET) and (lch != "u"))
+        or ((lprefix == "vy") and (lch in ("i", "e")))
+        or ((lprefix == "wh") and lch in AIUEO_R_SET and (lch != "u"))
+    ):
+        return "", onset_r + voicing_r + small_r + ch, ""
+    elif (lprefix == "vy") and lch in AUO_R_SET:
+        return "", onset_r + voicing_r + small_r + prefix[1:] + ch, ""
+    elif (
+        ((lprefix in LEAD_AIUEO_R2R_R_SET) and (lch in AIUEO_R_SET))
+        or ((lprefix == "y") and lch in AUO_R_SET)
+        or ((lprefix == "w") and (lch in ("a", "o")))
+        or ((lprefix == "q") and (lch == "u"))
+        or ((lprefix in ("ch", "cy")) and (lch == "i"))
+        or ((lprefix in ("sh", "j")) and (lch == "i"))
+    ):
+        out = onset_ch_r
+        if lprefix == "cy":
+            out += small_r + ch
+        return "", out, ""
+    elif (lprefix in ONSET_I_AIUEO_R2R_R_SET) and (lch in AUO_R_SET):
+        return "", onset_i_r + small_r + prefix[1:] + ch, ""
+    elif (lprefix in ONSET_I_AIUEO_R2R_R_SET) and (lch in ("i", "e")):
+        return "", onset_i_r + small_r + ch, ""
+    elif (
+        ((lprefix in ONSET_U_AIUEO_R_SET) and (lch in AIUEO_R_SET))
+        or (
+            (lprefix in ONSET_U_AIEO_R_SET)
+            and (lch in AIUEO_R_SET)
+            and lch != "u"
+        )
+        or ((lprefix == "hwy") and (lch == "u"))
+    ):
+        return "", onset_u_r + small_r + prefix[2:] + ch, ""
+    elif (lprefix in ("ts", "dz", "f")) and (lch == "u"):
+        return "", onset_u_r, ""
+    elif (lprefix in ("qy", "fy")) and lch in AUO_R_SET:
+        return "", onset_u_r + small_r + prefix[1:] + ch, ""
+    elif ((lprefix in ("ch", "cy")) and (lch in AUO_R_SET)) or (
+        (lprefix in ("sh", "sy", "j")) and (lch in AUO_R_SET)
+    ):
+        return "", onset_i_r + small_y_r + ch, ""
+    elif ((lprefix in ("ch", "cy")) and (lch == "e")) or (
+        (lprefix in ("sh", "sy", "j"))
+        and ((lch == "i" and lprefix == "sy") or lch == "e")
+    ):
+        return "", onset_i_r + small_r + ch, ""
+    elif (lprefix == "z") and (
+        lprefix_ch
+        in (
+            DAKUTEN_R,
+            HANDAKUTEN_R,
+            "z" + MIDDOT_A,
+            "z" + HYPHEN_MINUS_A,
+        )
+    ):
+        return "", prefix + ch, ""
+    elif (lprefix in ("th", "dh")) and lch in AUO_R_SET:
+        return "", onset_e_r + small_y_r + ch, ""
+    elif (lprefix in ("th", "dh")) and lch in ("i", "e"):
+        return "", onset_e_r + small_r + ch, ""
+    elif ((lprefix in ("tw", "dw")) and lch in AIUEO_R_SET) or (
+        (lprefix in ("t'", "d'")) and (lch == "u")
+    ):
+        return "", onset_o_r + small_r + ch, ""
+    elif ((lprefix in ("t'", "d'")) and (lch == "i")) or (
+        (
+            lprefix
+            in (
+                "t'y",
+                "d'y",
+            )
+        )
+        and (lch == "u")
+    ):
+        return "", onset_e_r + small_r + prefix[2:] + ch, ""
+    elif (lprefix == "n") and (lch in ("n", "'")):
+        return "", onset_r + "'", ""
+    elif (lprefix == "n") and (
+        (not ch) or ((lch not in AIUEO_R_SET) and (lch not in ("n", "'")))
+    ):
+        return "", onset_r + "'", ch
+    elif (
+        ((lprefix == "y") and (lch == "i"))
+        or ((lprefix == "w") and (lch == "u"))
+        or ((lprefix == "wh") and (lch == "u"))
+    ):
+        return "", ch, ""
+    elif (lprefix == "y") and (lch == "e"):
+        return "", cased("i") + small_r + ch, ""
+    elif (lprefix == "w") and (lch in ("i", "e")):
+        return "", cased("u") + small_r + ch, ""
+    if prefix:
+        # print(f"r2r fallback!!! {dict(prefix=prefix, ch=ch)}")
+        return "", prefix[:1], prefix[1:] + ch
+    return "", ch, ""
+
+
+def r2h(*, ibuf, state, obuf, flags, getch, r2k_one_to_one=r2k_one_to_one):
     """
     convert romaji to halfwidth katakana
 
@@ -477,6 +664,8 @@ def r2h(*, ibuf, state, obuf, flags, getch):
     the return values are ch, ibuf, state, obuf, flags.
     - ch is the next output character, or an empty string to indicate that the input source is exhausted (EOF) and all input fully processed.
     - the returned ibuf, state, obuf, and flags should be passed back in on a subsequent call associated with the same input source / getch.
+    - r2k_one_to_one is the implementation of the 1:1 romaji-to-kana step, `r2k_one_to_one_simple()` or `r2k_one_to_one_fast()`; both give the same output.
+    - the returned ibuf, state, and obuf are never longer than `R2H_MAX_IBUF`, `R2H_MAX_STATE`, and `R2H_MAX_OBUF` characters, however long or adversarial the input, so a stream of any length is converted in constant memory (see `r2h_buffer_bounds()`).
 
     supported inputs:
 
@@ -576,274 +765,3201 @@ def r2h(*, ibuf, state, obuf, flags, getch):
                 ch, ibuf_r2r = ibuf_r2r[:1], ibuf_r2r[1:]
             else:
                 ch = getch()
-            lch = ch.lower()
-            lprefix = prefix.lower()
-            lprefix_ch = lprefix + lch
-            if prefix and (lch in (BACKSPACE_A, RUBOUT_A)):
-                prefix = prefix[:-1]
-                continue
+            if not (prefix or ch):
+                break
+            prefix, obuf_r2r, retry = r2r_step(prefix, ch)
+            ibuf_r2r = retry + ibuf_r2r
+        return ch
 
-            def cased(s):
-                if prefix != lprefix:
-                    s = s.upper()
-                return s
-
-            voicing_r = ""
-            if lprefix[:1] in HAS_DAKUTEN_R_SET:
-                voicing_r = cased(DAKUTEN_R)
-            elif lprefix[:1] in HAS_HANDAKUTEN_R_SET:
-                voicing_r = cased(HANDAKUTEN_R)
-            onset_r = prefix[:1]
-            onset_r = cased(ONSET_DEVOICING_MAP.get(onset_r.lower(), "")) or onset_r
-            if lprefix_ch[:2] == "wh":
-                onset_r = cased("u")
-            elif lprefix[:1] == "c":
-                if (lprefix[1:2] or lch) in ("i", "e"):
-                    onset_r = cased("s")
-                elif (lprefix[1:2] or lch) in ("h", "y"):
-                    onset_r = cased("t")
-                else:
-                    onset_r = cased("k")
-            onset_ch_r = onset_r + ch + voicing_r
-            onset_i_r = onset_r + cased("i") + voicing_r
-            onset_u_r = onset_r + cased("u") + voicing_r
-            onset_e_r = onset_r + cased("e") + voicing_r
-            onset_o_r = onset_r + cased("o") + voicing_r
-            small_r = cased("x")
-            small_y_r = small_r + cased("y")
-            if prefix and (lprefix != "n") and (lch == lprefix):
-                obuf_r2r = small_r + cased("tu")
-                prefix = ch
-                continue
-            if (
-                (prefix == "" and lch in LEAD_R2R_R_SET)
-                or ((lprefix in ("x", "l")) and (lch == "t"))
-                or ((lprefix in LEAD_Y_R2R_R_SET) and (lch == "y"))
-                or ((lprefix in ("xt", "lt", "t")) and (lch == "s"))
-                or ((lprefix in LEAD_W_R2R_R_SET) and (lch == "w"))
-                or ((lprefix in LEAD_H_R2R_R_SET) and (lch == "h"))
-                or ((lprefix in ("t", "d")) and lch == "'")
-                or ((lprefix == "d") and lch == "z")
-            ):
-                prefix += ch
-                continue
-            elif ((lprefix in ("x", "l")) and lch in AIUEO_R_SET) or (
-                (lprefix in ("xy", "ly")) and (lch in ("i", "e"))
-            ):
-                obuf_r2r = small_r + ch
-                prefix = ""
-                continue
-            elif (lprefix in ("x", "l")) and lch == "n":
-                obuf_r2r = ch + "'"
-                prefix = ""
-                continue
-            elif (lprefix in ("xy", "ly")) and lch in AUO_R_SET:
-                obuf_r2r = small_y_r + ch
-                prefix = ""
-                continue
-            elif ((lprefix in ("xt", "lt")) and (lch == "u")) or (
-                (lprefix in ("xts", "lts")) and (lch == "u")
-            ):
-                obuf_r2r = small_r + prefix[1:2] + ch
-                prefix = ""
-                continue
-            elif (lprefix == "v") and (lch == "u"):
-                obuf_r2r = onset_r + voicing_r
-                prefix = ""
-                continue
-            elif (
-                ((lprefix == "v") and (lch in AIUEO_R_SET) and (lch != "u"))
-                or ((lprefix == "vy") and (lch in ("i", "e")))
-                or ((lprefix == "wh") and lch in AIUEO_R_SET and (lch != "u"))
-            ):
-                obuf_r2r = onset_r + voicing_r + small_r + ch
-                prefix = ""
-                continue
-            elif (lprefix == "vy") and lch in AUO_R_SET:
-                obuf_r2r = onset_r + voicing_r + small_r + prefix[1:] + ch
-                prefix = ""
-                continue
-            elif (
-                ((lprefix in LEAD_AIUEO_R2R_R_SET) and (lch in AIUEO_R_SET))
-                or ((lprefix == "y") and lch in AUO_R_SET)
-                or ((lprefix == "w") and (lch in ("a", "o")))
-                or ((lprefix == "q") and (lch == "u"))
-                or ((lprefix in ("ch", "cy")) and (lch == "i"))
-                or ((lprefix in ("sh", "j")) and (lch == "i"))
-            ):
-                obuf_r2r = onset_ch_r
-                if lprefix == "cy":
-                    obuf_r2r += small_r + ch
-                prefix = ""
-                continue
-            elif (lprefix in ONSET_I_AIUEO_R2R_R_SET) and (lch in AUO_R_SET):
-                obuf_r2r = onset_i_r
-                obuf_r2r += small_r + prefix[1:] + ch
-                prefix = ""
-                continue
-            elif (lprefix in ONSET_I_AIUEO_R2R_R_SET) and (lch in ("i", "e")):
-                obuf_r2r = onset_i_r
-                obuf_r2r += small_r + ch
-                prefix = ""
-                continue
-            elif (
-                ((lprefix in ONSET_U_AIUEO_R_SET) and (lch in AIUEO_R_SET))
-                or (
-                    (lprefix in ONSET_U_AIEO_R_SET)
-                    and (lch in AIUEO_R_SET)
-                    and lch != "u"
-                )
-                or ((lprefix == "hwy") and (lch == "u"))
-            ):
-                obuf_r2r = onset_u_r + small_r + prefix[2:] + ch
-                prefix = ""
-                continue
-            elif (lprefix in ("ts", "dz", "f")) and (lch == "u"):
-                obuf_r2r = onset_u_r
-                prefix = ""
-                continue
-            elif (lprefix in ("qy", "fy")) and lch in AUO_R_SET:
-                obuf_r2r = onset_u_r + small_r + prefix[1:] + ch
-                prefix = ""
-                continue
-            elif ((lprefix in ("ch", "cy")) and (lch in AUO_R_SET)) or (
-                (lprefix in ("sh", "sy", "j")) and (lch in AUO_R_SET)
-            ):
-                obuf_r2r = onset_i_r + small_y_r + ch
-                prefix = ""
-                continue
-            elif ((lprefix in ("ch", "cy")) and (lch == "e")) or (
-                (lprefix in ("sh", "sy", "j"))
-                and ((lch == "i" and lprefix == "sy") or lch == "e")
-            ):
-                obuf_r2r = onset_i_r + small_r + ch
-                prefix = ""
-                continue
-            elif (lprefix == "z") and (
-                lprefix_ch
-                in (
-                    DAKUTEN_R,
-                    HANDAKUTEN_R,
-                    "z" + MIDDOT_A,
-                    "z" + HYPHEN_MINUS_A,
-                )
-            ):
-                obuf_r2r = prefix + ch
-                prefix = ""
-                continue
-            elif (lprefix in ("th", "dh")) and lch in AUO_R_SET:
-                obuf_r2r = onset_e_r
-                obuf_r2r += small_y_r + ch
-                prefix = ""
-                continue
-            elif (lprefix in ("th", "dh")) and lch in ("i", "e"):
-                obuf_r2r = onset_e_r
-                obuf_r2r += small_r + ch
-                prefix = ""
-                continue
-            elif ((lprefix in ("tw", "dw")) and lch in AIUEO_R_SET) or (
-                (lprefix in ("t'", "d'")) and (lch == "u")
-            ):
-                obuf_r2r = onset_o_r + small_r + ch
-                prefix = ""
-                continue
-            elif ((lprefix in ("t'", "d'")) and (lch == "i")) or (
-                (
-                    lprefix
-                    in (
-                        "t'y",
-                        "d'y",
+    ch, ibuf_r2k, state_r2k, obuf_r2k, flags_r2k = r2k_one_to_one(
+        ibuf=ibuf_r2k, state=state_r2k, obuf=obuf_r2k, flags=flags_r2k, getch=getch_r2r
+    )
+    ibuf = "".join(
+        [
+            (ibuf_r2k[i : 1 + i] or UNUSED_R2R) + (ibuf_r2r[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(ibuf_r2k), len(ibuf_r2r)))
+        ]
+    )
+    state = "".join(
+        [
+            (state_r2k[i : 1 + i] or UNUSED_R2R) + (prefix[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(state_r2k), len(prefix)))
+        ]
+    )
+    obuf = "".join(
+        [
+            (obuf_r2k[i : 1 + i] or UNUSED_R2R) + (obuf_r2r[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(obuf_r2k), len(obuf_r2r)))
+        ]
+    )
+    flags = flags_r2k | (flags_r2r << 8)
+    return ch, ibuf, state, obuf, flags
+
+
+import functools
+
+
+def r2hs(s, r2h=r2h, form="halfwidth", alignment=None):
+    """
+    convert romaji in the input string to halfwidth katakana. see `r2h()` for a list of supported conversions
+
+    r2h is a conversion engine, or the name of one for `get_engine()`.
+
+    form is one of `OUTPUT_FORMS`, and selects halfwidth katakana, fullwidth katakana, or hiragana output.
+
+    alignment is an optional `array.array("I")` (or list), which is extended with one input offset for each output character: the end of the romaji which produced it, so output character k came from `s[alignment[k - 1]:alignment[k]]`, taking `alignment[-1]` as 0. the offsets are recorded during the conversion, after each output character, as the input read so far less the romaji still pending in ibuf and state, so input retried from ibuf, rewritten by `r2r_step()`, or erased by backspace is attributed to the output it ends up in; the offsets never decrease, and characters produced together (like `ｷｬ` from `kya`) share the span of the first. a kana held back by `r2h_output_form()` keeps the offset from when the underlying engine produced it.
+
+    the input is read by position rather than by slicing off each character, so the total work is linear in the length of s whatever it contains: the engines only ever retry a bounded number of characters (see `r2h_buffer_bounds()`), so each input character costs a bounded number of steps.
+    """
+    if isinstance(r2h, str):
+        r2h = get_engine(r2h)
+    if alignment is not None:
+        ends = [0, 0]  # offsets after the last two outputs of the underlying engine
+
+        def aligned(*, ibuf, state, obuf, flags, getch, r2h=r2h):
+            ch, ibuf, state, obuf, flags = r2h(
+                ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+            )
+            pending = len(ibuf) + len(state) - (ibuf + state).count(UNUSED_R2R)
+            ends[:] = ends[1], max(ends[1], min(position, len(s)) - pending)
+            return ch, ibuf, state, obuf, flags
+
+        r2h = aligned
+
+    if form != "halfwidth":
+        r2h = functools.partial(r2h_output_form, form=form, r2h=r2h)
+    o = []
+    position = 0
+
+    def getch():
+        nonlocal position
+        ch = s[position : 1 + position]
+        position += 1
+        return ch
+
+    ibuf, state, obuf, flags = "", "", "", 0
+    while True:
+        ch, ibuf, state, obuf, flags = r2h(
+            ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+        )
+        if ch == "":
+            break
+        o += [ch]
+        if alignment is not None:  # a kana held back by r2h_output_form() is the later of the two
+            alignment.append(ends[0] if flags >> R2H_OUTPUT_FORM_SHIFT else ends[1])
+    return "".join(o)
+
+
+import hashlib
+import marshal
+import mmap
+import os
+import sys
+
+R2H_COMPILED_PROBES = [chr(cc) for cc in range(0x80)] + [""]
+R2H_COMPILED_OTHER_PROBES = (  # stand-ins for all the characters with no special meaning in romaji
+    "\x80",
+    "\x81",
+)
+
+
+def casings(s):
+    """
+    all the upper/lower case variants of s
+    """
+    variants = [""]
+    for c in s:
+        variants = [variant + cc for variant in variants for cc in sorted({c, c.upper()})]
+    return variants
+
+
+def r2r_action(lprefix, chs):
+    """
+    derive the compiled form of `r2r_step()` for all casings of lprefix and each input character in chs
+
+    - lprefix is a lowercase romaji-to-romaji prefix.
+    - chs is a pair of input characters which are handled alike, differing only where the input character is copied into the results.
+
+    the return values are literal, lower_templates, upper_templates.
+    - literal is the result of `r2r_step(lprefix, chs[0])`, or None when chs[0] only stands in for other characters.
+    - lower_templates are `str.format` templates (with fields p for prefix and c for ch) for the results when prefix is lowercase.
+    - upper_templates are `str.format` templates (with fields p for prefix and c for ch) for the results when prefix contains uppercase.
+    """
+    letters = [i for i, c in enumerate(lprefix) if c != c.upper()]
+
+    def derive(prefix, letters):
+        results = r2r_step(prefix, chs[0])
+        templates = [
+            [c.replace("{", "{{").replace("}", "}}") for c in result]
+            for result in results
+        ]
+        variants = [(r2r_step(prefix, chs[1]), lambda c, cv: c != cv, "{c}")]
+        for i in letters:
+            if len(letters) > 1:
+                # lowercasing just one letter leaves the rest of the prefix uppercase
+                variants += [
+                    (
+                        r2r_step(prefix[:i] + lprefix[i] + prefix[1 + i :], chs[0]),
+                        lambda c, cv: c != cv,
+                        "{p[%d]}" % i,
                     )
-                )
-                and (lch == "u")
-            ):
-                obuf_r2r = onset_e_r + small_r + prefix[2:] + ch
-                prefix = ""
-                continue
-            elif (lprefix == "n") and (lch in ("n", "'")):
-                obuf_r2r = onset_r + "'"
-                prefix = ""
-                continue
-            elif (lprefix == "n") and (
-                (not ch) or ((lch not in AIUEO_R_SET) and (lch not in ("n", "'")))
-            ):
-                obuf_r2r = onset_r + "'"
-                prefix = ""
-                ibuf_r2r = ch + ibuf_r2r
-                continue
-            elif (
-                ((lprefix == "y") and (lch == "i"))
-                or ((lprefix == "w") and (lch == "u"))
-                or ((lprefix == "wh") and (lch == "u"))
-            ):
-                obuf_r2r = ch
-                prefix = ""
-                continue
-            elif (lprefix == "y") and (lch == "e"):
-                obuf_r2r = cased("i") + small_r + ch
-                prefix = ""
-                continue
-            elif (lprefix == "w") and (lch in ("i", "e")):
-                obuf_r2r = cased("u") + small_r + ch
-                prefix = ""
+                ]
+            else:
+                # lowercasing the only letter also lowercases the constants, so compare values instead
+                variants += [
+                    (
+                        r2r_step(lprefix, chs[0]),
+                        lambda c, cv, i=i: (c, cv) == (prefix[i], lprefix[i]),
+                        "{p[%d]}" % i,
+                    )
+                ]
+        for variant, differs, field in variants:
+            for result, result_variant, template in zip(results, variant, templates):
+                assert len(result) == len(result_variant)
+                for j, (c, cv) in enumerate(zip(result, result_variant)):
+                    if template[j] != "{c}" and differs(c, cv):
+                        template[j] = field
+        return tuple("".join(template) for template in templates)
+
+    lower_templates = derive(lprefix, [])
+    upper_templates = derive(lprefix.upper(), letters) if letters else lower_templates
+    literal = None if chs[0] in R2H_COMPILED_OTHER_PROBES else r2r_step(lprefix, chs[0])
+    return literal, lower_templates, upper_templates
+
+
+def r2r_render(action, prefix, ch):
+    """
+    apply an action from `r2r_action()`, returning the same results as `r2r_step(prefix, ch)`
+    """
+    lprefix, lch = prefix.lower(), ch.lower()
+    if (action[0] is not None) and (prefix == lprefix) and (ch == lch):
+        return action[0]
+    return tuple(
+        template.format(p=prefix, c=ch)
+        for template in action[2 if (prefix != lprefix) else 1]
+    )
+
+
+def r2h_compiled_tables():
+    """
+    flatten `r2r_step()` and the 1:1 romaji in `ALL_1_1_STARTS_R` into per-state dispatch dicts
+
+    the return values are r2r_table, r2k_table.
+    - r2r_table maps each reachable lowercase romaji-to-romaji prefix to actions, default. actions maps lowercase input characters to actions from `r2r_action()`, and default is the action for all other input characters.
+    - r2k_table maps each reachable lowercase romaji-to-kana state to a dict from lowercase input characters to kana, or to "" where the state is only extended.
+
+    every action is checked against `r2r_step()` for all casings of the prefix and input character.
+    """
+    r2r_table = {}
+    pending = [""]
+    while pending:
+        lprefix = pending.pop()
+        if lprefix in r2r_table:
+            continue
+        prefixes = casings(lprefix)
+        default = r2r_action(lprefix, R2H_COMPILED_OTHER_PROBES)
+        for prefix in prefixes:
+            for ch in R2H_COMPILED_OTHER_PROBES + ("ﾌ", "Ā", "İ"):
+                assert r2r_render(default, prefix, ch) == r2r_step(
+                    prefix, ch
+                ), f"r2h_compiled_tables: {repr(prefix)}, {repr(ch)} compiled incorrectly"
+        actions = {}
+        for lch in R2H_COMPILED_PROBES:
+            if not (lprefix or lch):
                 continue
-            if prefix:
-                # print(f"r2r fallback!!! {dict(prefix=prefix, ch=ch)}")
-                obuf_r2r = prefix[:1]
-                ibuf_r2r = prefix[1:] + ch + ibuf_r2r
-                prefix = ""
+            chs = (lch, lch.upper())
+            action = r2r_action(lprefix, chs)
+            is_default = bool(lprefix)
+            for prefix in prefixes:
+                for ch in chs + (("K",) if lch == "k" else ()):  # KELVIN SIGN lowercases to k
+                    expected = r2r_step(prefix, ch)
+                    assert (
+                        r2r_render(action, prefix, ch) == expected
+                    ), f"r2h_compiled_tables: {repr(prefix)}, {repr(ch)} compiled incorrectly"
+                    is_default = is_default and (
+                        r2r_render(default, prefix, ch) == expected
+                    )
+                    pending += [expected[0].lower()]
+            if not is_default:
+                actions[lch] = action
+        r2r_table[lprefix] = (actions, default)
+    r2k_table = {}
+    all_1_1_r = expand_1_1_starts(*ALL_1_1_STARTS_R)
+    for romaji in all_1_1_r:
+        for i in range(len(romaji)):
+            r2k_table.setdefault(romaji[:i], {}).setdefault(romaji[i], "")
+    for i, romaji in enumerate(all_1_1_r):
+        r2k_table[romaji[:-1]][romaji[-1]] = ALL_K[i]
+    return r2r_table, r2k_table
+
+
+def r2h_compiled_source():
+    """
+    generate Python source for `r2h_compiled()`, a version of `r2h()` specialized for the current rule tables
+    """
+    r2r_table, r2k_table = r2h_compiled_tables()
+    action_names = {}
+    lines = ["# generated by r2h.py from its rule tables, do not edit", ""]
+
+    def action_name(action):
+        if action not in action_names:
+            action_names[action] = f"A{len(action_names)}"
+            lines.append(f"{action_names[action]} = {repr(action)}")
+        return action_names[action]
+
+    r2r_lines = ["R2R = {"]
+    for lprefix, (actions, default) in sorted(r2r_table.items()):
+        r2r_lines += [f"    {repr(lprefix)}: ("]
+        r2r_lines += ["        {"]
+        r2r_lines += [
+            f"            {repr(lch)}: {action_name(action)},"
+            for lch, action in actions.items()
+        ]
+        r2r_lines += ["        },"]
+        r2r_lines += [f"        {action_name(default)},"]
+        r2r_lines += ["    ),"]
+    r2r_lines += ["}"]
+    r2k_lines = ["R2K = {"]
+    r2k_lines += [
+        f"    {repr(lstate)}: {repr(kana)}," for lstate, kana in sorted(r2k_table.items())
+    ]
+    r2k_lines += ["}"]
+    lines += [""] + r2r_lines + [""] + r2k_lines
+    lines += ["", "R2H_COMPILED_TABLES = R2R, R2K  # read once per call, so replacing this replaces both at once"]
+    return "\n".join(lines) + f'''
+
+
+def r2h_compiled(*, ibuf, state, obuf, flags, getch):
+    """
+    convert romaji to halfwidth katakana
+    [generated from the rule tables by `r2h_compiled_source()`; see `r2h()` for the arguments and supported inputs]
+    """
+    ibuf_r2k, ibuf_r2r = ibuf[::2].rstrip({repr(UNUSED_R2R)}), ibuf[1::2].rstrip({repr(UNUSED_R2R)})
+    state_r2k, prefix = state[::2].rstrip({repr(UNUSED_R2R)}), state[1::2].rstrip({repr(UNUSED_R2R)})
+    obuf_r2k, obuf_r2r = obuf[::2].rstrip({repr(UNUSED_R2R)}), obuf[1::2].rstrip({repr(UNUSED_R2R)})
+    flags_r2k, flags_r2r = flags & 0xFF, flags >> 8
+    r2r_table, r2k_table = R2H_COMPILED_TABLES
+    while True:
+        if obuf_r2k:
+            ch, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+        else:
+            if ibuf_r2k:
+                ch, ibuf_r2k = ibuf_r2k[:1], ibuf_r2k[1:]
+            else:
+                while True:
+                    if obuf_r2r:
+                        ch, obuf_r2r = obuf_r2r[:1], obuf_r2r[1:]
+                        break
+                    if ibuf_r2r:
+                        ch, ibuf_r2r = ibuf_r2r[:1], ibuf_r2r[1:]
+                    else:
+                        ch = getch()
+                    if not (prefix or ch):
+                        break
+                    lprefix, lch = prefix.lower(), ch.lower()
+                    actions, action = r2r_table[lprefix]
+                    action = actions.get(lch, action)
+                    if (prefix == lprefix) and (ch == lch) and (action[0] is not None):
+                        prefix, obuf_r2r, retry = action[0]
+                    else:
+                        prefix, obuf_r2r, retry = [
+                            template.format(p=prefix, c=ch)
+                            for template in action[2 if (prefix != lprefix) else 1]
+                        ]
+                    if retry:
+                        ibuf_r2r = retry + ibuf_r2r
+            if ch in ({repr(BACKSPACE_A)}, {repr(RUBOUT_A)}):
+                if state_r2k:
+                    state_r2k = state_r2k[:-1]
+                    continue
+                flags_r2k = (flags_r2k & 0x7F) << 1
+                break
+            lstate = state_r2k.lower()
+            kana = r2k_table[lstate].get(ch.lower())
+            if kana:
+                ch, state_r2k = kana, ""
+            elif kana is not None:
+                state_r2k += ch
                 continue
-            break
-        return ch
+            elif (lstate == "z") and (ch == {repr(MIDDOT_A)}):
+                ch, state_r2k = {repr(MIDDOT_K)}, ""
+            elif (lstate == "z") and (ch == {repr(HYPHEN_MINUS_A)}):
+                flags_r2k &= 0x7F
+                state_r2k = ""
+            elif (ch == {repr(HYPHEN_MINUS_A)}) and (flags_r2k & 0x80):
+                ch = {repr(CHOUONPU_K)}
+            if state_r2k:
+                obuf_r2k += state_r2k[:1]
+                ibuf_r2k += state_r2k[1:] + ch
+                state_r2k = ""
+                ch, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+        if ch and (ch < " ") and (ch != {repr(BACKSPACE_A)}):
+            flags_r2k = 0
+        else:
+            flags_r2k = (0x80 if (ch and (ch in {repr(ALL_K)})) else 0) | (flags_r2k >> 1)
+        break
+    ibuf = "".join(
+        [
+            (ibuf_r2k[i : 1 + i] or {repr(UNUSED_R2R)}) + (ibuf_r2r[i : 1 + i] or {repr(UNUSED_R2R)})
+            for i in range(max(len(ibuf_r2k), len(ibuf_r2r)))
+        ]
+    )
+    state = "".join(
+        [
+            (state_r2k[i : 1 + i] or {repr(UNUSED_R2R)}) + (prefix[i : 1 + i] or {repr(UNUSED_R2R)})
+            for i in range(max(len(state_r2k), len(prefix)))
+        ]
+    )
+    obuf = "".join(
+        [
+            (obuf_r2k[i : 1 + i] or {repr(UNUSED_R2R)}) + (obuf_r2r[i : 1 + i] or {repr(UNUSED_R2R)})
+            for i in range(max(len(obuf_r2k), len(obuf_r2r)))
+        ]
+    )
+    flags = flags_r2k | (flags_r2r << 8)
+    return ch, ibuf, state, obuf, flags
+'''
+
+
+def fingerprint(h, value):
+    """
+    feed a stable representation of value into the hash h, following code objects and ignoring set ordering
+    """
+    if isinstance(value, type(fingerprint.__code__)):
+        h.update(value.co_code)
+        fingerprint(h, value.co_names)
+        fingerprint(h, value.co_consts)
+    elif isinstance(value, (set, frozenset)):
+        fingerprint(h, sorted(value, key=repr))
+    elif isinstance(value, dict):
+        fingerprint(h, sorted(value.items(), key=repr))
+    elif isinstance(value, type):  # the repr would depend on whether this is run as __main__
+        fingerprint(h, value.__qualname__)
+    elif isinstance(value, functools.partial):
+        fingerprint(h, (value.func, value.args, value.keywords))
+    elif hasattr(value, "__code__"):  # the repr of a function includes its address
+        fingerprint(h, (value.__qualname__, value.__code__))
+    elif hasattr(value, "__wrapped__"):  # for example `functools.cache()`
+        fingerprint(h, value.__wrapped__)
+    elif isinstance(value, (list, tuple)):
+        h.update(b"(")
+        for item in value:
+            fingerprint(h, item)
+        h.update(b")")
+    else:
+        h.update(repr(value).encode())
+
+
+def r2h_source_digest():
+    """
+    hex SHA-256 of the Python version and the source of this module
+    """
+    h = hashlib.sha256(sys.version.encode())
+    h.update(__loader__.get_data(__file__))
+    return h.hexdigest()
+
+
+R2H_SOURCE_DIGEST = r2h_source_digest()
+
+
+def r2h_cache_digest():
+    """
+    key of the files cached from the rule tables: `R2H_SOURCE_DIGEST`, together with the rules added by `register_rules()`
+
+    like the source hashes `py_compile` can key bytecode with, this is cheap to compute at import, and any change to this module regenerates the cached files.
+    """
+    added = R2R_EXTENSION_RULES[0]
+    if not added:
+        return R2H_SOURCE_DIGEST
+    h = hashlib.sha256(R2H_SOURCE_DIGEST.encode())
+    h.update(repr(sorted(added.items())).encode())
+    return h.hexdigest()
+
+
+def r2h_cache_dirs():
+    """
+    directories where files are cached, in order of preference: `__pycache__` next to this module, then `r2h` in the user's cache directory, for installs where `__pycache__` cannot be written
+    """
+    user_cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return [
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__"),
+        os.path.join(user_cache, "r2h"),
+    ]
+
+
+def r2h_cache_path(kind, digest, suffix):
+    """
+    path of a cached file: where it already exists in one of `r2h_cache_dirs()`, or else in the first of them which can be written, or else in `__pycache__`, where it can be neither read nor written
+    """
+    cache_name = f"{kind}-{digest}{suffix}"
+    cache_dirs = r2h_cache_dirs()
+    for cache_dir in cache_dirs:
+        if os.path.exists(os.path.join(cache_dir, cache_name)):
+            return os.path.join(cache_dir, cache_name)
+    for cache_dir in cache_dirs:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(cache_dir, os.W_OK):
+            return os.path.join(cache_dir, cache_name)
+    return os.path.join(cache_dirs[0], cache_name)
+
+
+R2H_CACHE_MAGIC = b"R2HC"
+R2H_CACHE_HEADER_SIZE = 68  # magic, the digest the file is named for, and the SHA-256 of the contents following the header
+
+
+def read_r2h_cache(cache_path):
+    """
+    the contents of a file cached by `write_r2h_cache()`, as a read-only memoryview of its memory-mapped pages, or None when it is missing or fails its integrity check
+
+    the header must hold the digest in the name of the file and the SHA-256 of the contents, so a file which is truncated, corrupted, or copied to another name is never loaded.
+    """
+    digest = os.path.basename(cache_path).split("-", 1)[1].split(".", 1)[0]
+    try:
+        with open(cache_path, "rb") as cache:
+            data = memoryview(mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):  # mmap raises ValueError for an empty file
+        return None
+    contents = data[R2H_CACHE_HEADER_SIZE:]
+    if data[:R2H_CACHE_HEADER_SIZE] != (
+        R2H_CACHE_MAGIC + bytes.fromhex(digest) + hashlib.sha256(contents).digest()
+    ):
+        return None
+    return contents
+
+
+R2H_CACHE_KEEP = 8  # versions of each kind of cached file kept, so that processes using different rules do not evict each other
+
+
+def write_r2h_cache(cache_path, data):
+    """
+    atomically replace a cached file, with a header for `read_r2h_cache()`, removing all but the `R2H_CACHE_KEEP` most recently written versions of it; failures are ignored since the cache is only an optimization
+    """
+    cache_dir, cache_name = os.path.split(cache_path)
+    kind, digest = cache_name.split(".", 1)[0].split("-", 1)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f"{cache_path}.{os.getpid()}", "wb") as cache:
+            cache.write(R2H_CACHE_MAGIC + bytes.fromhex(digest) + hashlib.sha256(data).digest())
+            cache.write(data)
+        os.replace(f"{cache_path}.{os.getpid()}", cache_path)
+        versions = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.startswith(f"{kind}-"):
+                try:
+                    versions.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        for _, path in sorted(versions, reverse=True)[R2H_CACHE_KEEP:]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+R2H_CACHE_UNCHECKED = {}  # files generated at import, written once `smoketest()` has checked the engines using them; None afterwards
+
+
+def cache_r2h_generated(cache_path, data):
+    """
+    cache a file generated from the rule tables with `write_r2h_cache()`, or at import hold it back in `R2H_CACHE_UNCHECKED` until `smoketest()` has passed
+    """
+    if R2H_CACHE_UNCHECKED is None:
+        write_r2h_cache(cache_path, data)
+    else:
+        R2H_CACHE_UNCHECKED[cache_path] = data
+
+
+R2H_SHARED_ENV = "R2H_SHARED_TABLES"
+R2H_SHARED_MAGIC = b"R2HS"
+R2H_SHARED_HEADER_SIZE = 16  # magic, index offset, index size, padding
+R2H_SHARED_CHECK = "kon'nichiha, sekai. kyakka t'yu nn Ra-men\b\bxtsu z;wo [vu]"  # converted by workers with the attached tables
+
+
+def attach_r2h_shared():
+    """
+    attach to the cached files published by a parent process with `share_r2h_tables()`, if the `R2H_SHARED_TABLES` environment variable names them and this is a worker it started
+
+    workers must be started from the publishing process with `multiprocessing`, using the spawn start method (forked workers inherit the tables anyway). the variable also names the publishing process, and other processes it starts ignore it, so they load the tables and run `smoketest()` as usual.
+    the return value maps cache file names (which include the digests of the rule tables and code they were derived from) to read-only memoryviews of their contents in shared memory; it is empty when nothing usable was published.
+    """
+    name, _, publisher = os.environ.get(R2H_SHARED_ENV, "").partition(":")
+    if not (
+        name
+        and (publisher == str(os.getppid()))
+        and ("multiprocessing.spawn" in sys.modules)  # imported by spawned workers before anything else
+    ):
+        return {}
+    from multiprocessing import shared_memory  # only needed by workers
+
+    try:
+        try:
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # before Python 3.13, workers share the publishing process's resource tracker instead
+            segment = shared_memory.SharedMemory(name=name)
+    except (OSError, ValueError):
+        return {}
+    view = segment.buf.toreadonly()
+    if bytes(view[:4]) != R2H_SHARED_MAGIC:
+        return {}
+    index_offset, index_size = [
+        int.from_bytes(view[i : 4 + i], "little") for i in (4, 8)
+    ]
+    index = marshal.loads(view[index_offset : index_offset + index_size])
+    R2H_SHARED_SEGMENTS.append(segment)  # keep the mapping alive
+    return {
+        cache_name: view[offset : offset + size]
+        for cache_name, (offset, size) in index.items()
+    }
+
+
+def r2h_shared_cache(cache_path):
+    """
+    the contents of a cached file as published by `share_r2h_tables()`, or None
+    """
+    cache_name = os.path.basename(cache_path)
+    if cache_name in R2H_SHARED:
+        R2H_SHARED_USED.add(cache_name)
+    return R2H_SHARED.get(cache_name)
+
+
+R2H_SHARED_SEGMENTS = []
+R2H_SHARED_USED = set()
+R2H_SHARED = attach_r2h_shared()
+
+
+def r2h_compiled_code():
+    """
+    bytecode defining `r2h_compiled()`, cached (see `r2h_cache_path()`) and regenerated whenever this module or the added rules change
+    """
+    cache_path = r2h_cache_path("r2h_compiled", r2h_cache_digest(), ".marshal")
+    shared = r2h_shared_cache(cache_path)
+    if shared is not None:
+        return marshal.loads(shared)
+    cached = read_r2h_cache(cache_path)
+    if cached is not None:
+        return marshal.loads(cached)
+    code = compile(r2h_compiled_source(), "<r2h_compiled>", "exec")
+    cache_r2h_generated(cache_path, marshal.dumps(code))
+    return code
+
+
+def load_r2h_compiled(code):
+    """
+    define `r2h_compiled()` from its bytecode, see `r2h_compiled_code()`
+    """
+    namespace = {}
+    exec(code, namespace)
+    return namespace["r2h_compiled"]
+
+
+R2H_COMPILED_CODE = r2h_compiled_code()
+r2h_compiled = load_r2h_compiled(R2H_COMPILED_CODE)
+
+
+def r2h_buffer_bounds():
+    """
+    the longest ibuf, state, and obuf which `r2h()` or any engine derived from its rule tables can return, whatever the input
+
+    between calls only unconverted romaji and not yet returned output are carried over, and neither can accumulate:
+    - each romaji-to-romaji step consumes one character, and the prefix plus any retried characters it leaves are never longer than the prefix it started from plus that character, which this checks for every rule.
+    - a failed romaji-to-kana conversion returns its first character and retries the rest, so the retried characters plus the state are never longer than the longest state plus one character.
+    - new characters are only read once all retried characters have been consumed, and new romaji-to-romaji output is only produced once the previous output has been consumed.
+
+    the bounds are for the packed strings, which hold two characters for each position of the longer of the romaji-to-kana and romaji-to-romaji parts.
+    """
+    r2r_table, r2k_table = r2h_compiled.__globals__["R2H_COMPILED_TABLES"]
+    longest_state = max(max(map(len, r2r_table)), max(map(len, r2k_table)))
+    longest_out = 1
+    for lprefix, (actions, default) in r2r_table.items():
+        for action in [*actions.values(), default]:
+            prefix, out, retry = [
+                template.format(p=lprefix, c="?") for template in action[1]
+            ]
+            assert len(prefix) + len(retry) <= len(lprefix) + 1, (
+                f"r2h_buffer_bounds: rule for {repr(lprefix)} retries more than it consumes"
+            )
+            longest_out = max(longest_out, len(out))
+    return 2 * (longest_state + 1), 2 * longest_state, 2 * longest_out
+
+
+R2H_MAX_IBUF, R2H_MAX_STATE, R2H_MAX_OBUF = r2h_buffer_bounds()
+
+
+import array
+import struct
+import unicodedata
+
+R2H_TABLE_MAGIC = b"R2HT"
+R2H_TABLE_HEADER = "<4sH12I"  # magic, byte order mark, 5 counts, 7 section offsets
+R2H_TABLE_NONE = 0xFFFF  # marks a missing string or transition in the packed tables
+R2H_TABLE_ACTION_SIZE = 10  # next state, then literal, lower template, upper template string ids for prefix, out, retry
+
+
+def r2h_table_bytes():
+    """
+    pack the compiled rule tables into flat `array("H")` transition and output tables indexed by (state, input class)
+
+    input characters are lowercased and then grouped into input classes: each ASCII character is mapped through a class map, all other characters share one class, and the end of input (EOF) has its own class.
+
+    sections:
+    - class map: 130 bytes mapping lowercase ASCII to input class, then the input classes for all other characters and for EOF.
+    - r2r transitions: action id for each (romaji-to-romaji state, input class).
+    - r2r actions: `R2H_TABLE_ACTION_SIZE` entries per action; see `r2r_action()` for the strings.
+    - r2k transitions: for each (romaji-to-kana state, input class), kana code point, next state id (below 0x8000) when the state is only extended, or `R2H_TABLE_NONE`.
+    - state names: string ids of the lowercase r2r states, then of the r2k states.
+    - strings: offsets into UTF-8 string data.
+    """
+    r2r_table, r2k_table = r2h_compiled_tables()
+    r2r_states = sorted(r2r_table)
+    r2k_states = sorted(r2k_table)
+    assert r2r_states[0] == r2k_states[0] == ""
+    assert len(r2k_states) < 0x8000
+    strings = {}
+
+    def string_id(s):
+        if s is None:
+            return R2H_TABLE_NONE
+        return strings.setdefault(s, len(strings))
+
+    probes = [chr(cc).lower() for cc in range(0x80)] + [
+        R2H_COMPILED_OTHER_PROBES[0],
+        "",
+    ]
+    actions = {}
+    columns = []
+    for ch in probes:
+        column = []
+        for lprefix in r2r_states:
+            prefix_actions, default = r2r_table[lprefix]
+            action = default if ch in R2H_COMPILED_OTHER_PROBES else prefix_actions.get(ch, default)
+            if not (lprefix or ch):
+                action, next_state = (None, ("", "", ""), ("", "", "")), 0
+            else:
+                next_state = r2r_states.index(r2r_step(lprefix, ch)[0].lower())
+            column += [actions.setdefault((next_state, action), len(actions))]
+        for lstate in r2k_states:
+            kana = r2k_table[lstate].get(ch)
+            if kana is None:
+                column += [R2H_TABLE_NONE]
+            elif kana:
+                column += [ord(kana)]
+            else:
+                column += [r2k_states.index(lstate + ch)]
+        columns += [tuple(column)]
+    classes = {}
+    class_map = bytes(classes.setdefault(column, len(classes)) for column in columns)
+    n_classes = len(classes)
+    assert n_classes < 0x100
+    class_columns = sorted(classes, key=classes.get)
+    r2r_transitions = array.array(
+        "H",
+        [
+            class_columns[input_class][i]
+            for i in range(len(r2r_states))
+            for input_class in range(n_classes)
+        ],
+    )
+    r2k_transitions = array.array(
+        "H",
+        [
+            class_columns[input_class][len(r2r_states) + i]
+            for i in range(len(r2k_states))
+            for input_class in range(n_classes)
+        ],
+    )
+    r2r_actions = array.array("H")
+    for (next_state, (literal, lower_templates, upper_templates)), _ in sorted(
+        actions.items(), key=lambda item: item[1]
+    ):
+        r2r_actions += array.array(
+            "H",
+            [next_state]
+            + [string_id(s) for s in (literal or (None, None, None))]
+            + [string_id(s) for s in lower_templates]
+            + [string_id(s) for s in upper_templates],
+        )
+    state_names = array.array("H", [string_id(s) for s in r2r_states + r2k_states])
+    string_data = b""
+    string_offsets = array.array("I", [0])
+    for s in sorted(strings, key=strings.get):
+        string_data += s.encode("utf-8")
+        string_offsets += array.array("I", [len(string_data)])
+    sections = [
+        class_map,
+        r2r_transitions.tobytes(),
+        r2r_actions.tobytes(),
+        r2k_transitions.tobytes(),
+        state_names.tobytes(),
+        string_offsets.tobytes(),
+        string_data,
+    ]
+    data = b""
+    offsets = []
+    for section in sections:
+        data += b"\0" * (-(struct.calcsize(R2H_TABLE_HEADER) + len(data)) % 4)
+        offsets += [struct.calcsize(R2H_TABLE_HEADER) + len(data)]
+        data += section
+    return (
+        struct.pack(
+            R2H_TABLE_HEADER,
+            R2H_TABLE_MAGIC,
+            0xFEFF,
+            n_classes,
+            len(r2r_states),
+            len(r2k_states),
+            len(actions),
+            len(strings),
+            *offsets,
+        )
+        + data
+    )
+
+
+def r2h_table_data():
+    """
+    the packed rule tables from `r2h_table_bytes()`, memory-mapped read-only from the cache (see `r2h_cache_path()`) so that the pages are shared by every process using them
+    """
+    cache_path = r2h_cache_path("r2h_tables", r2h_cache_digest(), ".bin")
+    shared = r2h_shared_cache(cache_path)
+    if shared is not None:
+        return shared
+    table = read_r2h_cache(cache_path)
+    if (table is None) or (
+        struct.unpack_from(R2H_TABLE_HEADER, table)[:2] != (R2H_TABLE_MAGIC, 0xFEFF)
+    ):  # tables written on a machine with the other byte order
+        table = r2h_table_bytes()
+        cache_r2h_generated(cache_path, table)
+    return table
+
+
+def load_r2h_tables(table):
+    """
+    decode the packed rule tables from `r2h_table_data()`
+
+    the return values are class_map, r2r_transitions, r2r_actions, r2k_transitions, strings, r2r_state_ids, r2k_state_ids, n_classes.
+    - class_map, r2r_transitions, r2r_actions, and r2k_transitions are read-only memoryviews into table; see `r2h_table_bytes()` for their layout.
+    - strings, r2r_state_ids, and r2k_state_ids are small per-process tuples/dicts decoded from table.
+    """
+    _, _, n_classes, n_r2r_states, n_r2k_states, n_actions, n_strings, *offsets = (
+        struct.unpack_from(R2H_TABLE_HEADER, table)
+    )
+    view = memoryview(table)
+    sizes = [
+        0x82,
+        2 * n_r2r_states * n_classes,
+        2 * n_actions * R2H_TABLE_ACTION_SIZE,
+        2 * n_r2k_states * n_classes,
+        2 * (n_r2r_states + n_r2k_states),
+        4 * (1 + n_strings),
+    ]
+    (
+        class_map,
+        r2r_transitions,
+        r2r_actions,
+        r2k_transitions,
+        state_names,
+        string_offsets,
+    ) = [view[offset : offset + size] for offset, size in zip(offsets, sizes)]
+    r2r_transitions, r2r_actions, r2k_transitions, state_names = [
+        section.cast("H")
+        for section in (r2r_transitions, r2r_actions, r2k_transitions, state_names)
+    ]
+    string_offsets = string_offsets.cast("I")
+    strings = tuple(
+        bytes(
+            view[offsets[6] + string_offsets[i] : offsets[6] + string_offsets[1 + i]]
+        ).decode("utf-8")
+        for i in range(n_strings)
+    )
+    r2r_state_ids = {strings[state_names[i]]: i for i in range(n_r2r_states)}
+    r2k_state_ids = {
+        strings[state_names[n_r2r_states + i]]: i for i in range(n_r2k_states)
+    }
+    return (
+        class_map,
+        r2r_transitions,
+        r2r_actions,
+        r2k_transitions,
+        strings,
+        r2r_state_ids,
+        r2k_state_ids,
+        n_classes,
+    )
+
+
+R2H_TABLE_DATA = r2h_table_data()
+R2H_TABLES = load_r2h_tables(R2H_TABLE_DATA)
+
+
+def share_r2h_tables():
+    """
+    publish the compiled conversion tables through shared memory to worker processes started afterwards, returning the `multiprocessing.shared_memory.SharedMemory` segment
+
+    workers importing this module attach to the published tables instead of loading or rebuilding them, and skip `smoketest()`, which the publishing process has already passed, converting only `R2H_SHARED_CHECK` to check the tables, so they start several times faster. this only saves start-up time: the tables are a few dozen KiB, memory-mapped from the cache and so shared anyway, and a worker's memory is the interpreter and this module's own objects, which are the same either way.
+    the segment and this process are named in the `R2H_SHARED_TABLES` environment variable inherited by the workers, which `attach_r2h_shared()` only honours in workers spawned by this process; pass the segment to `unshare_r2h_tables()` once no more workers will start.
+    """
+    from multiprocessing import shared_memory  # only needed when publishing
+
+    sections = {
+        os.path.basename(
+            r2h_cache_path("r2h_compiled", r2h_cache_digest(), ".marshal")
+        ): marshal.dumps(R2H_COMPILED_CODE),
+        os.path.basename(
+            r2h_cache_path("r2h_tables", r2h_cache_digest(), ".bin")
+        ): memoryview(R2H_TABLE_DATA),
+    }
+    index, offset = {}, R2H_SHARED_HEADER_SIZE
+    for cache_name, data in sections.items():
+        index[cache_name] = (offset, len(data))
+        offset = -(-(offset + len(data)) // 8) * 8
+    index_bytes = marshal.dumps(index)
+    segment = shared_memory.SharedMemory(create=True, size=offset + len(index_bytes))
+    segment.buf[:12] = (
+        R2H_SHARED_MAGIC
+        + offset.to_bytes(4, "little")
+        + len(index_bytes).to_bytes(4, "little")
+    )
+    for cache_name, data in sections.items():
+        start, size = index[cache_name]
+        segment.buf[start : start + size] = data
+    segment.buf[offset : offset + len(index_bytes)] = index_bytes
+    os.environ[R2H_SHARED_ENV] = f"{segment.name}:{os.getpid()}"
+    return segment
+
+
+def unshare_r2h_tables(segment):
+    """
+    stop publishing tables from `share_r2h_tables()`; workers which already attached keep their mappings
+    """
+    if os.environ.get(R2H_SHARED_ENV) == f"{segment.name}:{os.getpid()}":
+        del os.environ[R2H_SHARED_ENV]
+    segment.close()
+    segment.unlink()
+
+
+def r2h_table(*, ibuf, state, obuf, flags, getch):
+    """
+    convert romaji to halfwidth katakana
+    [runs directly on the shared memory-mapped tables from `load_r2h_tables()`; see `r2h()` for the arguments and supported inputs]
+    """
+    (
+        class_map,
+        r2r_transitions,
+        r2r_actions,
+        r2k_transitions,
+        strings,
+        r2r_state_ids,
+        r2k_state_ids,
+        n_classes,
+    ) = R2H_TABLES
+    ibuf_r2k, ibuf_r2r = ibuf[::2].rstrip(UNUSED_R2R), ibuf[1::2].rstrip(UNUSED_R2R)
+    state_r2k, prefix = state[::2].rstrip(UNUSED_R2R), state[1::2].rstrip(UNUSED_R2R)
+    obuf_r2k, obuf_r2r = obuf[::2].rstrip(UNUSED_R2R), obuf[1::2].rstrip(UNUSED_R2R)
+    flags_r2k, flags_r2r = flags & 0xFF, flags >> 8
+    r2r_state = r2r_state_ids[prefix.lower()]
+    r2k_state = r2k_state_ids[state_r2k.lower()]
+    while True:
+        if obuf_r2k:
+            ch, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+        else:
+            if ibuf_r2k:
+                ch, ibuf_r2k = ibuf_r2k[:1], ibuf_r2k[1:]
+            else:
+                while True:
+                    if obuf_r2r:
+                        ch, obuf_r2r = obuf_r2r[:1], obuf_r2r[1:]
+                        break
+                    if ibuf_r2r:
+                        ch, ibuf_r2r = ibuf_r2r[:1], ibuf_r2r[1:]
+                    else:
+                        ch = getch()
+                    if not (prefix or ch):
+                        break
+                    lch = ch.lower()
+                    if len(lch) != 1:
+                        input_class = class_map[0x80 if lch else 0x81]
+                    else:
+                        input_class = class_map[ord(lch) if (lch < "\x80") else 0x80]
+                    action = R2H_TABLE_ACTION_SIZE * r2r_transitions[
+                        r2r_state * n_classes + input_class
+                    ]
+                    r2r_state = r2r_actions[action]
+                    uncased = prefix == prefix.lower()
+                    if uncased and (ch == lch) and (r2r_actions[1 + action] != R2H_TABLE_NONE):
+                        prefix, obuf_r2r, retry = [
+                            strings[r2r_actions[i]] for i in range(1 + action, 4 + action)
+                        ]
+                    else:
+                        action += 4 if uncased else 7
+                        prefix, obuf_r2r, retry = [
+                            strings[r2r_actions[i]].format(p=prefix, c=ch)
+                            for i in range(action, 3 + action)
+                        ]
+                    if retry:
+                        ibuf_r2r = retry + ibuf_r2r
+            if ch in (BACKSPACE_A, RUBOUT_A):
+                if state_r2k:
+                    state_r2k = state_r2k[:-1]
+                    r2k_state = r2k_state_ids[state_r2k.lower()]
+                    continue
+                flags_r2k = (flags_r2k & 0x7F) << 1
+                break
+            lch = ch.lower()
+            if len(lch) != 1:
+                input_class = class_map[0x80 if lch else 0x81]
+            else:
+                input_class = class_map[ord(lch) if (lch < "\x80") else 0x80]
+            kana = r2k_transitions[r2k_state * n_classes + input_class]
+            if kana == R2H_TABLE_NONE:
+                lstate = state_r2k.lower()
+                if (lstate == "z") and (ch == MIDDOT_A):
+                    ch, state_r2k = MIDDOT_K, ""
+                elif (lstate == "z") and (ch == HYPHEN_MINUS_A):
+                    flags_r2k &= 0x7F
+                    state_r2k = ""
+                elif (ch == HYPHEN_MINUS_A) and (flags_r2k & 0x80):
+                    ch = CHOUONPU_K
+            elif kana < 0x8000:
+                state_r2k += ch
+                r2k_state = kana
+                continue
+            else:
+                ch, state_r2k = chr(kana), ""
+            r2k_state = 0
+            if state_r2k:
+                obuf_r2k += state_r2k[:1]
+                ibuf_r2k += state_r2k[1:] + ch
+                state_r2k = ""
+                ch, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+        if ch and (ch < " ") and (ch != BACKSPACE_A):
+            flags_r2k = 0
+        else:
+            flags_r2k = (0x80 if (ch and (ch in ALL_K)) else 0) | (flags_r2k >> 1)
+        break
+    ibuf = "".join(
+        [
+            (ibuf_r2k[i : 1 + i] or UNUSED_R2R) + (ibuf_r2r[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(ibuf_r2k), len(ibuf_r2r)))
+        ]
+    )
+    state = "".join(
+        [
+            (state_r2k[i : 1 + i] or UNUSED_R2R) + (prefix[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(state_r2k), len(prefix)))
+        ]
+    )
+    obuf = "".join(
+        [
+            (obuf_r2k[i : 1 + i] or UNUSED_R2R) + (obuf_r2r[i : 1 + i] or UNUSED_R2R)
+            for i in range(max(len(obuf_r2k), len(obuf_r2r)))
+        ]
+    )
+    flags = flags_r2k | (flags_r2r << 8)
+    return ch, ibuf, state, obuf, flags
+
+
+OUTPUT_FORMS = ("halfwidth", "katakana", "hiragana")
+SPACING_DAKUTEN_K = "゛"
+SPACING_HANDAKUTEN_K = "゜"
+
+
+def output_form_tables(form):
+    """
+    tables for converting halfwidth katakana output to another output form
+
+    - form is one of `OUTPUT_FORMS`.
+
+    the return values are convert, compose.
+    - convert maps each halfwidth kana to its equivalent in form; the voicing marks map to their spacing forms.
+    - compose maps a halfwidth kana followed by a halfwidth voicing mark to the precomposed voiced kana in form, where there is one.
+    """
+
+    def katakana(k):
+        if k == DAKUTEN_K:
+            return SPACING_DAKUTEN_K
+        if k == HANDAKUTEN_K:
+            return SPACING_HANDAKUTEN_K
+        return unicodedata.normalize("NFKC", k)
+
+    def in_form(k):
+        if form == "halfwidth":
+            return None
+        if form == "hiragana":
+            if not ("ァ" <= k <= "ヶ"):
+                return None if (len(k) == 1 and "ヷ" <= k <= "ヺ") else k
+            return chr(ord(k) - ord("ァ") + ord("ぁ"))
+        return k
+
+    convert = {}
+    compose = {}
+    for k in ALL_K:
+        convert[k] = in_form(katakana(k)) or k
+        for mark in (DAKUTEN_K, HANDAKUTEN_K):
+            voiced = unicodedata.normalize(
+                "NFC", katakana(k) + unicodedata.normalize("NFKC", mark)
+            )
+            if len(voiced) == 1 and in_form(voiced):
+                compose[k + mark] = in_form(voiced)
+    return convert, compose
+
+
+OUTPUT_FORM_TABLES = {form: output_form_tables(form) for form in OUTPUT_FORMS}
+R2H_OUTPUT_FORM_SHIFT = 16  # flags bits 0-7 are flags_r2k and 8-15 flags_r2r; the kana held back by `r2h_output_form()` is kept above them
+
+
+def r2h_output_form(*, ibuf, state, obuf, flags, getch, form, r2h=r2h_compiled):
+    """
+    convert romaji to halfwidth katakana, fullwidth katakana, or hiragana in a single pass
+
+    - form is one of `OUTPUT_FORMS`.
+    - r2h is the underlying conversion engine.
+    - the other arguments and the return values are as for `r2h()`.
+
+    a kana which could take a voicing mark is held back until the next character is known, so that it can be combined with a following voicing mark into a precomposed kana (for example ｶﾞ becomes ガ); the held back character is carried in flags above bit `R2H_OUTPUT_FORM_SHIFT`, and only the 16 bits below it, which hold the backspace flags of the r2k and r2r stages, are passed to r2h.
+    """
+    convert, compose = OUTPUT_FORM_TABLES[form]
+    pending, flags = flags >> R2H_OUTPUT_FORM_SHIFT, flags & ((1 << R2H_OUTPUT_FORM_SHIFT) - 1)
+    if pending:
+        ch = chr(pending - 1)
+    else:
+        ch, ibuf, state, obuf, flags = r2h(
+            ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+        )
+    if (ch + DAKUTEN_K in compose) or (ch + HANDAKUTEN_K in compose):
+        mark, ibuf, state, obuf, flags = r2h(
+            ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+        )
+        if ch + mark in compose:
+            return compose[ch + mark], ibuf, state, obuf, flags
+        if mark:
+            flags |= (1 + ord(mark)) << R2H_OUTPUT_FORM_SHIFT
+    return convert.get(ch, ch), ibuf, state, obuf, flags
+
+
+import concurrent.futures
+
+
+def r2hs_batch(strings, r2h=r2h_compiled, form="halfwidth", workers=None, executor=None):
+    """
+    convert each of the input strings like `r2hs()`, concurrently, returning a list of the results in the same order
+
+    - workers is the number of worker threads; by default this is chosen by `concurrent.futures.ThreadPoolExecutor`.
+    - executor is an existing `concurrent.futures.Executor` to use instead of a new thread pool, for example a `concurrent.futures.ProcessPoolExecutor`.
+
+    the conversion engines keep all the state of a conversion in their arguments and local variables, and only read the module-level rule tables, which `register_rules()` replaces without modifying them (see `rebuild_r2h_tables()`). so any number of conversions may run at once in different threads, including on free-threaded builds of CPython, and threads avoid pickling the strings as a process pool must.
+    """
+    strings = list(strings)
+    convert = functools.partial(r2hs, r2h=r2h, form=form)
+    if executor is not None:
+        chunksize = max(1, len(strings) // (4 * (workers or os.cpu_count() or 1)))
+        return list(executor.map(convert, strings, chunksize=chunksize))
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(convert, strings))
+
+
+import codecs
+
+R2H_CODEC_NAMES = {
+    "r2h": "halfwidth",
+    "r2h_katakana": "katakana",
+    "r2h_hiragana": "hiragana",
+}
+
+
+class R2HNeedInput(Exception):
+    """
+    raised from getch by `r2h_chunk()` when a conversion step needs input beyond the current chunk
+    """
+
+
+def r2h_chunk(text, final, *, pending, ibuf, state, obuf, flags, r2h, history=None, settle=0):
+    """
+    convert the next chunk of a stream of romaji, carrying the conversion over from the previous chunk
+
+    - text is the next chunk of the input.
+    - final is true when text is the last chunk.
+    - pending is the input left over from the previous chunk; initially it should be an empty string.
+    - ibuf, state, obuf, and flags are as for `r2h()`, and r2h is the conversion engine.
+    - history is an optional bytearray of the kana state byte of flags after each output character not yet erased by backspace. when given, it is extended with each output character and used to restore the kana state exactly when output is erased, however far back that goes, instead of the engine's own 8 characters of kana state history.
+    - settle is the number of characters of input which may be left pending, with their output held back, so that a chunk ends with ibuf, state, and obuf all empty; it cannot be combined with history.
+
+    the return values are converted, pending, ibuf, state, obuf, flags; all but converted should be passed back in with the next chunk.
+
+    each call to the engine either returns an output character or runs out of input. running out of input part way through a call leaves the engine's state from before that call, with the input it consumed left pending to be converted again once more input arrives.
+    """
+    if settle and (history is not None):
+        raise ValueError("r2h_chunk: settle cannot be combined with history")
+    text = pending + text
+    position = 0
+    converted = []
+    settled = None if (ibuf or state or obuf) else (0, 0, flags)  # the last point with empty buffers
+
+    def getch():
+        nonlocal position
+        if position < len(text):
+            position += 1
+            return text[position - 1]
+        if final:
+            return ""
+        raise R2HNeedInput()
+
+    while True:
+        start = position
+        try:
+            ch, ibuf, state, obuf, flags = r2h(
+                ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+            )
+        except R2HNeedInput:
+            if (ibuf or state or obuf) and settled and (len(text) - settled[0] <= settle):
+                position, n, flags = settled
+                return "".join(converted[:n]), text[position:], "", "", "", flags
+            return "".join(converted), text[start:], ibuf, state, obuf, flags
+        if ch == "":
+            return "".join(converted), "", "", "", "", 0
+        if history is not None:
+            if ch in (BACKSPACE_A, RUBOUT_A):
+                if history:
+                    history.pop()
+                flags = (flags & ~0xFF) | (history[-1] if history else 0)
+            else:
+                history.append(flags & 0xFF)
+        converted += [ch]
+        if settle and not (ibuf or state or obuf):
+            settled = position, len(converted), flags
+
+
+R2H_CODEC_FLAGS_BITS = 40  # low bits of a codec state integer holding the flags, which `r2h_output_form()` extends to 37 bits
+R2H_CODEC_SETTLE = 64  # characters of romaji the decoder may hold back to end each chunk with empty buffers
+
+
+def r2h_codec_state_int(conversion):
+    """
+    encode the strings and flags of a conversion state, such as ibuf, state, obuf, and flags, as an integer for `getstate()`
+
+    the flags are kept in the low `R2H_CODEC_FLAGS_BITS` bits and the strings, as UTF-8 after their lengths, above them, so the integer means the same in any process. a state whose strings are all empty, as at the end of most words, is just its flags, which is small enough for the 32 bits of decoder state that `io.TextIOWrapper` keeps in the positions returned by `tell()`.
+    """
+    *strings, flags = conversion
+    if not any(strings):
+        return flags
+    data = b""
+    for s in strings:
+        encoded = s.encode("utf-8", "surrogatepass")
+        data += struct.pack("<H", len(encoded)) + encoded
+    return flags | (int.from_bytes(data + b"\x01", "little") << R2H_CODEC_FLAGS_BITS)
+
+
+def r2h_codec_state(value, n):
+    """
+    the conversion state of n values encoded by `r2h_codec_state_int()`
+    """
+    flags, strings = value & ((1 << R2H_CODEC_FLAGS_BITS) - 1), []
+    payload = value >> R2H_CODEC_FLAGS_BITS
+    if not payload:
+        return ("",) * (n - 1) + (flags,)
+    data = payload.to_bytes((payload.bit_length() + 7) // 8, "little")[:-1]
+    position = 0
+    while position < len(data):
+        (size,) = struct.unpack_from("<H", data, position)
+        strings += [data[position + 2 : position + 2 + size].decode("utf-8", "surrogatepass")]
+        position += 2 + size
+    if len(strings) != n - 1:
+        raise ValueError(f"r2h_codec_state: {value} is not a state of {n} values")
+    return (*strings, flags)
+
+
+class R2HIncrementalDecoder(codecs.IncrementalDecoder):
+    """
+    decode UTF-8 romaji to kana for the codecs found by `r2h_codec_search()`
+
+    the state from `getstate()` holds any pending romaji re-encoded together with the undecoded UTF-8 bytes, and the ibuf, state, obuf, and flags of the conversion encoded by `r2h_codec_state_int()`. each chunk is decoded with the settle argument of `r2h_chunk()`, so the buffers are almost always empty between chunks, and the state fits in the positions returned by `tell()`.
+    """
+
+    def __init__(self, errors="strict", form="halfwidth", r2h=r2h_compiled):
+        super().__init__(errors)
+        if form != "halfwidth":
+            r2h = functools.partial(r2h_output_form, form=form, r2h=r2h)
+        self.r2h = r2h
+        self.reset()
+
+    def decode(self, input, final=False):
+        pending, ibuf, state, obuf, flags = self.conversion
+        converted, *self.conversion = r2h_chunk(
+            self.utf8.decode(input, final),
+            final,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.r2h,
+            settle=R2H_CODEC_SETTLE,
+        )
+        return converted
+
+    def reset(self):
+        self.utf8 = codecs.getincrementaldecoder("utf-8")(self.errors)
+        self.conversion = ["", "", "", "", 0]
+
+    def getstate(self):
+        pending, *conversion = self.conversion
+        undecoded, _ = self.utf8.getstate()
+        return (
+            pending.encode("utf-8", "surrogatepass") + undecoded,
+            r2h_codec_state_int(conversion),
+        )
+
+    def setstate(self, state):
+        buffered, state_id = state
+        self.utf8.reset()
+        self.conversion = [self.utf8.decode(buffered), *r2h_codec_state(state_id, 4)]
+
+
+class R2HIncrementalEncoder(codecs.IncrementalEncoder):
+    """
+    convert romaji to kana encoded as UTF-8 for the codecs found by `r2h_codec_search()`
+    """
+
+    def __init__(self, errors="strict", form="halfwidth", r2h=r2h_compiled):
+        super().__init__(errors)
+        if form != "halfwidth":
+            r2h = functools.partial(r2h_output_form, form=form, r2h=r2h)
+        self.r2h = r2h
+        self.reset()
+
+    def encode(self, input, final=False):
+        pending, ibuf, state, obuf, flags = self.conversion
+        converted, *self.conversion = r2h_chunk(
+            input,
+            final,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.r2h,
+        )
+        return converted.encode("utf-8", self.errors)
+
+    def reset(self):
+        self.conversion = ["", "", "", "", 0]
+
+    def getstate(self):
+        return r2h_codec_state_int(self.conversion)
+
+    def setstate(self, state):
+        self.conversion = list(r2h_codec_state(state, 5))
+
+
+def r2h_codec_search(name):
+    """
+    `codecs` search function for the "r2h", "r2h_katakana", and "r2h_hiragana" codecs
+
+    decoding converts UTF-8 romaji to halfwidth katakana, fullwidth katakana, or hiragana respectively, so `open(path, encoding="r2h")` reads a file of romaji as kana; encoding likewise converts romaji to kana and encodes that as UTF-8.
+    """
+    form = R2H_CODEC_NAMES.get(name.replace("-", "_"))
+    if form is None:
+        return None
+    decoder = functools.partial(R2HIncrementalDecoder, form=form)
+    encoder = functools.partial(R2HIncrementalEncoder, form=form)
+    return codecs.CodecInfo(
+        name=name.replace("-", "_"),
+        encode=lambda input, errors="strict": (
+            encoder(errors).encode(input, final=True),
+            len(input),
+        ),
+        decode=lambda input, errors="strict": (
+            decoder(errors).decode(input, final=True),
+            len(input),
+        ),
+        incrementalencoder=encoder,
+        incrementaldecoder=decoder,
+    )
+
+
+codecs.register(r2h_codec_search)
+
+
+import time
+
+PREEDIT_START = "\x1b[4m"  # underline
+PREEDIT_END = "\x1b[24m"
+ERASE_TO_EOL = "\x1b[K"
+
+
+def pending_romaji(ibuf, state):
+    """
+    romaji which has been read but not yet converted, given the ibuf and state of `r2h()`
+    """
+    state_r2k, prefix = state[::2].rstrip(UNUSED_R2R), state[1::2].rstrip(UNUSED_R2R)
+    ibuf_r2k, ibuf_r2r = ibuf[::2].rstrip(UNUSED_R2R), ibuf[1::2].rstrip(UNUSED_R2R)
+    return state_r2k + ibuf_r2k + prefix + ibuf_r2r
+
+
+def display_width(s):
+    """
+    number of terminal columns used to display s
+    """
+    return sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in s)
+
+
+def erase_backspaces(s):
+    """
+    apply any backspace/rubout characters in s to the characters preceding them
+    """
+    erased = ""
+    for c in s:
+        if c in (BACKSPACE_A, RUBOUT_A):
+            erased = erased[:-1]
+        else:
+            erased += c
+    return erased
+
+
+def r2h_interactive(*, infd, outfd, r2h=r2h_compiled, latencies=None):
+    """
+    convert keystrokes read from file descriptor infd, echoing the conversion to the terminal on file descriptor outfd as it is typed
+
+    - r2h is the conversion engine.
+    - latencies is an optional list, to which the time in seconds from each read of keystrokes until all the resulting output has been written is appended.
+
+    romaji which has been typed but not yet converted is shown as underlined preedit text after the converted output, and only the part of the display which changed is redrawn after each keystroke.
+    the terminal should already be in raw mode (see `raw_terminal()`); Ctrl-D or the end of the input ends the conversion.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    keys, position, typed, shown, out, widths = "", 0, "", "", [], []
+    read_time, eof = None, False
+    ibuf, state, obuf, flags = "", "", "", 0
+
+    def show(preedit):
+        nonlocal shown
+        common = len(os.path.commonprefix([shown, preedit]))
+        if common < len(shown):
+            out.append(BACKSPACE_A * display_width(shown[common:]) + ERASE_TO_EOL)
+        if common < len(preedit):
+            out.append(PREEDIT_START + preedit[common:] + PREEDIT_END)
+        shown = preedit
+
+    def getch():
+        nonlocal keys, position, typed, read_time, eof
+        if (position >= len(keys)) and not eof:
+            show(erase_backspaces(pending_romaji(ibuf, state) + typed))
+            if out:
+                os.write(outfd, "".join(out).encode("utf-8"))
+                out.clear()
+            if (read_time is not None) and (latencies is not None):
+                latencies.append(time.perf_counter() - read_time)
+            data = os.read(infd, 4096)
+            read_time = time.perf_counter()
+            keys = decoder.decode(data, final=not data)
+            eof = (not data) or ("\x04" in keys)
+            keys, position = keys.split("\x04")[0], 0
+        ch = keys[position : 1 + position]
+        position += len(ch)
+        typed += ch
+        return ch
+
+    while True:
+        ch, ibuf, state, obuf, flags = r2h(
+            ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+        )
+        typed = ""
+        show("")
+        if ch == "":
+            break
+        if ch in (BACKSPACE_A, RUBOUT_A):
+            if widths:
+                out.append(BACKSPACE_A * widths.pop() + ERASE_TO_EOL)
+        elif ch in "\r\n":
+            out.append(ch)
+            widths.clear()
+        elif ch >= " ":
+            out.append(ch)
+            widths.append(display_width(ch))
+    if out:
+        os.write(outfd, "".join(out).encode("utf-8"))
+        if (read_time is not None) and (latencies is not None):
+            latencies.append(time.perf_counter() - read_time)
+
+
+def raw_terminal(fd, signals=True):
+    """
+    put the terminal on file descriptor fd into raw mode, returning a function which restores its previous mode
+
+    keystrokes are delivered one at a time without echo or line editing. signal keys such as Ctrl-C and output newline translation keep working, unless signals is false, when every key and output byte is passed through unchanged, for a program in a pseudo-terminal to interpret.
+    """
+    import termios  # only available on Unix-like systems
+
+    saved = termios.tcgetattr(fd)
+    raw = termios.tcgetattr(fd)
+    raw[3] &= ~(termios.ICANON | termios.ECHO | termios.IEXTEN)
+    if not signals:
+        raw[0] &= ~(termios.BRKINT | termios.ICRNL | termios.IXON | termios.ISTRIP)
+        raw[1] &= ~termios.OPOST
+        raw[3] &= ~termios.ISIG
+    raw[6][termios.VMIN], raw[6][termios.VTIME] = 1, 0
+    termios.tcsetattr(fd, termios.TCSAFLUSH, raw)
+    return lambda: termios.tcsetattr(fd, termios.TCSAFLUSH, saved)
+
+
+def latency_summary(latencies):
+    """
+    one-line summary of latencies in seconds, with percentiles in milliseconds
+    """
+    if not latencies:
+        return "no samples"
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return 1000 * ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return f"n={len(ordered)} p50={percentile(0.50):.3f}ms p95={percentile(0.95):.3f}ms p99={percentile(0.99):.3f}ms max={1000 * ordered[-1]:.3f}ms"
+
+
+import json
+import tempfile
+
+R2H_TREE_MANIFEST = ".r2h-manifest.json"
+
+
+def r2h_fingerprint(form):
+    """
+    version fingerprint of the conversion to the given output form; it changes whenever this module or the added rules change
+    """
+    return f"{form}:{r2h_cache_digest()}"
+
+
+def file_sha256(path):
+    """
+    hex SHA-256 of the contents of a file
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def convert_file(src_path, dst_path, form="halfwidth", r2h=r2h_compiled):
+    """
+    convert a UTF-8 file of romaji to kana with the engine r2h, or the engine of that name, atomically replacing dst_path; line endings are preserved
+    """
+    os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+    with open(src_path, encoding="utf-8", newline="") as source:
+        kana = r2hs(source.read(), r2h=r2h, form=form)
+    with open(f"{dst_path}.{os.getpid()}", "w", encoding="utf-8", newline="") as output:
+        output.write(kana)
+    os.replace(f"{dst_path}.{os.getpid()}", dst_path)
+
+
+def r2h_tree(src, dst, form="halfwidth", workers=None, r2h=r2h_compiled):
+    """
+    convert every file in the directory tree src to the same path under dst, skipping files unchanged since the last conversion
+
+    the content hash and size/modification time of each converted file are kept with the fingerprint of the converter in a manifest file in dst. files whose size and modification time are unchanged are skipped without reading them, files whose contents hash the same are skipped after hashing, and everything is converted again when the fingerprint changes. outputs whose source files have gone are removed.
+
+    changed files are converted in parallel by a pool of worker processes, which attach to the tables shared by `share_r2h_tables()`; workers is the size of the pool, by default chosen by `concurrent.futures.ProcessPoolExecutor`. r2h is the conversion engine, which is passed to the workers, so it must be picklable, for example the name of an engine for `get_engine()`. the registered engines all convert alike, but an engine loaded by `module:attribute` name is part of the fingerprint.
+
+    the return values are converted, unchanged, removed; each is a sorted list of relative paths.
+    """
+    manifest_path = os.path.join(dst, R2H_TREE_MANIFEST)
+    fingerprint = r2h_fingerprint(form)
+    if isinstance(r2h, str) and (":" in r2h):
+        fingerprint += f":{r2h}"
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        entries = manifest["files"] if manifest.get("converter") == fingerprint else {}
+    except (OSError, ValueError, KeyError):
+        entries = {}
+    files, todo, unchanged = {}, [], []
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames[:] = sorted(  # the output tree may be inside the input tree
+            name
+            for name in dirnames
+            if os.path.realpath(os.path.join(dirpath, name)) != os.path.realpath(dst)
+        )
+        for filename in sorted(filenames):
+            src_path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(src_path, src)
+            stat = os.stat(src_path)
+            entry = entries.get(relpath)
+            if entry and os.path.exists(os.path.join(dst, relpath)):
+                if (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                    files[relpath] = entry
+                    unchanged += [relpath]
+                    continue
+                sha256 = file_sha256(src_path)
+                if entry["sha256"] == sha256:
+                    files[relpath] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    unchanged += [relpath]
+                    continue
+            else:
+                sha256 = file_sha256(src_path)
+            files[relpath] = dict(sha256=sha256, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            todo += [relpath]
+    args = (
+        [os.path.join(src, relpath) for relpath in todo],
+        [os.path.join(dst, relpath) for relpath in todo],
+        [form] * len(todo),
+        [r2h] * len(todo),
+    )
+    if (len(todo) > 1) and (workers != 1):
+        segment = share_r2h_tables()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                list(executor.map(convert_file, *args))
+        finally:
+            unshare_r2h_tables(segment)
+    else:
+        list(map(convert_file, *args))
+    removed = sorted(set(entries) - set(files))
+    for relpath in removed:
+        try:
+            os.remove(os.path.join(dst, relpath))
+        except OSError:
+            pass
+    os.makedirs(dst, exist_ok=True)
+    with open(f"{manifest_path}.{os.getpid()}", "w", encoding="utf-8") as f:
+        json.dump(dict(converter=fingerprint, files=files), f, indent=1, sort_keys=True)
+    os.replace(f"{manifest_path}.{os.getpid()}", manifest_path)
+    return todo, unchanged, removed
+
+
+import itertools
+
+R2H_SPAN_DELIMITERS = ("{{", "}}")
+R2H_SPAN_MAX = 1 << 16  # characters of an open span buffered while waiting for its closing delimiter
+
+
+def r2h_spans(chunks, delimiters=R2H_SPAN_DELIMITERS, r2h=r2h_compiled, form="halfwidth"):
+    """
+    convert only the romaji between pairs of delimiters in a stream of text chunks, yielding the output in pieces
+
+    - delimiters is a pair of non-empty opening and closing delimiter strings, which are removed from the output.
+    - r2h and form are as for `r2hs()`.
+
+    each span is converted with a fresh conversion state, and the text outside spans is copied unchanged. an opening delimiter without a matching closing delimiter, or followed by more than `R2H_SPAN_MAX` characters without one, is copied unchanged along with the text after it, so the memory used is bounded. each chunk is only searched once, so the time taken is linear in the length of the text.
+    """
+    open_delimiter, close_delimiter = delimiters
+    if not (open_delimiter and close_delimiter):
+        raise ValueError("r2h_spans: delimiters must not be empty")
+    text, span, span_size = "", None, 0  # span holds the pieces of an open span, or is None outside spans
+    for chunk in itertools.chain(chunks, [None]):
+        text += chunk or ""
+        while True:
+            if span is None:
+                start = text.find(open_delimiter)
+                if start < 0:
+                    break
+                yield text[:start]
+                text, span, span_size = text[start + len(open_delimiter) :], [], 0
+            end = text.find(close_delimiter)
+            if end < 0:
+                break
+            span.append(text[:end])
+            yield r2hs("".join(span), r2h=r2h, form=form)
+            text, span = text[end + len(close_delimiter) :], None
+        if chunk is None:
+            if span is not None:  # an unterminated span
+                yield open_delimiter + "".join(span)
+            yield text
+            return
+        if span is None:
+            keep = max(0, len(text) - len(open_delimiter) + 1)  # all but a partial opening delimiter
+            yield text[:keep]
+        else:
+            keep = max(0, len(text) - len(close_delimiter) + 1)  # all but a partial closing delimiter
+            span.append(text[:keep])
+            span_size += keep
+            if span_size > R2H_SPAN_MAX:  # too long to wait for, so the opening delimiter is taken literally
+                yield open_delimiter + "".join(span)
+                span = None
+        text = text[keep:]
+
+
+import collections
+import signal
+
+R2H_STATS_WINDOWS = (1, 10, 60)  # seconds
+R2H_STATS_SAMPLE_EVERY = 1024  # input characters between checks of the clock
+R2H_STATS_KANA = frozenset(
+    k
+    for form in OUTPUT_FORMS
+    for table in OUTPUT_FORM_TABLES[form]
+    for k in table.values()
+    if ("KATAKANA" in unicodedata.name(k, "")) or ("HIRAGANA" in unicodedata.name(k, ""))
+)
+
+
+class R2HStats:
+    """
+    cheap running counters for a conversion, see `count_input()`, `count_output()`, and `report()`, or `count_input_chunk()` and `count_output_chunk()` for text converted a chunk at a time
+
+    - input_chars and output_chars count the characters read and written.
+    - kana counts kana in the output, in any output form.
+    - fallbacks counts romaji letters left unconverted in the output.
+    - backspaces counts backspace and rubout characters in the input.
+    """
+
+    __slots__ = (
+        "input_chars",
+        "output_chars",
+        "kana",
+        "fallbacks",
+        "backspaces",
+        "started",
+        "next_sample",
+        "samples",
+    )
+
+    def __init__(self):
+        self.input_chars, self.output_chars, self.kana = 0, 0, 0
+        self.fallbacks, self.backspaces = 0, 0
+        self.started = time.monotonic()
+        self.next_sample = R2H_STATS_SAMPLE_EVERY
+        # (time, input_chars, output_chars) at most every half second
+        self.samples = collections.deque(
+            [(self.started, 0, 0)], maxlen=2 * max(R2H_STATS_WINDOWS)
+        )
+
+    def count_input(self, ch):
+        self.input_chars += 1
+        if ch in (BACKSPACE_A, RUBOUT_A):
+            self.backspaces += 1
+        if self.input_chars >= self.next_sample:
+            self.next_sample += R2H_STATS_SAMPLE_EVERY
+            now = time.monotonic()
+            if now - self.samples[-1][0] >= 0.5:
+                self.samples.append((now, self.input_chars, self.output_chars))
+
+    def count_output(self, ch):
+        self.output_chars += 1
+        if ch in R2H_STATS_KANA:
+            self.kana += 1
+        elif ch.isascii() and ch.isalpha():
+            self.fallbacks += 1
+
+    def count_input_chunk(self, text):
+        """
+        `count_input()` for each character of text, counting each kind of character with `str.count()` instead of one at a time
+        """
+        self.input_chars += len(text)
+        self.backspaces += text.count(BACKSPACE_A) + text.count(RUBOUT_A)
+        if self.input_chars >= self.next_sample:
+            self.next_sample = self.input_chars + R2H_STATS_SAMPLE_EVERY
+            now = time.monotonic()
+            if now - self.samples[-1][0] >= 0.5:
+                self.samples.append((now, self.input_chars, self.output_chars))
+
+    def count_output_chunk(self, text):
+        """
+        `count_output()` for each character of text, counting each distinct character with `str.count()` instead of one at a time
+        """
+        self.output_chars += len(text)
+        present = set(text)
+        self.kana += sum(map(text.count, present & R2H_STATS_KANA))
+        self.fallbacks += sum(
+            text.count(ch) for ch in present if ch.isascii() and ch.isalpha()
+        )
+
+    def report(self):
+        """
+        the counters, elapsed seconds, and input throughput overall and over each of the recent time windows in `R2H_STATS_WINDOWS`, as a dict
+        """
+        now = time.monotonic()
+        throughput = dict(overall=self.input_chars / max(now - self.started, 1e-9))
+        for window in R2H_STATS_WINDOWS:
+            t, input_chars, _ = next(
+                (sample for sample in self.samples if sample[0] >= now - window),
+                (now, self.input_chars, self.output_chars),
+            )
+            throughput[f"last_{window}s"] = (
+                (self.input_chars - input_chars) / (now - t) if now > t else 0.0
+            )
+        return dict(
+            input_chars=self.input_chars,
+            output_chars=self.output_chars,
+            kana=self.kana,
+            fallbacks=self.fallbacks,
+            backspaces=self.backspaces,
+            elapsed=now - self.started,
+            input_chars_per_second=throughput,
+        )
+
+    def dump(self, file=None):
+        """
+        write `report()` as a line of JSON, by default to stderr
+        """
+        print(json.dumps(self.report()), file=file or sys.stderr, flush=True)
+
+
+import re
+
+R2H_REPLAY_SEGMENTS = re.compile(r"[\b\x7f]+|[^\b\x7f\s]*\s|[^\b\x7f\s]+")
+R2H_REPLAY_CACHE_SIZE = 1 << 16
+
+
+def r2h_replay(keys, r2h=r2h_compiled):
+    """
+    replay a log of keystrokes, returning the text it leaves once every backspace has been applied
+
+    - keys is the keystroke log, either a string or an iterable of string chunks.
+    - r2h is the conversion engine, or the name of one for `get_engine()`.
+
+    unlike `r2hs()`, the kana state used for `-` is remembered for every output character (see the history argument of `r2h_chunk()`), so backing up over any number of characters restores it exactly.
+
+    the log is split into segments at whitespace and backspaces. the conversion of segments without backspaces depends only on the conversion state they start from, so those are looked up in a cache of recently converted segments, which makes replaying the repetitive text of real logs fast.
+    """
+    r2h = get_engine(r2h)
+    if isinstance(keys, str):
+        keys = [keys]
+    text, history = [], bytearray()
+    conversion = ("", "", "", "", 0)
+    cache = {}
+
+    def replay_uncached(segment, final):
+        nonlocal conversion
+        pending, ibuf, state, obuf, flags = conversion
+        converted, *conversion = r2h_chunk(
+            segment,
+            final,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=r2h,
+            history=history,
+        )
+        conversion = tuple(conversion)
+        for ch in converted:
+            if ch not in (BACKSPACE_A, RUBOUT_A):
+                text.append(ch)
+            elif text:
+                text.pop()
+
+    for chunk in keys:
+        for segment in R2H_REPLAY_SEGMENTS.findall(chunk):
+            if segment[0] in (BACKSPACE_A, RUBOUT_A):
+                replay_uncached(segment, False)
+                continue
+            key = (segment, conversion)
+            cached = cache.get(key)
+            if cached is None:
+                pending, ibuf, state, obuf, flags = conversion
+                segment_history = bytearray()
+                converted, *end = r2h_chunk(
+                    segment,
+                    False,
+                    pending=pending,
+                    ibuf=ibuf,
+                    state=state,
+                    obuf=obuf,
+                    flags=flags,
+                    r2h=r2h,
+                    history=segment_history,
+                )
+                if len(cache) >= R2H_REPLAY_CACHE_SIZE:
+                    cache.clear()
+                cached = cache[key] = (converted, bytes(segment_history), tuple(end))
+            converted, segment_history, conversion = cached
+            text += converted
+            history += segment_history
+    replay_uncached("", True)
+    return "".join(text)
+
+
+R2H_CHECK_SEGMENTS = re.compile(r"\S*\s|\S+")
+R2H_CHECK_CACHE_SIZE = 1 << 14  # segments whose check results are remembered by `r2h_check_spans()`
+R2H_CHECK_CACHE_SEGMENT = 64  # characters in the longest segment remembered, which bounds the memory used
+
+
+def r2h_check_segment(text, final, conversion, r2h):
+    """
+    run the conversion over text without keeping its output, for `r2h_check_spans()`
+
+    - text is the next segment of input, preceded by any input pending from the previous segment.
+    - conversion is the ibuf, state, obuf, and flags to start from.
+
+    the return values are spans, pending, conversion; spans lists the (start, end) offsets in text of the input left unconverted, which are negative for romaji held over in the conversion state from earlier segments, and pending and conversion are to be passed on with the next segment as for `r2h_chunk()`.
+    """
+    position = 0
+    spans = []
+
+    def getch():
+        nonlocal position
+        if position < len(text):
+            position += 1
+            return text[position - 1]
+        if final:
+            return ""
+        raise R2HNeedInput()
+
+    ibuf, state, obuf, flags = conversion
+    while True:
+        start = position
+        unresolved = position - len(pending_romaji(ibuf, state))
+        try:
+            ch, ibuf, state, obuf, flags = r2h(
+                ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+            )
+        except R2HNeedInput:
+            return spans, text[start:], (ibuf, state, obuf, flags)
+        if ch == "":
+            return spans, "", ("", "", "", 0)
+        if ch.isascii() and ch.isalpha():
+            end = max(unresolved + 1, position - len(pending_romaji(ibuf, state)))
+            spans += [(unresolved, end)]
+
+
+@functools.lru_cache(maxsize=R2H_CHECK_CACHE_SIZE)
+def r2h_check_cached(segment, pending, conversion, r2h):
+    """
+    `r2h_check_segment()` for the next segment of `r2h_check_spans()`, or None at the end, remembering the results for the most recently used segments
+    """
+    spans, pending, conversion = r2h_check_segment(
+        pending + (segment or ""), segment is None, conversion, r2h
+    )
+    return tuple(spans), pending, conversion
+
+
+R2H_RECOGNIZER_UNSUPPORTED = "\u212a"  # KELVIN SIGN, the only non-ASCII character which lowercases to romaji, which `r2h_recognize()` leaves to the conversion engine
+
+
+def r2h_recognizer_step(prefix, state_r2k, ch):
+    """
+    follow the conversion over one more input character from a point where it reads input, without producing any output, for `r2h_recognizer_bytes()`
+
+    - prefix and state_r2k are the lowercase romaji-to-romaji prefix and romaji-to-kana state when the conversion reads ch.
+    - ch is a lowercase input character, or an empty string for the end of the input.
+
+    the steps are those of `r2h_table()` on the tables of `r2h_compiled()`, less the flags, which only choose between `-` and `ｰ` and never decide whether romaji is converted.
+
+    the return values are next, restart, spans, with offsets relative to the end of ch.
+    - next is the prefix and state_r2k when the conversion reads its next input character, or None after the end of the input.
+    - restart is the offset of the first unconverted input character when the conversion step in progress at that point started (see `r2h_check_segment()`), or None when that step started before ch.
+    - spans lists the (start, end) offsets of the input left unconverted, as for `r2h_check_segment()`, with None for a start which is the restart of the step in progress when ch was read.
+    """
+    r2r_table, r2k_table = r2h_compiled.__globals__["R2H_COMPILED_TABLES"]
+    ibuf_r2k, ibuf_r2r, obuf_r2k, obuf_r2r = "", "", "", ""
+    position, unresolved, spans = 0, None, []
+    while True:
+        while True:
+            if obuf_r2k:
+                out, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+                break
+            if ibuf_r2k:
+                out, ibuf_r2k = ibuf_r2k[:1], ibuf_r2k[1:]
+            else:
+                while True:
+                    if obuf_r2r:
+                        out, obuf_r2r = obuf_r2r[:1], obuf_r2r[1:]
+                        break
+                    if ibuf_r2r:
+                        out, ibuf_r2r = ibuf_r2r[:1], ibuf_r2r[1:]
+                    elif (position == 0) or not ch:
+                        out, position = ch, 1
+                    else:
+                        return (
+                            (prefix, state_r2k),
+                            None if unresolved is None else unresolved - 1,
+                            spans,
+                        )
+                    if not (prefix or out):
+                        break
+                    prefix, obuf_r2r, retry = r2r_step(prefix, out)
+                    ibuf_r2r = retry + ibuf_r2r
+            if out in (BACKSPACE_A, RUBOUT_A):
+                if state_r2k:
+                    state_r2k = state_r2k[:-1]
+                    continue
+                break
+            kana = r2k_table[state_r2k].get(out)
+            if kana == "":
+                state_r2k += out
+                continue
+            if kana is not None:
+                out, state_r2k = kana, ""
+            elif (state_r2k == "z") and (out in (MIDDOT_A, HYPHEN_MINUS_A)):
+                out, state_r2k = MIDDOT_K, ""
+            if state_r2k:
+                obuf_r2k += state_r2k[:1]
+                ibuf_r2k += state_r2k[1:] + out
+                state_r2k = ""
+                out, obuf_r2k = obuf_r2k[:1], obuf_r2k[1:]
+            break
+        if out == "":
+            return None, None, spans
+        pending = len(state_r2k + ibuf_r2k + prefix + ibuf_r2r)
+        if out.isascii() and out.isalpha():
+            spans += [
+                (None if unresolved is None else unresolved - 1, position - pending - 1)
+            ]
+        unresolved = position - pending
+
+
+def r2h_recognizer_bytes():
+    """
+    build the recognizer used by `validate()`: a transition table over the states in which the conversion reads input, recording only where input is left unconverted
+
+    the states are explored from the start with `r2h_recognizer_step()`, reading one lowercase character from each input class of `r2h_table_bytes()` (split where a class holds both letters and other characters, or backspace, rubout, `/` or `-`, which the conversion treats specially), and the characters are then regrouped into the classes which the recognizer tells apart.
+
+    the return value is the `marshal` serialization of class_map, n_classes, transitions, restarts, fallbacks, ends, span_lists.
+    - class_map maps each ASCII character, then all other characters, to an input class.
+    - transitions holds the next state for each (state, input class).
+    - restarts holds the restart offset of `r2h_recognizer_step()` for each (state, input class), or None.
+    - fallbacks holds the index in span_lists of the spans left unconverted for each (state, input class), and ends the same for the end of the input in each state; index 0 is no spans.
+    """
+    table_classes = R2H_TABLES[0]
+
+    def probe_key(lch):
+        special = lch in (BACKSPACE_A, RUBOUT_A, MIDDOT_A, HYPHEN_MINUS_A)
+        return table_classes[min(ord(lch), 0x80)], (lch if special else lch.isalpha())
+
+    chs = [chr(cc) for cc in range(0x80)] + [R2H_COMPILED_OTHER_PROBES[0]]
+    probes = {}
+    for ch in chs:
+        probes.setdefault(probe_key(ch.lower()), ch.lower())
+    states = [("", "")]  # grows while it is explored
+    state_ids = {states[0]: 0}
+    columns = {probe: [] for probe in probes.values()}
+    ends = []
+    span_ids = {(): 0}
+    for state in states:
+        for probe, column in columns.items():
+            following, restart, spans = r2h_recognizer_step(*state, probe)
+            if following not in state_ids:
+                state_ids[following] = len(states)
+                states += [following]
+            column += [
+                (
+                    state_ids[following],
+                    restart,
+                    span_ids.setdefault(tuple(spans), len(span_ids)),
+                )
+            ]
+        spans = r2h_recognizer_step(*state, "")[2]
+        ends += [span_ids.setdefault(tuple(spans), len(span_ids))]
+    classes = {}
+    for column in columns.values():
+        classes.setdefault(tuple(column), len(classes))
+    class_columns = sorted(classes, key=classes.get)
+    class_map = [
+        classes[tuple(columns[probes[probe_key(ch.lower())]])] for ch in chs
+    ]
+    return marshal.dumps(
+        (
+            tuple(class_map),
+            len(class_columns),
+            *[
+                tuple(
+                    column[state][field]
+                    for state in range(len(states))
+                    for column in class_columns
+                )
+                for field in range(3)
+            ],
+            tuple(ends),
+            tuple(sorted(span_ids, key=span_ids.get)),
+        )
+    )
+
+
+@functools.cache
+def r2h_recognizer():
+    """
+    the recognizer from `r2h_recognizer_bytes()`, cached (see `r2h_cache_path()`) and rebuilt whenever this module or the added rules change, built on first use since that takes a second or so
+
+    the return values are classes, other, n_classes, transitions, restarts, fallbacks, ends, span_lists; classes maps each ASCII character to its input class, and other is the input class of all other characters.
+    """
+    cache_path = r2h_cache_path("r2h_recognizer", r2h_cache_digest(), ".marshal")
+    data = read_r2h_cache(cache_path)
+    checked = data is not None
+    if not checked:
+        data = r2h_recognizer_bytes()
+    class_map, *tables = marshal.loads(data)
+    recognizer = (
+        {chr(cc): input_class for cc, input_class in enumerate(class_map[:0x80])},
+        class_map[0x80],
+        *tables,
+    )
+    if not checked:
+        assert r2h_recognize(R2H_ENGINE_CHECK_R, recognizer) == r2h_check_spans(
+            R2H_ENGINE_CHECK_R, r2h_table
+        ), "r2h_recognizer: recognized spans differ from the conversion's"
+        cache_r2h_generated(cache_path, data)
+    return recognizer
+
+
+def r2h_recognize(s, recognizer=None):
+    """
+    the (start, end) offsets of the spans of s left unconverted, unmerged, as from `r2h_check_spans()` for the engines in `R2H_RECOGNIZED_ENGINES`, found by following the transitions of `r2h_recognizer()` (or recognizer) a character at a time without converting anything
+
+    s must not contain `R2H_RECOGNIZER_UNSUPPORTED`.
+    """
+    (
+        classes,
+        other,
+        n_classes,
+        transitions,
+        restarts,
+        fallbacks,
+        ends,
+        span_lists,
+    ) = recognizer or r2h_recognizer()
+    get_class = classes.get
+    spans = []
+    state = position = unresolved = 0
+    for position, ch in enumerate(s, 1):
+        i = state * n_classes + get_class(ch, other)
+        state = transitions[i]
+        if fallbacks[i]:
+            for start, end in span_lists[fallbacks[i]]:
+                start = unresolved if start is None else position + start
+                spans += [(start, max(start + 1, position + end))]
+        if restarts[i] is not None:
+            unresolved = position + restarts[i]
+    for start, end in span_lists[ends[state]]:
+        start = unresolved if start is None else position + start
+        spans += [(start, max(start + 1, position + end))]
+    return spans
+
+
+def r2h_check_spans(s, r2h):
+    """
+    the (start, end) offsets of the spans of s left unconverted by conversion engine r2h, unmerged, found by running the conversion over each whitespace-delimited segment of s with `r2h_check_cached()` or `r2h_check_segment()`
+    """
+    spans = []
+    pending, conversion, offset = "", ("", "", "", 0), 0
+    for segment in R2H_CHECK_SEGMENTS.findall(s) + [None]:
+        if len(segment or "") + len(pending) <= R2H_CHECK_CACHE_SEGMENT:
+            checked = r2h_check_cached(segment, pending, conversion, r2h)
+        else:
+            checked = r2h_check_segment(
+                pending + (segment or ""), segment is None, conversion, r2h
+            )
+        segment_spans, next_pending, conversion = checked
+        base = offset - len(pending)
+        spans += [(base + start, base + end) for start, end in segment_spans]
+        offset += len(segment or "")
+        pending = next_pending
+    return spans
+
+
+def validate(s, r2h=r2h_compiled):
+    """
+    check whether romaji converts cleanly, without producing the converted output
+
+    the return value lists the (start, end) offsets of the spans of s which would be left unconverted, as romaji letters in the output; it is empty when s converts cleanly.
+
+    for the engines in `R2H_RECOGNIZED_ENGINES`, which all convert by the rule tables, s is checked by `r2h_recognize()` with one table lookup per character. other engines run the conversion with `r2h_check_spans()`, which remembers the results for whitespace-delimited segments of up to `R2H_CHECK_CACHE_SEGMENT` characters in `r2h_check_cached()`, a bounded and thread-safe `functools.lru_cache`, since they depend only on the segment and the conversion state it starts from.
+
+    r2h is the conversion engine, or the name of one for `get_engine()`.
+    """
+    r2h = get_engine(r2h)
+    if (r2h in R2H_RECOGNIZED_ENGINES) and (R2H_RECOGNIZER_UNSUPPORTED not in s):
+        found = r2h_recognize(s)
+    else:
+        found = r2h_check_spans(s, r2h)
+    spans = []
+    for start, end in found:
+        start, end = max(0, start), min(len(s), end)
+        if spans and (start <= spans[-1][1]):
+            spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+        else:
+            spans += [(start, end)]
+    return spans
+
+
+import importlib
+
+R2H_ENGINES = dict(
+    simple=functools.partial(r2h, r2k_one_to_one=r2k_one_to_one_simple),
+    fast=functools.partial(r2h, r2k_one_to_one=r2k_one_to_one_fast),
+    compiled=r2h_compiled,
+    table=r2h_table,
+)
+R2H_RECOGNIZED_ENGINES = tuple(R2H_ENGINES.values())  # engines converting by the rule tables, which `validate()` checks with `r2h_recognize()`
+R2H_ENGINE_REFERENCE = "simple"  # engine whose output the others are checked against
+R2H_ENGINE_DEFAULT = "compiled"  # engine used by `main()` unless --engine is given, and by "auto" when its choice cannot be cached
+R2H_ENGINE_CHECK_R = (
+    " ".join(expand_1_1_starts(*ALL_1_1_STARTS_R))
+    + " kon'nichiha, Ra-men/Pa-sonaru/byu-t'ifuru KYANTO chokore-to xtuhuxa vvyu nn z; z: kyt\b\bka\x7fqwxyz\n"
+)
+
+
+def register_engine(name, engine):
+    """
+    add a conversion engine with the same calling convention as `r2h()` to `R2H_ENGINES`, making it available by name to `get_engine()` and as a candidate for "auto"
+    """
+    R2H_ENGINES[name] = engine
+    auto_engine.cache_clear()
+
+
+def check_engine(engine, repeat=3):
+    """
+    startup self-check of a conversion engine: the best time in seconds to convert `R2H_ENGINE_CHECK_R`, or None when its output differs from the reference engine's or it fails
+    """
+    expected = r2hs(R2H_ENGINE_CHECK_R, r2h=R2H_ENGINES[R2H_ENGINE_REFERENCE])
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        try:
+            converted = r2hs(R2H_ENGINE_CHECK_R, r2h=engine)
+        except Exception:
+            return None
+        elapsed = time.perf_counter() - t
+        if converted != expected:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@functools.cache
+def auto_engine():
+    """
+    name of the fastest registered engine passing `check_engine()`
+
+    the choice is cached (see `r2h_cache_path()`), keyed by this module, the added rules, and the registered engines, so the engines are only timed again when those change. when no cache directory can be written, `R2H_ENGINE_DEFAULT` is chosen without timing anything, rather than timing every engine again in every process.
+    """
+    h = hashlib.sha256(r2h_cache_digest().encode())
+    fingerprint(h, R2H_ENGINES)
+    cache_path = r2h_cache_path("r2h_engine", h.hexdigest(), ".json")
+    try:
+        name = json.loads(bytes(read_r2h_cache(cache_path)))["engine"]
+        if name in R2H_ENGINES:
+            return name
+    except (TypeError, ValueError, KeyError):  # TypeError for a missing file
+        pass
+    if not os.access(os.path.dirname(cache_path), os.W_OK):
+        return R2H_ENGINE_DEFAULT
+    timings = {name: check_engine(engine) for name, engine in R2H_ENGINES.items()}
+    name = min(
+        (name for name, elapsed in timings.items() if elapsed is not None),
+        key=timings.get,
+        default=R2H_ENGINE_REFERENCE,
+    )
+    write_r2h_cache(cache_path, json.dumps(dict(engine=name, timings=timings)).encode())
+    return name
+
+
+def get_engine(name="auto"):
+    """
+    the conversion engine for name
+
+    - a name in `R2H_ENGINES` selects that engine.
+    - "auto" selects the fastest registered engine which passes its self-check, see `auto_engine()`.
+    - "module:attribute" imports an engine from another module, so new engines can be tried without editing this one.
+    - anything callable is already an engine, and is returned unchanged.
+
+    unknown names raise ValueError.
+    """
+    if callable(name):
+        return name
+    if name == "auto":
+        name = auto_engine()
+    if name in R2H_ENGINES:
+        return R2H_ENGINES[name]
+    module, _, attribute = name.partition(":")
+    if attribute:
+        try:
+            return functools.reduce(
+                getattr, attribute.split("."), importlib.import_module(module)
+            )
+        except (ImportError, AttributeError) as e:
+            raise ValueError(f"cannot load engine {name!r}: {e}") from e
+    raise ValueError(
+        f"unknown engine {name!r}; expected one of {', '.join([*R2H_ENGINES, 'auto'])} or module:attribute"
+    )
+
+
+class R2HConverter:
+    """
+    a conversion engine and output form chosen once, for converting many strings
+
+    engine is anything `get_engine()` accepts, and form is one of `OUTPUT_FORMS`.
+    """
+
+    def __init__(self, engine="auto", form="halfwidth"):
+        self.r2h = get_engine(engine)
+        self.form = form
+
+    def __call__(self, s):
+        return r2hs(s, r2h=self.r2h, form=self.form)
+
+    def batch(self, strings, workers=None, executor=None):
+        return r2hs_batch(
+            strings, r2h=self.r2h, form=self.form, workers=workers, executor=executor
+        )
+
+    def validate(self, s):
+        return validate(s, r2h=self.r2h)
+
+
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+
+R2H_COMPRESSORS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+R2H_PIPELINE_CHUNK = 1 << 16  # characters read at a time
+R2H_PIPELINE_DEPTH = 4  # chunks queued between stages
+
+
+def open_r2h_file(path, mode="r", newline=None):
+    """
+    open path as text for reading ("r") or writing ("w"), decompressing or compressing it with the module in `R2H_COMPRESSORS` for its suffix, if any; newline is as for `open()`
+    """
+    compressor = R2H_COMPRESSORS.get(os.path.splitext(path)[1].lower())
+    if compressor is None:
+        return open(path, mode, newline=newline)
+    return compressor.open(path, mode + "t", newline=newline)
+
+
+def r2h_pipeline(
+    source,
+    sink,
+    r2h=r2h_compiled,
+    stats=None,
+    chunk_size=R2H_PIPELINE_CHUNK,
+    *,
+    ibuf="",
+    state="",
+    obuf="",
+    flags=0,
+):
+    """
+    convert the text read from source, writing it to sink, with reading, conversion, and writing each in its own thread
+
+    - source and sink are text files, for example from `open_r2h_file()`.
+    - r2h is the conversion engine.
+    - stats is an optional `R2HStats` to count the input and output in.
+    - chunk_size is the number of characters read at a time.
+    - ibuf, state, obuf, and flags are as for `r2h()`, carried over from whatever was converted before source.
+
+    the return value is the ibuf, state, obuf, and flags the engine ends source with (rather than the fresh state `r2h_chunk()` leaves at the end of a stream), to be passed on when converting what follows it, so that a series of files converts as it does a character at a time.
+
+    the stages are joined by queues of at most `R2H_PIPELINE_DEPTH` chunks, so memory stays bounded whichever stage is slowest. the gzip, bz2, and lzma (de)compressors and file I/O release the GIL, so reading and writing overlap with conversion, which is the only serial stage. the conversion is carried over from chunk to chunk by `r2h_chunk()`.
+
+    an exception in any stage stops the others, and is raised here once they have finished.
+    """
+    chunks = queue.Queue(R2H_PIPELINE_DEPTH)
+    converted = queue.Queue(R2H_PIPELINE_DEPTH)
+    failed = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not failed.is_set():
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                chunks.put(chunk)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            chunks.put(None)
+
+    def write():
+        while (chunk := converted.get()) is not None:
+            if failed.is_set():
+                continue  # keep draining, so conversion never blocks
+            try:
+                sink.write(chunk)
+            except BaseException as e:
+                errors.append(e)
+                failed.set()
+
+    reader = threading.Thread(target=read, name="r2h-read", daemon=True)
+    writer = threading.Thread(target=write, name="r2h-write", daemon=True)
+    reader.start()
+    writer.start()
+    pending, ended = "", None
+
+    def r2h_to_end(**conversion):
+        nonlocal ended
+        ch, *ended = r2h(**conversion)
+        return (ch, *ended)
+
+    try:
+        while not failed.is_set():
+            chunk = chunks.get()
+            if stats is not None:
+                stats.count_input_chunk(chunk or "")
+            text, pending, ibuf, state, obuf, flags = r2h_chunk(
+                chunk or "",
+                chunk is None,
+                pending=pending,
+                ibuf=ibuf,
+                state=state,
+                obuf=obuf,
+                flags=flags,
+                r2h=r2h if chunk is not None else r2h_to_end,
+            )
+            if stats is not None:
+                stats.count_output_chunk(text)
+            converted.put(text)
+            if chunk is None:
+                break
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        while reader.is_alive():  # unblock a reader waiting for room in the queue
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        converted.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+    return tuple(ended)
+
+
+import select
+
+R2H_WRAP_ESCAPE = "\x1b"  # starts terminal key sequences, which are passed through unconverted
+R2H_WRAP_IUTF8 = 0x4000 if sys.platform == "linux" else 0  # termios.IUTF8, from Python 3.13
+
+
+def write_all(fd, data):
+    """
+    write all of data to file descriptor fd, however many writes that takes
+    """
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def copy_window_size(from_fd, to_fd):
+    """
+    copy the terminal window size from one terminal file descriptor to another, ignoring file descriptors which are not terminals
+    """
+    import fcntl  # only available on Unix-like systems
+    import termios
+
+    try:
+        size = fcntl.ioctl(from_fd, termios.TIOCGWINSZ, bytes(8))
+        fcntl.ioctl(to_fd, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
+
+
+def r2h_wrap(
+    argv, *, infd, outfd, r2h=r2h_compiled, latencies=None, speculation=None
+):
+    """
+    run a command in a pseudo-terminal, converting the keystrokes read from file descriptor infd before passing them on to it, and copying its output to file descriptor outfd unchanged
+
+    - argv is the command and its arguments.
+    - r2h is the conversion engine.
+    - latencies is an optional list, to which the time in seconds from each read of keystrokes until the resulting input has been written to the command is appended.
+    - speculation is an optional `R2HSpeculation`, which converts the keystrokes instead of r2h, passing the output for pending romaji on to the command straight away and correcting it with backspaces when needed.
+
+    the return value is the exit status of the command, negative if it was killed by a signal.
+
+    keystrokes are converted with `r2h_chunk()`, so romaji which has not been converted yet is held back from the command, and backspace/rubout edits it before the command ever sees it; once nothing is pending, backspace/rubout is passed on to the command. an escape character, which starts the sequences sent by arrow and function keys, flushes any pending romaji unconverted and is passed on along with the rest of the keystrokes read with it. the end of the input flushes pending romaji and sends Ctrl-D, twice if needed to end a partial line.
+
+    both directions are multiplexed with `select.select()`, blocking until there is something to do, and the command's window size follows the terminal's. the terminal should already be in raw mode, without signal keys (see `raw_terminal()`), so that they reach the command.
+    """
+    import pty  # only available on Unix-like systems
+    import termios
+
+    pid, master = pty.fork()
+    if pid == 0:
+        try:
+            attributes = termios.tcgetattr(0)
+            attributes[0] |= R2H_WRAP_IUTF8  # so that erasing removes a whole kana
+            termios.tcsetattr(0, termios.TCSANOW, attributes)
+            os.execvp(argv[0], argv)
+        except OSError as e:
+            print(f"{argv[0]}: {e.strerror}", file=sys.stderr)
+        os._exit(127)
+    copy_window_size(infd, master)
+    resized = signal.getsignal(signal.SIGWINCH)
+    signal.signal(
+        signal.SIGWINCH, lambda signum, frame: copy_window_size(infd, master)
+    )
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    pending, ibuf, state, obuf, flags = "", "", "", "", 0
+    fds, written = [infd, master], ""
+    try:
+        while True:
+            readable, _, _ = select.select(fds, [], [])
+            if master in readable:
+                try:
+                    data = os.read(master, 1 << 16)
+                except OSError:  # EIO once the command has exited
+                    data = b""
+                if not data:
+                    break
+                write_all(outfd, data)
+            if infd in readable:
+                data = os.read(infd, 4096)
+                read_time = time.perf_counter()
+                keys = decoder.decode(data, final=not data)
+                text, escape, rest = keys.partition(R2H_WRAP_ESCAPE)
+                if speculation is not None:
+                    converted = speculation.feed(text, bool(escape) or not data)
+                else:
+                    converted, pending, ibuf, state, obuf, flags = r2h_chunk(
+                        text,
+                        bool(escape) or not data,
+                        pending=pending,
+                        ibuf=ibuf,
+                        state=state,
+                        obuf=obuf,
+                        flags=flags,
+                        r2h=r2h,
+                    )
+                written = (written + converted + escape + rest)[-1:]
+                if not data:  # Ctrl-D ends the input, after ending any partial line
+                    fds.remove(infd)
+                    rest += "\x04" if written in ("", "\r", "\n") else "\x04\x04"
+                write_all(master, (converted + escape + rest).encode("utf-8"))
+                if latencies is not None:
+                    latencies.append(time.perf_counter() - read_time)
+        _, status = os.waitpid(pid, 0)  # before closing, which would hang up on the command as it exits
+    finally:
+        signal.signal(signal.SIGWINCH, resized)
+        os.close(master)
+    return os.waitstatus_to_exitcode(status)
+
+
+import random
+
+R2H_SHADOW_SEGMENT = 4096  # steps recorded before a segment of a stream is handed to the comparison thread
+R2H_SHADOW_QUEUE = 64  # segments waiting for comparison before further ones are dropped
+
+
+class R2HShadowInputEnd(Exception):
+    """
+    raised from getch when the candidate engine of `R2HShadow` reads past the input recorded for a segment
+    """
+
+
+class R2HShadow:
+    """
+    run a candidate engine beside a primary engine on a sampled fraction of conversion streams, comparing every step off the hot path
+
+    - candidate and primary are engines, or names of engines for `get_engine()`; primary produces the output.
+    - sample is the fraction of streams to compare, chosen at random (with seed, reproducibly).
+    - log is a text file to which divergences and the final summary are written as lines of JSON; by default stderr.
+
+    each conversion stream gets its own engine from `stream()`. for a sampled stream, this records the input the primary engine reads and the number of steps it takes, and hands them over with the state they started from to a background thread every `R2H_SHADOW_SEGMENT` steps and at the end of the stream. the thread replays each segment through both engines from the same starting state, comparing the input read and the ch, ibuf, state, obuf, and flags returned after every step. the first divergence in a segment is logged with the input since both engines last had empty buffers and the ibuf, state, obuf, and flags at that point, which together reproduce it, and with the relative speed of the engines so far.
+
+    both engines are timed on the same replay in the CPU time of the comparison thread, so the ratio is not skewed by the recording or by the threads taking turns. on the hot path, each step of a sampled stream costs one extra call and append per character read and a step count; `python3 r2h_bench.py shadow` measures this. the comparison thread still competes for the interpreter with the conversions, so sample sparingly on busy processes; when it falls `R2H_SHADOW_QUEUE` segments behind, further segments are dropped rather than waited for, and counted in `report()`. streams which are not sampled get the primary engine itself.
+    """
+
+    def __init__(self, candidate, primary=r2h, sample=1.0, log=None, seed=None):
+        self.candidate, self.primary = get_engine(candidate), get_engine(primary)
+        self.sample, self.log = sample, log
+        self.random = random.Random(seed)
+        self.segments = queue.Queue(R2H_SHADOW_QUEUE)
+        self.lock = threading.Lock()
+        self.counts = dict(
+            streams=0, sampled=0, steps=0, segments=0, dropped=0, divergences=0
+        )
+        self.seconds = dict(primary=0.0, candidate=0.0)
+        self.thread = threading.Thread(target=self.compare_segments, daemon=True)
+        self.thread.start()
+
+    def stream(self):
+        """
+        engine for one conversion stream, with the same calling convention as `r2h()`
+        """
+        with self.lock:
+            self.counts["streams"] += 1
+            if self.random.random() >= self.sample:
+                return self.primary
+            self.counts["sampled"] += 1
+        primary, read, steps, start, source = self.primary, [], 0, ("", "", "", 0), None
+        append = read.append
+
+        def recording_getch():
+            ch = source()
+            append(ch)
+            return ch
+
+        def shadowed(*, ibuf, state, obuf, flags, getch):
+            nonlocal steps, start, source
+            source = getch  # callers pass the same getch every step, so no wrapper is made per step
+            ch, ibuf, state, obuf, flags = primary(
+                ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=recording_getch
+            )
+            steps += 1
+            if (ch == "") or (steps >= R2H_SHADOW_SEGMENT):
+                self.submit(start, "".join(read), steps, ch == "")
+                read.clear()
+                steps, start = 0, (ibuf, state, obuf, flags)
+            return ch, ibuf, state, obuf, flags
+
+        return shadowed
+
+    def submit(self, start, text, steps, final):
+        try:
+            self.segments.put_nowait((start, text, steps, final))
+        except queue.Full:
+            with self.lock:
+                self.counts["dropped"] += 1
+
+    def compare_segments(self):
+        while (segment := self.segments.get()) is not None:
+            try:
+                self.compare(*segment)
+            except Exception as e:  # a failing candidate must not stop the comparisons
+                self.write(dict(error=f"{type(e).__name__}: {e}"))
+
+    def replay(self, engine, start, text, steps, final):
+        """
+        run engine for the given number of steps from the start state, reading text; yields the input read so far and the values returned after each step, then the CPU time taken
+        """
+        position = 0
+
+        def getch():
+            nonlocal position
+            if position < len(text):
+                position += 1
+                return text[position - 1]
+            if final:
+                return ""
+            raise R2HShadowInputEnd()
+
+        ibuf, state, obuf, flags = start
+        t = time.thread_time()
+        for _ in range(steps):
+            try:
+                result = list(
+                    engine(ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch)
+                )
+            except R2HShadowInputEnd:
+                result = ["read past the recorded input"]
+            yield position, result
+            if len(result) == 1:
+                break
+            ch, ibuf, state, obuf, flags = result
+        yield time.thread_time() - t
+
+    def compare(self, start, text, steps, final):
+        """
+        replay one recorded segment of a stream through both engines, timing each, and log the first divergence
+        """
+        *expected_steps, primary_seconds = self.replay(self.primary, start, text, steps, final)
+        candidate_steps = self.replay(self.candidate, start, text, steps, final)
+        reset, reset_state = 0, start
+        for n, ((expected_position, expected), (position, actual)) in enumerate(
+            zip(expected_steps, candidate_steps)
+        ):
+            if (actual != expected) or (position != expected_position):
+                break
+            ch, ibuf, state, obuf, flags = actual
+            if not (ibuf or state or obuf):
+                reset, reset_state = position, (ibuf, state, obuf, flags)
+        else:
+            n, actual = None, None
+        candidate_seconds = next(candidate_steps) if n is None else None
+        with self.lock:
+            self.counts["segments"] += 1
+            self.counts["steps"] += len(expected_steps) if n is None else n + 1
+            if candidate_seconds is not None:  # only segments compared to the end are timed
+                self.seconds["primary"] += primary_seconds
+                self.seconds["candidate"] += candidate_seconds
+            if n is None:
+                return
+            self.counts["divergences"] += 1
+        self.write(
+            dict(
+                divergence=dict(
+                    step=n,
+                    context=text[reset:expected_position],
+                    start=reset_state,
+                    primary=expected,
+                    primary_read=expected_position,
+                    candidate=actual,
+                    candidate_read=position,
+                ),
+                candidate_time_ratio=self.time_ratio(),
+            )
+        )
+
+    def time_ratio(self):
+        return self.seconds["candidate"] / max(self.seconds["primary"], 1e-9)
+
+    def write(self, record):
+        print(json.dumps(record), file=self.log or sys.stderr, flush=True)
+
+    def report(self):
+        """
+        the counts of streams, sampled streams, steps and segments compared, segments dropped, and divergences, with the time each engine spent on the compared steps, as a dict
+        """
+        with self.lock:
+            return dict(
+                **self.counts,
+                primary_seconds=self.seconds["primary"],
+                candidate_seconds=self.seconds["candidate"],
+                candidate_time_ratio=self.time_ratio(),
+            )
+
+    def close(self):
+        """
+        finish comparing the segments already handed over, stop the background thread, and log and return `report()`
+        """
+        self.segments.put(None)
+        self.thread.join()
+        report = self.report()
+        self.write(dict(shadow=report))
+        return report
+
+
+R2H_SQLITE_CACHE_SIZE = 1 << 16  # distinct values whose conversions are remembered
+
+
+class R2HSqliteAggregate:
+    """
+    `sqlite3` aggregate converting the values of a group as a single stream of romaji, in the order they are stepped, see `register_sqlite()`
+    """
+
+    def __init__(self, r2h=r2h_compiled):
+        self.r2h, self.form = r2h, "halfwidth"
+        self.converted = []
+        self.conversion = ("", "", "", "", 0)
+
+    def step(self, romaji, form="halfwidth"):
+        if romaji is None:
+            return
+        self.form = form
+        pending, ibuf, state, obuf, flags = self.conversion
+        converted, *self.conversion = r2h_chunk(
+            str(romaji),
+            False,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.engine(form),
+        )
+        self.converted.append(converted)
+
+    def engine(self, form):
+        if form == "halfwidth":
+            return self.r2h
+        return functools.partial(r2h_output_form, form=form, r2h=self.r2h)
+
+    def finalize(self):
+        if not self.converted:
+            return None
+        pending, ibuf, state, obuf, flags = self.conversion
+        converted, *_ = r2h_chunk(
+            "",
+            True,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.engine(self.form),
+        )
+        return "".join(self.converted) + converted
+
+
+def register_sqlite(
+    connection, name="r2h", r2h=r2h_compiled, cache_size=R2H_SQLITE_CACHE_SIZE
+):
+    """
+    register conversion functions with a `sqlite3` connection, so that `UPDATE t SET kana = r2h(romaji)` converts inside the database
+
+    - name(romaji) and name(romaji, form) are deterministic scalar functions converting each value like `r2hs()`, where form is one of `OUTPUT_FORMS`; NULL stays NULL.
+    - name_stream(romaji) and name_stream(romaji, form) are aggregates which convert the values of each group as one stream, in the order they are stepped, so that romaji split across rows converts as if it were joined up.
+    - r2h is the conversion engine, or the name of one for `get_engine()`.
+    - cache_size is the number of distinct values whose conversions are kept in a least recently used cache shared by the scalar functions, which is cleared when the rules change.
+
+    the return value is the cached conversion function, whose `cache_info()` shows how well the cache is working.
+
+    the scalar functions are declared deterministic where SQLite supports it, so they can be used in indexes and generated columns, and SQLite may skip calling them again for the same arguments within a statement; the cache also skips converting values seen in earlier statements and rows.
+    """
+    import sqlite3  # not included in every Python build
+
+    r2h = get_engine(r2h)
+
+    @functools.lru_cache(maxsize=cache_size)
+    def convert(romaji, form="halfwidth"):
+        return r2hs(romaji, r2h=r2h, form=form)
+
+    rules_version = R2H_RULES_VERSION
+
+    def function(romaji, form="halfwidth"):
+        nonlocal rules_version
+        if romaji is None:
+            return None
+        if rules_version != R2H_RULES_VERSION:  # conversions cached before `register_rules()` or `clear_rules()`
+            convert.cache_clear()
+            rules_version = R2H_RULES_VERSION
+        return convert(str(romaji), form)
+
+    for n_args in (1, 2):
+        try:
+            connection.create_function(name, n_args, function, deterministic=True)
+        except sqlite3.NotSupportedError:  # SQLite before 3.8.3
+            connection.create_function(name, n_args, function)
+    for n_args in (1, 2):
+        connection.create_aggregate(
+            f"{name}_stream", n_args, functools.partial(R2HSqliteAggregate, r2h)
+        )
+    return convert
+
+
+class R2HSpeculation:
+    """
+    early-commit conversion of keystrokes: the output for romaji still pending is shown straight away, and corrected with backspaces if later keystrokes change it
+
+    - r2h is the conversion engine, or the name of one for `get_engine()`.
+    - erase is the character used to erase speculative output; a pseudo-terminal's line editing erases with `RUBOUT_A` unless configured otherwise.
+
+    `feed()` takes the keystrokes read so far and returns the text to show. the speculative part is the output the pending romaji would produce if the input ended there (so a pending `n` shows as `ﾝ`, and a pending `ky`, which has no likely conversion of its own yet, as itself). when the conversion turns out differently, just enough of the speculative output is erased and replaced, so that once every backspace is applied the text shown always matches normal conversion of the keystrokes so far.
+
+    the counters in `report()` measure how often the speculation had to be corrected.
+    """
+
+    def __init__(self, r2h=r2h_compiled, erase=BACKSPACE_A):
+        self.r2h, self.erase = get_engine(r2h), erase
+        self.conversion = ("", "", "", "", 0)
+        self.shown = ""  # speculative output which has been shown
+        self.feeds, self.speculations, self.corrections, self.erased = 0, 0, 0, 0
+
+    def feed(self, keys, final=False):
+        """
+        convert more keystrokes, returning the text to show, which may start with backspaces erasing speculative output shown before
+        """
+        pending, ibuf, state, obuf, flags = self.conversion
+        converted, *self.conversion = r2h_chunk(
+            keys,
+            final,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.r2h,
+        )
+        speculative = "" if final else self.speculate()
+        target = converted + speculative
+        if (BACKSPACE_A in converted) or (RUBOUT_A in converted):
+            common = 0  # erasing committed output, so take back all the speculation first
+        else:
+            common = len(os.path.commonprefix([self.shown, target]))
+        erase = len(self.shown) - common
+        self.feeds += 1
+        self.speculations += bool(speculative)
+        self.corrections += bool(erase)
+        self.erased += erase
+        self.shown = speculative
+        return self.erase * erase + target[common:]
+
+    def speculate(self):
+        """
+        the output the pending romaji would produce if the input ended now, or nothing when that would erase output
+        """
+        pending, ibuf, state, obuf, flags = self.conversion
+        speculative, *_ = r2h_chunk(
+            "",
+            True,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.r2h,
+        )
+        if (BACKSPACE_A in speculative) or (RUBOUT_A in speculative):
+            return ""
+        return speculative
+
+    def report(self):
+        """
+        the numbers of feeds, feeds showing speculative output, feeds correcting earlier speculative output, and characters erased, with the correction rate, as a dict
+        """
+        return dict(
+            feeds=self.feeds,
+            speculations=self.speculations,
+            corrections=self.corrections,
+            erased=self.erased,
+            correction_rate=self.corrections / max(self.speculations, 1),
+        )
+
+
+R2H_RULE_MAX_LEN = 4  # longest romaji accepted by `register_rules()`, which bounds the conversion state
+R2H_RULES_LOCK = threading.Lock()  # held while the rules and the tables derived from them are replaced
+R2H_RULES_VERSION = 0  # counts the times the rules have changed, so caches of conversions can tell when to forget them
+
+
+def r2h_rule_prefixes(romaji):
+    """
+    check romaji for `register_rules()` against the built-in rules, returning how many of its leading characters the built-in rules leave pending
+
+    romaji-to-romaji rewriting of romaji with the built-in rules may only leave characters pending, pass them through unconverted, or fail and retry them; ValueError is raised when a built-in rule converts any part of romaji, or is still pending at its end.
+    """
+    r2k_starts = {start[:1] for start in expand_1_1_starts(*ALL_1_1_STARTS_R)}
+    pending, prefix, rest = None, "", romaji
+    while rest:
+        ch, rest = rest[0], rest[1:]
+        step = r2r_step(prefix, ch, extensions=False)
+        if step == (prefix + ch, "", ""):
+            prefix += ch
+            continue
+        if pending is None:
+            pending = len(prefix)
+        if prefix and step == ("", prefix[:1], prefix[1:] + ch):
+            prefix, rest = "", step[2] + rest
+        elif prefix or step != ("", ch, "") or ch in r2k_starts or ch == HYPHEN_MINUS_A:
+            raise ValueError(
+                f"register_rules: {repr(romaji)} conflicts with the built-in rule for {repr(prefix + ch)}"
+            )
+    if prefix:
+        raise ValueError(
+            f"register_rules: {repr(romaji)} ends part way through the built-in rules for {repr(prefix)}"
+        )
+    return pending
+
+
+def register_rules(rules):
+    """
+    add site-specific rules converting romaji to halfwidth katakana, for example `register_rules({"~": "ｰ"})`
+
+    - rules maps romaji, which is matched case-insensitively and may be up to `R2H_RULE_MAX_LEN` printable ASCII characters, to the halfwidth katakana in `ALL_K` it converts to.
+
+    the rules are checked before any is added: ValueError is raised when one conflicts with a built-in rule (see `r2h_rule_prefixes()`), with a rule added earlier, or with another of the rules, or when its kana is not in `ALL_K`.
+
+    the rules are merged into `r2r_step()`, and so into the dispatch tables of `r2h_compiled()` and `r2h_table()`, which are rebuilt (or loaded from the cache for the same rules), so the cost per character stays the same however many rules are added. see `rebuild_r2h_tables()` for how conversions running in other threads meanwhile are affected; rules should still be registered before starting conversions, since conversions in progress may hold state which the new tables do not have.
+    """
+    global R2R_EXTENSION_RULES
+    with R2H_RULES_LOCK:
+        added, added_prefixes, added_only_prefixes = R2R_EXTENSION_RULES
+        romaji_k = dict(zip(ALL_K, expand_1_1_starts(*ALL_1_1_STARTS_R)))
+        extensions, prefixes, only_prefixes = {}, set(), set()
+        for romaji, kana in rules.items():
+            lromaji = romaji.lower()
+            if not (
+                0 < len(lromaji) <= R2H_RULE_MAX_LEN
+                and lromaji.isascii()
+                and lromaji.isprintable()
+                and not any(ch.isspace() for ch in lromaji)
+            ):
+                raise ValueError(
+                    f"register_rules: {repr(romaji)} is not 1 to {R2H_RULE_MAX_LEN} printable ASCII characters"
+                )
+            if not (kana and all(k in romaji_k for k in kana)):
+                raise ValueError(
+                    f"register_rules: {repr(kana)} for {repr(romaji)} is not halfwidth katakana from ALL_K"
+                )
+            starts = {lromaji[:i] for i in range(1, len(lromaji))}
+            taken = added.keys() | extensions.keys()
+            if (
+                (lromaji in taken)
+                or (lromaji in added_prefixes)
+                or (lromaji in prefixes)
+                or (starts & taken)
+            ):
+                raise ValueError(
+                    f"register_rules: {repr(romaji)} conflicts with another added rule"
+                )
+            pending = r2h_rule_prefixes(lromaji)
+            extensions[lromaji] = "".join(romaji_k[k] for k in kana)
+            prefixes |= starts
+            only_prefixes |= {start for start in starts if len(start) > pending}
+        R2R_EXTENSION_RULES = (
+            {**added, **extensions},
+            added_prefixes | prefixes,
+            added_only_prefixes | only_prefixes,
+        )
+        rebuild_r2h_tables()
+
+
+def clear_rules():
+    """
+    remove the rules added by `register_rules()`
+    """
+    global R2R_EXTENSION_RULES
+    with R2H_RULES_LOCK:
+        R2R_EXTENSION_RULES = ({}, frozenset(), frozenset())
+        rebuild_r2h_tables()
+
+
+def rebuild_r2h_tables():
+    """
+    rebuild the dispatch tables of `r2h_compiled()` and `r2h_table()` after the rules have changed, with the buffer bounds derived from them, and forget cached conversions
+
+    the functions stay the same objects, so engines already passed around pick up the new rules. each engine reads its tables from a single global once per call, and the new tables are built completely before that global is replaced, so a conversion running in another thread meanwhile uses either the old or the new tables for each call, never a mixture.
+    """
+    global R2H_COMPILED_CODE, R2H_TABLE_DATA, R2H_TABLES, R2H_RULES_VERSION
+    global R2H_MAX_IBUF, R2H_MAX_STATE, R2H_MAX_OBUF
+    R2H_COMPILED_CODE = r2h_compiled_code()
+    rebuilt = load_r2h_compiled(R2H_COMPILED_CODE).__globals__
+    namespace = r2h_compiled.__globals__
+    namespace["R2H_COMPILED_TABLES"] = rebuilt["R2H_COMPILED_TABLES"]
+    namespace["R2R"], namespace["R2K"] = rebuilt["R2H_COMPILED_TABLES"]
+    R2H_TABLE_DATA = r2h_table_data()
+    R2H_TABLES = load_r2h_tables(R2H_TABLE_DATA)
+    R2H_MAX_IBUF, R2H_MAX_STATE, R2H_MAX_OBUF = r2h_buffer_bounds()
+    R2H_RULES_VERSION += 1
+    r2h_check_cached.cache_clear()
+    r2h_recognizer.cache_clear()
+
+
+R2H_SESSION_SLOT = 24  # bytes of conversion state stored inline for each session, see `R2HSessionManager`
+R2H_SESSION_CLOSED = 0xFE  # size of a closed session's slot
+R2H_SESSION_OVERFLOW = 0xFF  # size of the slot of a session whose state is in the overflow dict
+
+
+class R2HSessionManager:
+    """
+    conversion streams for many concurrent sessions, for example one per connected user of a chat gateway, with the state of every session packed into arrays indexed by session id
+
+    - sessions is the number of sessions to allocate up front, with ids from 0; `open()` adds more.
+    - r2h is the conversion engine, or the name of one for `get_engine()`, and form is one of `OUTPUT_FORMS`.
+
+    between feeds a session's state is the pending input, ibuf, state, and obuf from `r2h_chunk()`, stored as UTF-8 after their lengths in a slot of `R2H_SESSION_SLOT` bytes, and its flags, in an array of 64-bit integers; so each session costs `R2H_SESSION_SLOT` + 9 bytes, and no Python objects. state which does not fit in a slot, which even adversarial input rarely needs, is kept in the overflow dict instead.
+
+    the ids of closed sessions are marked in the array of slot sizes, and using one before `open()` returns it again raises ValueError.
+    """
+
+    def __init__(self, sessions=0, r2h=r2h_compiled, form="halfwidth"):
+        r2h = get_engine(r2h)
+        if form != "halfwidth":
+            r2h = functools.partial(r2h_output_form, form=form, r2h=r2h)
+        self.r2h = r2h
+        self.sizes = bytearray(sessions)  # bytes used in each slot, or R2H_SESSION_CLOSED or R2H_SESSION_OVERFLOW
+        self.slots = bytearray(R2H_SESSION_SLOT * sessions)
+        self.flags = array.array("Q", bytes(8 * sessions))
+        self.overflow = {}
+        self.free = []  # ids of closed sessions, reused by `open()`
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def open(self):
+        """
+        the id of a new session, reusing that of a closed session where possible
+        """
+        if self.free:
+            session_id = self.free.pop()
+            self.sizes[session_id] = 0
+            self.flags[session_id] = 0
+            return session_id
+        self.sizes.append(0)
+        self.slots += bytes(R2H_SESSION_SLOT)
+        self.flags.append(0)
+        return len(self.sizes) - 1
+
+    def close(self, session_id):
+        """
+        end a session, returning the conversion of its pending romaji; its id may be reused by `open()`
+        """
+        (flushed,) = self.drain([session_id])
+        self.sizes[session_id] = R2H_SESSION_CLOSED
+        self.free.append(session_id)
+        return flushed
+
+    def load(self, session_id):
+        """
+        the pending input, ibuf, state, obuf, and flags of a session, as for `r2h_chunk()`
+        """
+        size = self.sizes[session_id]
+        if size == R2H_SESSION_CLOSED:
+            raise ValueError(f"R2HSessionManager: session {session_id} is closed")
+        if size == R2H_SESSION_OVERFLOW:
+            return self.overflow[session_id]
+        if not size:
+            return "", "", "", "", self.flags[session_id]
+        start = R2H_SESSION_SLOT * session_id
+        n_pending, n_ibuf, n_state = self.slots[start : start + 3]
+        data = self.slots[start + 3 : start + size].decode("utf-8", "surrogatepass")
+        n_ibuf += n_pending
+        n_state += n_ibuf
+        return (
+            data[:n_pending],
+            data[n_pending:n_ibuf],
+            data[n_ibuf:n_state],
+            data[n_state:],
+            self.flags[session_id],
+        )
+
+    def store(self, session_id, pending, ibuf, state, obuf, flags):
+        """
+        set the state of a session, see `load()`
+        """
+        if self.sizes[session_id] == R2H_SESSION_CLOSED:
+            raise ValueError(f"R2HSessionManager: session {session_id} is closed")
+        self.flags[session_id] = flags
+        self.overflow.pop(session_id, None)
+        data = (pending + ibuf + state + obuf).encode("utf-8", "surrogatepass")
+        if not data:
+            self.sizes[session_id] = 0
+        elif 3 + len(data) <= R2H_SESSION_SLOT:
+            start = R2H_SESSION_SLOT * session_id
+            self.slots[start : start + 3 + len(data)] = (
+                bytes((len(pending), len(ibuf), len(state))) + data
+            )
+            self.sizes[session_id] = 3 + len(data)
+        else:
+            self.sizes[session_id] = R2H_SESSION_OVERFLOW
+            self.overflow[session_id] = pending, ibuf, state, obuf, flags
+
+    def feed(self, session_id, text, final=False):
+        """
+        convert the next text of a session, returning the converted text; final ends the session's stream, converting its pending romaji too, and leaves it ready for a new stream
+        """
+        pending, ibuf, state, obuf, flags = self.load(session_id)
+        converted, *conversion = r2h_chunk(
+            text,
+            final,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=self.r2h,
+        )
+        self.store(session_id, *conversion)
+        return converted
+
+    def feed_many(self, items, final=False):
+        """
+        feed each (session id, text) pair of items in turn, returning a list of the converted texts
+        """
+        feed = self.feed
+        return [feed(session_id, text, final) for session_id, text in items]
+
+    def drain(self, session_ids):
+        """
+        convert the pending romaji of each of session_ids, as at the end of a message, returning a list of the conversions
+        """
+        feed = self.feed
+        return [feed(session_id, "", True) for session_id in session_ids]
+
+    def nbytes(self):
+        """
+        bytes of session state held, not counting the overflow dict's own overhead
+        """
+        return (
+            len(self.sizes)
+            + len(self.slots)
+            + self.flags.itemsize * len(self.flags)
+            + sum(len("".join(value[:4])) * 4 for value in self.overflow.values())
+        )
 
-    ch, ibuf_r2k, state_r2k, obuf_r2k, flags_r2k = r2k_one_to_one(
-        ibuf=ibuf_r2k, state=state_r2k, obuf=obuf_r2k, flags=flags_r2k, getch=getch_r2r
-    )
-    ibuf = "".join(
-        [
-            (ibuf_r2k[i : 1 + i] or UNUSED_R2R) + (ibuf_r2r[i : 1 + i] or UNUSED_R2R)
-            for i in range(max(len(ibuf_r2k), len(ibuf_r2r)))
-        ]
-    )
-    state = "".join(
-        [
-            (state_r2k[i : 1 + i] or UNUSED_R2R) + (prefix[i : 1 + i] or UNUSED_R2R)
-            for i in range(max(len(state_r2k), len(prefix)))
-        ]
-    )
-    obuf = "".join(
-        [
-            (obuf_r2k[i : 1 + i] or UNUSED_R2R) + (obuf_r2r[i : 1 + i] or UNUSED_R2R)
-            for i in range(max(len(obuf_r2k), len(obuf_r2r)))
-        ]
-    )
-    flags = flags_r2k | (flags_r2r << 8)
-    return ch, ibuf, state, obuf, flags
 
+import csv
 
-def r2hs(s, r2h=r2h):
+R2H_RECORD_BATCH = 4096  # records read, converted, and written at a time
+R2H_FIELD_CACHE_SIZE = 1 << 16  # distinct field values whose conversions are remembered
+
+
+def r2h_values(values, cache, r2h=r2h_compiled, form="halfwidth", executor=None):
     """
-    convert romaji in the input string to halfwidth katakana. see `r2h()` for a list of supported conversions
+    convert each of values independently like `r2hs()`, returning a list of the results
+
+    - cache is a dict of conversions which is consulted and updated, and cleared when it would grow past `R2H_FIELD_CACHE_SIZE` entries or the rules have changed since it was filled; it keeps the `R2H_RULES_VERSION` of its conversions under the key None.
+    - executor is an optional `concurrent.futures.Executor` converting the distinct values not in cache in parallel with `r2hs_batch()`; r2h must then be picklable, for example the name of an engine.
     """
-    o = ""
+    if cache.get(None) != R2H_RULES_VERSION:
+        cache.clear()
+        cache[None] = R2H_RULES_VERSION
+    todo = list(dict.fromkeys(value for value in values if value not in cache))
+    if todo:
+        if len(cache) + len(todo) > R2H_FIELD_CACHE_SIZE:
+            cache.clear()
+        if executor is None:
+            converted = [r2hs(value, r2h=r2h, form=form) for value in todo]
+        else:
+            converted = r2hs_batch(todo, r2h=r2h, form=form, executor=executor)
+        cache.update(zip(todo, converted))
+    return [cache[value] for value in values]
 
-    def getch():
-        nonlocal s
-        ch, s = s[:1], s[1:]
-        return ch
 
-    ibuf, state, obuf, flags = "", "", "", 0
-    while True:
-        ch, ibuf, state, obuf, flags = r2h(
-            ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+def r2h_csv(source, sink, fields, r2h=r2h_compiled, form="halfwidth", executor=None):
+    """
+    copy CSV from source to sink, converting only the values of the named fields
+
+    - source and sink are text files, source opened with newline="" so that quoted line breaks are kept.
+    - fields are names from the header row; ValueError is raised if any is missing.
+    - r2h, form, and executor are as for `r2h_values()`.
+
+    records are parsed and written by `csv` `R2H_RECORD_BATCH` at a time, so memory stays bounded however large the file; rows are written with "\n" line endings and quoting only where needed.
+    """
+    reader = csv.reader(source)
+    writer = csv.writer(sink, lineterminator="\n")
+    header = next(reader, None)
+    if header is None:
+        return
+    missing = [field for field in fields if field not in header]
+    if missing:
+        raise ValueError(f"r2h_csv: no field {', '.join(map(repr, missing))} in header")
+    writer.writerow(header)
+    columns = [header.index(field) for field in fields]
+    cache = {}
+    for rows in iter(lambda: list(itertools.islice(reader, R2H_RECORD_BATCH)), []):
+        places = [(row, i) for row in rows for i in columns if i < len(row)]
+        converted = r2h_values(
+            [row[i] for row, i in places], cache, r2h=r2h, form=form, executor=executor
+        )
+        for (row, i), value in zip(places, converted):
+            row[i] = value
+        writer.writerows(rows)
+
+
+def r2h_jsonl(source, sink, keys, r2h=r2h_compiled, form="halfwidth", executor=None):
+    """
+    copy JSON Lines from source to sink, converting only the string values of the named top-level keys of each object
+
+    - source and sink are text files.
+    - r2h, form, and executor are as for `r2h_values()`.
+
+    records are parsed and written by `json` `R2H_RECORD_BATCH` at a time, so memory stays bounded however large the file. lines with no value changed by the conversion, including blank lines, are copied unchanged; other records are written back with non-ASCII characters unescaped, and the line ending they had, if any.
+    """
+    cache = {}
+    for lines in iter(lambda: list(itertools.islice(source, R2H_RECORD_BATCH)), []):
+        records = [json.loads(line) if line.strip() else None for line in lines]
+        places = [
+            (record, key)
+            for record in records
+            if isinstance(record, dict)
+            for key in keys
+            if isinstance(record.get(key), str)
+        ]
+        converted = r2h_values(
+            [record[key] for record, key in places],
+            cache,
+            r2h=r2h,
+            form=form,
+            executor=executor,
+        )
+        changed = set()
+        for (record, key), value in zip(places, converted):
+            if record[key] != value:
+                record[key] = value
+                changed.add(id(record))
+        sink.writelines(
+            json.dumps(record, ensure_ascii=False) + line[len(line.rstrip("\r\n")) :]
+            if id(record) in changed
+            else line
+            for line, record in zip(lines, records)
         )
-        o += ch
-        if ch == "":
-            break
-    return o
 
 
-def smoketest():
+def smoketest(generated=None):
+    """
+    quick checks run at import; generated are the engines derived from the rule tables to check against the reference engines, by default `r2h_compiled()` and `r2h_table()`
+    """
+    if generated is None:
+        generated = (r2h_compiled, r2h_table)
     romaji_specimen = " ".join(
         """
   . [ ] , / wo xa xi xu xe xo xya xyu xyo xtu
@@ -877,6 +3993,7 @@ def smoketest():
         r2k_one_to_one_fast,
         r2k_one_to_one,
         r2h,
+        *generated,
     ):
         r2ks = lambda s: r2hs(s, r2h=r2k_one_to_one_impl)
         assert r2ks("") == ""
@@ -1066,382 +4183,830 @@ def smoketest():
             == "ﾅﾆｬﾅﾝﾔﾅﾝﾆｬﾝﾝﾝﾝｯﾝｯﾝﾝﾝﾝﾝ~"
         )
     # tests from here onward may require romaji-to-romaji rewriting
-    for romaji, expected_kana in dict(
-        aiueoyayuyo="ｱｲｳｴｵﾔﾕﾖ",
-        _ye="ｲｪ",
-        __yi="ｲ",
-        kakikukekokyakyukyo="ｶｷｸｹｺｷｬｷｭｷｮ",
-        _qaqiqeqo="ｸｧｸｨｸｪｸｫ",
-        __qu="ｸ",
-        __cacicuceco="ｶｼｸｾｺ",
-        __kyikye="ｷｨｷｪ",
-        sasisusesosyasyusyesyo="ｻｼｽｾｿｼｬｼｭｼｪｼｮ",
-        __syi="ｼｨ",
-        shashishushesho="ｼｬｼｼｭｼｪｼｮ",
-        tatitutetotyatyutyetyo="ﾀﾁﾂﾃﾄﾁｬﾁｭﾁｪﾁｮ",
-        chachichuchecho="ﾁｬﾁﾁｭﾁｪﾁｮ",
-        _cyacyucyo="ﾁｬﾁｭﾁｮ",
-        __cyicye="ﾁｨﾁｪ",
-        naninunenonyanyunyo="ﾅﾆﾇﾈﾉﾆｬﾆｭﾆｮ",
-        __nyinye="ﾆｨﾆｪ",
-        hahihuhehohyahyuhyo="ﾊﾋﾌﾍﾎﾋｬﾋｭﾋｮ",
-        __hyihye="ﾋｨﾋｪ",
-        mamimumemomyamyumyo="ﾏﾐﾑﾒﾓﾐｬﾐｭﾐｮ",
-        __myimye="ﾐｨﾐｪ",
-        rarirureroryaryuryo="ﾗﾘﾙﾚﾛﾘｬﾘｭﾘｮ",
-        __ryirye="ﾘｨﾘｪ",
-        wawuwo="ﾜｳｦ",
-        nn="ﾝ",
-        n="ﾝ",
-        n_="ﾝ",
-        __xn="ﾝ",
-        __ln="ﾝ",
-        gagigugegogyagyugyo="ｶﾞｷﾞｸﾞｹﾞｺﾞｷﾞｬｷﾞｭｷﾞｮ",
-        __gyigye="ｷﾞｨｷﾞｪ",
-        zazizuzezozyazyuzyezyo="ｻﾞｼﾞｽﾞｾﾞｿﾞｼﾞｬｼﾞｭｼﾞｪｼﾞｮ",
-        __zyi="ｼﾞｨ",
-        jajijujejo="ｼﾞｬｼﾞｼﾞｭｼﾞｪｼﾞｮ",
-        _jyajyujyo="ｼﾞｬｼﾞｭｼﾞｮ",
-        __jyijye="ｼﾞｨｼﾞｪ",
-        dadidudedodyadyudyedyo="ﾀﾞﾁﾞﾂﾞﾃﾞﾄﾞﾁﾞｬﾁﾞｭﾁﾞｪﾁﾞｮ",
-        __dyi="ﾁﾞｨ",
-        babibubebobyabyubyo="ﾊﾞﾋﾞﾌﾞﾍﾞﾎﾞﾋﾞｬﾋﾞｭﾋﾞｮ",
-        __byibye="ﾋﾞｨﾋﾞｪ",
-        papipupepopyapyupyo="ﾊﾟﾋﾟﾌﾟﾍﾟﾎﾟﾋﾟｬﾋﾟｭﾋﾟｮ",
-        __pyipye="ﾋﾟｨﾋﾟｪ",
-        xaxixuxexoxtu="ｧｨｩｪｫｯ",
-        _xtsu="ｯ",
-        __laliluleloltu="ｧｨｩｪｫｯ",
-        __ltsu="ｯ",
-        kkaggissuttennotennnou="ｯｶｯｷﾞｯｽｯﾃﾝｵﾃﾝﾉｳ",
-        ggakkizzudde="ｯｶﾞｯｷｯｽﾞｯﾃﾞ",
-        hhammirruwwo="ｯﾊｯﾐｯﾙｯｦ",
-        bbappixxuxxyo="ｯﾊﾞｯﾋﾟｯｩｯｮ",
-        xxxxtu="ｯｯｯｯ",
-        xyaxyuxyo="ｬｭｮ",
-        __xyi="ｨ",
-        __lyalyilyulyelyo="ｬｨｭｪｮ",
-        _wiwe="ｳｨｳｪ",
-        _whiwhewho="ｳｨｳｪｳｫ",
-        __whawhu="ｳｧｳ",
-        _vavivuvevovyu="ｳﾞｧｳﾞｨｳﾞｳﾞｪｳﾞｫｳﾞｭ",
-        __vyivyevyavyo="ｳﾞｨｳﾞｪｳﾞｬｳﾞｮ",
-        _kwakwikwekwo="ｸｧｸｨｸｪｸｫ",
-        __kwu="ｸｩ",
-        ___cwacwicwucwecwo="ｸｧｸｨｸｩｸｪｸｫ",
-        __qwaqwiqwuqweqwoqyaqyuqyo="ｸｧｸｨｸｩｸｪｸｫｸｬｸｭｸｮ",
-        _gwa="ｸﾞｧ",
-        __gwigwugwegwo="ｸﾞｨｸﾞｩｸﾞｪｸﾞｫ",
-        __swaswiswusweswozwazwizwuzwezwo="ｽｧｽｨｽｩｽｪｽｫｽﾞｧｽﾞｨｽﾞｩｽﾞｪｽﾞｫ",
-        tsatsutsetso="ﾂｧﾂﾂｪﾂｫ",
-        _tsi="ﾂｨ",
-        ___dzadzidzudzedzo="ﾂﾞｧﾂﾞｨﾂﾞﾂﾞｪﾂﾞｫ",
-        _twu="ﾄｩ",
-        _t_u="ﾄｩ",
-        __twatwitwetwo="ﾄｧﾄｨﾄｪﾄｫ",
-        thi="ﾃｨ",
-        _thu="ﾃｭ",
-        _t_it_yu="ﾃｨﾃｭ",
-        _dwu="ﾄﾞｩ",
-        _d_u="ﾄﾞｩ",
-        __dwadwidwedwo="ﾄﾞｧﾄﾞｨﾄﾞｪﾄﾞｫ",
-        dhidhu="ﾃﾞｨﾃﾞｭ",
-        _d_id_yu="ﾃﾞｨﾃﾞｭ",
-        __dhadhedho="ﾃﾞｬﾃﾞｪﾃﾞｮ",
-        fafifufefo="ﾌｧﾌｨﾌﾌｪﾌｫ",
-        _fyu="ﾌｭ",
-        __fyafyo="ﾌｬﾌｮ",
-        _hwahwihwehwo="ﾌｧﾌｨﾌｪﾌｫ",
-        __fwafwifwufwefwo="ﾌｧﾌｨﾌｩﾌｪﾌｫ",
-        __phaphiphuphepho="ﾌﾟｧﾌﾟｨﾌﾟｩﾌﾟｪﾌﾟｫ",
-    ).items():
-        romaji = "'".join(romaji.lstrip("_").split("_"))
+    for r2h_impl in (r2h, *generated):
+        r2ks = lambda s: r2hs(s, r2h=r2h_impl)
+        for romaji, expected_kana in dict(
+            aiueoyayuyo="ｱｲｳｴｵﾔﾕﾖ",
+            _ye="ｲｪ",
+            __yi="ｲ",
+            kakikukekokyakyukyo="ｶｷｸｹｺｷｬｷｭｷｮ",
+            _qaqiqeqo="ｸｧｸｨｸｪｸｫ",
+            __qu="ｸ",
+            __cacicuceco="ｶｼｸｾｺ",
+            __kyikye="ｷｨｷｪ",
+            sasisusesosyasyusyesyo="ｻｼｽｾｿｼｬｼｭｼｪｼｮ",
+            __syi="ｼｨ",
+            shashishushesho="ｼｬｼｼｭｼｪｼｮ",
+            tatitutetotyatyutyetyo="ﾀﾁﾂﾃﾄﾁｬﾁｭﾁｪﾁｮ",
+            chachichuchecho="ﾁｬﾁﾁｭﾁｪﾁｮ",
+            _cyacyucyo="ﾁｬﾁｭﾁｮ",
+            __cyicye="ﾁｨﾁｪ",
+            naninunenonyanyunyo="ﾅﾆﾇﾈﾉﾆｬﾆｭﾆｮ",
+            __nyinye="ﾆｨﾆｪ",
+            hahihuhehohyahyuhyo="ﾊﾋﾌﾍﾎﾋｬﾋｭﾋｮ",
+            __hyihye="ﾋｨﾋｪ",
+            mamimumemomyamyumyo="ﾏﾐﾑﾒﾓﾐｬﾐｭﾐｮ",
+            __myimye="ﾐｨﾐｪ",
+            rarirureroryaryuryo="ﾗﾘﾙﾚﾛﾘｬﾘｭﾘｮ",
+            __ryirye="ﾘｨﾘｪ",
+            wawuwo="ﾜｳｦ",
+            nn="ﾝ",
+            n="ﾝ",
+            n_="ﾝ",
+            __xn="ﾝ",
+            __ln="ﾝ",
+            gagigugegogyagyugyo="ｶﾞｷﾞｸﾞｹﾞｺﾞｷﾞｬｷﾞｭｷﾞｮ",
+            __gyigye="ｷﾞｨｷﾞｪ",
+            zazizuzezozyazyuzyezyo="ｻﾞｼﾞｽﾞｾﾞｿﾞｼﾞｬｼﾞｭｼﾞｪｼﾞｮ",
+            __zyi="ｼﾞｨ",
+            jajijujejo="ｼﾞｬｼﾞｼﾞｭｼﾞｪｼﾞｮ",
+            _jyajyujyo="ｼﾞｬｼﾞｭｼﾞｮ",
+            __jyijye="ｼﾞｨｼﾞｪ",
+            dadidudedodyadyudyedyo="ﾀﾞﾁﾞﾂﾞﾃﾞﾄﾞﾁﾞｬﾁﾞｭﾁﾞｪﾁﾞｮ",
+            __dyi="ﾁﾞｨ",
+            babibubebobyabyubyo="ﾊﾞﾋﾞﾌﾞﾍﾞﾎﾞﾋﾞｬﾋﾞｭﾋﾞｮ",
+            __byibye="ﾋﾞｨﾋﾞｪ",
+            papipupepopyapyupyo="ﾊﾟﾋﾟﾌﾟﾍﾟﾎﾟﾋﾟｬﾋﾟｭﾋﾟｮ",
+            __pyipye="ﾋﾟｨﾋﾟｪ",
+            xaxixuxexoxtu="ｧｨｩｪｫｯ",
+            _xtsu="ｯ",
+            __laliluleloltu="ｧｨｩｪｫｯ",
+            __ltsu="ｯ",
+            kkaggissuttennotennnou="ｯｶｯｷﾞｯｽｯﾃﾝｵﾃﾝﾉｳ",
+            ggakkizzudde="ｯｶﾞｯｷｯｽﾞｯﾃﾞ",
+            hhammirruwwo="ｯﾊｯﾐｯﾙｯｦ",
+            bbappixxuxxyo="ｯﾊﾞｯﾋﾟｯｩｯｮ",
+            xxxxtu="ｯｯｯｯ",
+            xyaxyuxyo="ｬｭｮ",
+            __xyi="ｨ",
+            __lyalyilyulyelyo="ｬｨｭｪｮ",
+            _wiwe="ｳｨｳｪ",
+            _whiwhewho="ｳｨｳｪｳｫ",
+            __whawhu="ｳｧｳ",
+            _vavivuvevovyu="ｳﾞｧｳﾞｨｳﾞｳﾞｪｳﾞｫｳﾞｭ",
+            __vyivyevyavyo="ｳﾞｨｳﾞｪｳﾞｬｳﾞｮ",
+            _kwakwikwekwo="ｸｧｸｨｸｪｸｫ",
+            __kwu="ｸｩ",
+            ___cwacwicwucwecwo="ｸｧｸｨｸｩｸｪｸｫ",
+            __qwaqwiqwuqweqwoqyaqyuqyo="ｸｧｸｨｸｩｸｪｸｫｸｬｸｭｸｮ",
+            _gwa="ｸﾞｧ",
+            __gwigwugwegwo="ｸﾞｨｸﾞｩｸﾞｪｸﾞｫ",
+            __swaswiswusweswozwazwizwuzwezwo="ｽｧｽｨｽｩｽｪｽｫｽﾞｧｽﾞｨｽﾞｩｽﾞｪｽﾞｫ",
+            tsatsutsetso="ﾂｧﾂﾂｪﾂｫ",
+            _tsi="ﾂｨ",
+            ___dzadzidzudzedzo="ﾂﾞｧﾂﾞｨﾂﾞﾂﾞｪﾂﾞｫ",
+            _twu="ﾄｩ",
+            _t_u="ﾄｩ",
+            __twatwitwetwo="ﾄｧﾄｨﾄｪﾄｫ",
+            thi="ﾃｨ",
+            _thu="ﾃｭ",
+            _t_it_yu="ﾃｨﾃｭ",
+            _dwu="ﾄﾞｩ",
+            _d_u="ﾄﾞｩ",
+            __dwadwidwedwo="ﾄﾞｧﾄﾞｨﾄﾞｪﾄﾞｫ",
+            dhidhu="ﾃﾞｨﾃﾞｭ",
+            _d_id_yu="ﾃﾞｨﾃﾞｭ",
+            __dhadhedho="ﾃﾞｬﾃﾞｪﾃﾞｮ",
+            fafifufefo="ﾌｧﾌｨﾌﾌｪﾌｫ",
+            _fyu="ﾌｭ",
+            __fyafyo="ﾌｬﾌｮ",
+            _hwahwihwehwo="ﾌｧﾌｨﾌｪﾌｫ",
+            __fwafwifwufwefwo="ﾌｧﾌｨﾌｩﾌｪﾌｫ",
+            __phaphiphuphepho="ﾌﾟｧﾌﾟｨﾌﾟｩﾌﾟｪﾌﾟｫ",
+        ).items():
+            romaji = "'".join(romaji.lstrip("_").split("_"))
+            assert (
+                r2ks(romaji) == expected_kana
+            ), f"r2ks({repr(romaji)}) failed, expected: \n {repr(expected_kana)}, but got:\n {repr(r2ks(romaji))}"
+        long_romaji_specimen = """
+         a  i  u  e  o  ya  yi  yu  ye  yo
+        ka ki ku ke ko kya kyi kyu kye kyo
+        sa si su se so sya syi syu sye syo
+        ta ti tu te to tya tyi tyu tye tyo
+        na ni nu ne no nya nyi nyu nye nyo
+        ha hi hu he ho hya hyi hyu hye hyo
+        ma mi mu me mo mya myi myu mye myo
+        ra ri ru re ro rya ryi ryu rye ryo
+        wa wi wu we wo
+
+        ga gi gu ge go gya gyi gyu gye gyo
+        za zi zu ze zo zya zyi zyu zye zyo
+        da di du de do dya dyi dyu dye dyo
+        ba bi bu be bo bya byi byu bye byo
+        pa pi pu pe po pya pyi pyu pye pyo
+
+               n        a-
+              n'         ^
+              nn       kka
+              xn       xxa
+              ln       lla
+
+          wha  whi  whu  whe  who
+          kwa  kwi  kwu  kwe  kwo
+           qa   qi   qu   qe   qo  qya       qyu       qyo
+          qwa  qwi  qwu  qwe  qwo
+          cwa  cwi  cwu  cwe  cwo
+           ca   ci   cu   ce   co  cya  cyi  cyu  cye  cyo
+          sha  shi  shu  she  sho
+          swa  swi  swu  swe  swo
+          cha  chi  chu  che  cho
+          tsa  tsi  tsu  tse  tso
+          tha  thi  thu  the  tho
+          twa  twi  twu  twe  two
+               t'i  t'u                     t'yu
+           fa   fi   fu   fe   fo  fya       fyu       fyo
+          hwa  hwi       hwe  hwo           hwyu
+          fwa  fwi  fwu  fwe  fwo
+
+           va   vi   vu   ve   vo  vya  vyi  vyu  vye  vyo
+          gwa  gwi  gwu  gwe  gwo
+           ja   ji   ju   je   jo  jya  jyi  jyu  jye  jyo
+          zwa  zwi  zwu  zwe  zwo
+          dza  dzi  dzu  dze  dzo
+          dha  dhi  dhu  dhe  dho
+          dwa  dwi  dwu  dwe  dwo
+               d'i  d'u                     d'yu
+          pha  phi  phu  phe  pho
+
+           xa   xi   xu   xe   xo  xya  xyi  xyu  xye  xyo
+                    xtu
+                   xtsu
+           la   li   lu   le   lo  lya  lyi  lyu  lye  lyo
+                    ltu
+                   ltsu
+        """
+        long_kana_specimen = """
+        ｱ   ｲ   ｳ   ｴ   ｵ   ﾔ   ｲ   ﾕ   ｲｪ  ﾖ
+        ｶ   ｷ   ｸ   ｹ   ｺ   ｷｬ  ｷｨ  ｷｭ  ｷｪ  ｷｮ
+        ｻ   ｼ   ｽ   ｾ   ｿ   ｼｬ  ｼｨ  ｼｭ  ｼｪ  ｼｮ
+        ﾀ   ﾁ   ﾂ   ﾃ   ﾄ   ﾁｬ  ﾁｨ  ﾁｭ  ﾁｪ  ﾁｮ
+        ﾅ   ﾆ   ﾇ   ﾈ   ﾉ   ﾆｬ  ﾆｨ  ﾆｭ  ﾆｪ  ﾆｮ
+        ﾊ   ﾋ   ﾌ   ﾍ   ﾎ   ﾋｬ  ﾋｨ  ﾋｭ  ﾋｪ  ﾋｮ
+        ﾏ   ﾐ   ﾑ   ﾒ   ﾓ   ﾐｬ  ﾐｨ  ﾐｭ  ﾐｪ  ﾐｮ
+        ﾗ   ﾘ   ﾙ   ﾚ   ﾛ   ﾘｬ  ﾘｨ  ﾘｭ  ﾘｪ  ﾘｮ
+        ﾜ   ｳｨ  ｳ   ｳｪ  ｦ
+
+        ｶﾞ  ｷﾞ  ｸﾞ  ｹﾞ  ｺﾞ  ｷﾞｬ ｷﾞｨ ｷﾞｭ ｷﾞｪ ｷﾞｮ
+        ｻﾞ  ｼﾞ  ｽﾞ  ｾﾞ  ｿﾞ  ｼﾞｬ ｼﾞｨ ｼﾞｭ ｼﾞｪ ｼﾞｮ
+        ﾀﾞ  ﾁﾞ  ﾂﾞ  ﾃﾞ  ﾄﾞ  ﾁﾞｬ ﾁﾞｨ ﾁﾞｭ ﾁﾞｪ ﾁﾞｮ
+        ﾊﾞ  ﾋﾞ  ﾌﾞ  ﾍﾞ  ﾎﾞ  ﾋﾞｬ ﾋﾞｨ ﾋﾞｭ ﾋﾞｪ ﾋﾞｮ
+        ﾊﾟ  ﾋﾟ  ﾌﾟ  ﾍﾟ  ﾎﾟ  ﾋﾟｬ ﾋﾟｨ ﾋﾟｭ ﾋﾟｪ ﾋﾟｮ
+
+                ﾝ           ｱｰ
+                ﾝ           ｰ
+                ﾝ          ｯｶ
+                ﾝ          ｯｧ
+                ﾝ          ｯｧ
+
+        ｳｧ  ｳｨ  ｳ   ｳｪ  ｳｫ
+        ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
+        ｸｧ  ｸｨ  ｸ   ｸｪ  ｸｫ  ｸｬ      ｸｭ      ｸｮ
+        ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
+        ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
+        ｶ   ｼ   ｸ   ｾ   ｺ   ﾁｬ  ﾁｨ  ﾁｭ  ﾁｪ  ﾁｮ
+        ｼｬ  ｼ   ｼｭ  ｼｪ  ｼｮ
+        ｽｧ  ｽｨ  ｽｩ  ｽｪ  ｽｫ
+        ﾁｬ  ﾁ   ﾁｭ  ﾁｪ  ﾁｮ
+        ﾂｧ  ﾂｨ  ﾂ   ﾂｪ  ﾂｫ
+        ﾃｬ  ﾃｨ  ﾃｭ  ﾃｪ  ﾃｮ
+        ﾄｧ  ﾄｨ  ﾄｩ  ﾄｪ  ﾄｫ
+            ﾃｨ  ﾄｩ                  ﾃｭ
+        ﾌｧ  ﾌｨ  ﾌ   ﾌｪ  ﾌｫ  ﾌｬ      ﾌｭ      ﾌｮ
+        ﾌｧ  ﾌｨ      ﾌｪ  ﾌｫ          ﾌｭ
+        ﾌｧ  ﾌｨ  ﾌｩ  ﾌｪ  ﾌｫ
+
+        ｳﾞｧ ｳﾞｨ ｳﾞ  ｳﾞｪ ｳﾞｫ ｳﾞｬ ｳﾞｨ ｳﾞｭ ｳﾞｪ ｳﾞｮ
+        ｸﾞｧ ｸﾞｨ ｸﾞｩ ｸﾞｪ ｸﾞｫ
+        ｼﾞｬ  ｼﾞ ｼﾞｭ ｼﾞｪ ｼﾞｮ ｼﾞｬ ｼﾞｨ ｼﾞｭ ｼﾞｪ ｼﾞｮ
+        ｽﾞｧ ｽﾞｨ ｽﾞｩ ｽﾞｪ ｽﾞｫ
+        ﾂﾞｧ ﾂﾞｨ ﾂﾞ  ﾂﾞｪ ﾂﾞｫ
+        ﾃﾞｬ ﾃﾞｨ ﾃﾞｭ ﾃﾞｪ ﾃﾞｮ
+        ﾄﾞｧ ﾄﾞｨ ﾄﾞｩ ﾄﾞｪ ﾄﾞｫ
+            ﾃﾞｨ ﾄﾞｩ                 ﾃﾞｭ
+        ﾌﾟｧ ﾌﾟｨ ﾌﾟｩ ﾌﾟｪ ﾌﾟｫ
+
+        ｧ   ｨ   ｩ   ｪ   ｫ   ｬ  ｨ  ｭ  ｪ  ｮ
+                ｯ
+                ｯ
+        ｧ   ｨ   ｩ   ｪ   ｫ   ｬ  ｨ  ｭ  ｪ  ｮ
+                ｯ
+                ｯ
+        """
         assert (
-            r2ks(romaji) == expected_kana
-        ), f"r2ks({repr(romaji)}) failed, expected: \n {repr(expected_kana)}, but got:\n {repr(r2ks(romaji))}"
-    long_romaji_specimen = """
-     a  i  u  e  o  ya  yi  yu  ye  yo
-    ka ki ku ke ko kya kyi kyu kye kyo
-    sa si su se so sya syi syu sye syo
-    ta ti tu te to tya tyi tyu tye tyo
-    na ni nu ne no nya nyi nyu nye nyo
-    ha hi hu he ho hya hyi hyu hye hyo
-    ma mi mu me mo mya myi myu mye myo
-    ra ri ru re ro rya ryi ryu rye ryo
-    wa wi wu we wo
-
-    ga gi gu ge go gya gyi gyu gye gyo
-    za zi zu ze zo zya zyi zyu zye zyo
-    da di du de do dya dyi dyu dye dyo
-    ba bi bu be bo bya byi byu bye byo
-    pa pi pu pe po pya pyi pyu pye pyo
-
-           n        a-
-          n'         ^
-          nn       kka
-          xn       xxa
-          ln       lla
-
-      wha  whi  whu  whe  who
-      kwa  kwi  kwu  kwe  kwo
-       qa   qi   qu   qe   qo  qya       qyu       qyo
-      qwa  qwi  qwu  qwe  qwo
-      cwa  cwi  cwu  cwe  cwo
-       ca   ci   cu   ce   co  cya  cyi  cyu  cye  cyo
-      sha  shi  shu  she  sho
-      swa  swi  swu  swe  swo
-      cha  chi  chu  che  cho
-      tsa  tsi  tsu  tse  tso
-      tha  thi  thu  the  tho
-      twa  twi  twu  twe  two
-           t'i  t'u                     t'yu
-       fa   fi   fu   fe   fo  fya       fyu       fyo
-      hwa  hwi       hwe  hwo           hwyu
-      fwa  fwi  fwu  fwe  fwo
-
-       va   vi   vu   ve   vo  vya  vyi  vyu  vye  vyo
-      gwa  gwi  gwu  gwe  gwo
-       ja   ji   ju   je   jo  jya  jyi  jyu  jye  jyo
-      zwa  zwi  zwu  zwe  zwo
-      dza  dzi  dzu  dze  dzo
-      dha  dhi  dhu  dhe  dho
-      dwa  dwi  dwu  dwe  dwo
-           d'i  d'u                     d'yu
-      pha  phi  phu  phe  pho
-
-       xa   xi   xu   xe   xo  xya  xyi  xyu  xye  xyo
-                xtu
-               xtsu
-       la   li   lu   le   lo  lya  lyi  lyu  lye  lyo
-                ltu
-               ltsu
-    """
-    long_kana_specimen = """
-    ｱ   ｲ   ｳ   ｴ   ｵ   ﾔ   ｲ   ﾕ   ｲｪ  ﾖ
-    ｶ   ｷ   ｸ   ｹ   ｺ   ｷｬ  ｷｨ  ｷｭ  ｷｪ  ｷｮ
-    ｻ   ｼ   ｽ   ｾ   ｿ   ｼｬ  ｼｨ  ｼｭ  ｼｪ  ｼｮ
-    ﾀ   ﾁ   ﾂ   ﾃ   ﾄ   ﾁｬ  ﾁｨ  ﾁｭ  ﾁｪ  ﾁｮ
-    ﾅ   ﾆ   ﾇ   ﾈ   ﾉ   ﾆｬ  ﾆｨ  ﾆｭ  ﾆｪ  ﾆｮ
-    ﾊ   ﾋ   ﾌ   ﾍ   ﾎ   ﾋｬ  ﾋｨ  ﾋｭ  ﾋｪ  ﾋｮ
-    ﾏ   ﾐ   ﾑ   ﾒ   ﾓ   ﾐｬ  ﾐｨ  ﾐｭ  ﾐｪ  ﾐｮ
-    ﾗ   ﾘ   ﾙ   ﾚ   ﾛ   ﾘｬ  ﾘｨ  ﾘｭ  ﾘｪ  ﾘｮ
-    ﾜ   ｳｨ  ｳ   ｳｪ  ｦ
-
-    ｶﾞ  ｷﾞ  ｸﾞ  ｹﾞ  ｺﾞ  ｷﾞｬ ｷﾞｨ ｷﾞｭ ｷﾞｪ ｷﾞｮ
-    ｻﾞ  ｼﾞ  ｽﾞ  ｾﾞ  ｿﾞ  ｼﾞｬ ｼﾞｨ ｼﾞｭ ｼﾞｪ ｼﾞｮ
-    ﾀﾞ  ﾁﾞ  ﾂﾞ  ﾃﾞ  ﾄﾞ  ﾁﾞｬ ﾁﾞｨ ﾁﾞｭ ﾁﾞｪ ﾁﾞｮ
-    ﾊﾞ  ﾋﾞ  ﾌﾞ  ﾍﾞ  ﾎﾞ  ﾋﾞｬ ﾋﾞｨ ﾋﾞｭ ﾋﾞｪ ﾋﾞｮ
-    ﾊﾟ  ﾋﾟ  ﾌﾟ  ﾍﾟ  ﾎﾟ  ﾋﾟｬ ﾋﾟｨ ﾋﾟｭ ﾋﾟｪ ﾋﾟｮ
-
-            ﾝ           ｱｰ
-            ﾝ           ｰ
-            ﾝ          ｯｶ
-            ﾝ          ｯｧ
-            ﾝ          ｯｧ
-
-    ｳｧ  ｳｨ  ｳ   ｳｪ  ｳｫ
-    ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
-    ｸｧ  ｸｨ  ｸ   ｸｪ  ｸｫ  ｸｬ      ｸｭ      ｸｮ
-    ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
-    ｸｧ  ｸｨ  ｸｩ  ｸｪ  ｸｫ
-    ｶ   ｼ   ｸ   ｾ   ｺ   ﾁｬ  ﾁｨ  ﾁｭ  ﾁｪ  ﾁｮ
-    ｼｬ  ｼ   ｼｭ  ｼｪ  ｼｮ
-    ｽｧ  ｽｨ  ｽｩ  ｽｪ  ｽｫ
-    ﾁｬ  ﾁ   ﾁｭ  ﾁｪ  ﾁｮ
-    ﾂｧ  ﾂｨ  ﾂ   ﾂｪ  ﾂｫ
-    ﾃｬ  ﾃｨ  ﾃｭ  ﾃｪ  ﾃｮ
-    ﾄｧ  ﾄｨ  ﾄｩ  ﾄｪ  ﾄｫ
-        ﾃｨ  ﾄｩ                  ﾃｭ
-    ﾌｧ  ﾌｨ  ﾌ   ﾌｪ  ﾌｫ  ﾌｬ      ﾌｭ      ﾌｮ
-    ﾌｧ  ﾌｨ      ﾌｪ  ﾌｫ          ﾌｭ
-    ﾌｧ  ﾌｨ  ﾌｩ  ﾌｪ  ﾌｫ
-
-    ｳﾞｧ ｳﾞｨ ｳﾞ  ｳﾞｪ ｳﾞｫ ｳﾞｬ ｳﾞｨ ｳﾞｭ ｳﾞｪ ｳﾞｮ
-    ｸﾞｧ ｸﾞｨ ｸﾞｩ ｸﾞｪ ｸﾞｫ
-    ｼﾞｬ  ｼﾞ ｼﾞｭ ｼﾞｪ ｼﾞｮ ｼﾞｬ ｼﾞｨ ｼﾞｭ ｼﾞｪ ｼﾞｮ
-    ｽﾞｧ ｽﾞｨ ｽﾞｩ ｽﾞｪ ｽﾞｫ
-    ﾂﾞｧ ﾂﾞｨ ﾂﾞ  ﾂﾞｪ ﾂﾞｫ
-    ﾃﾞｬ ﾃﾞｨ ﾃﾞｭ ﾃﾞｪ ﾃﾞｮ
-    ﾄﾞｧ ﾄﾞｨ ﾄﾞｩ ﾄﾞｪ ﾄﾞｫ
-        ﾃﾞｨ ﾄﾞｩ                 ﾃﾞｭ
-    ﾌﾟｧ ﾌﾟｨ ﾌﾟｩ ﾌﾟｪ ﾌﾟｫ
-
-    ｧ   ｨ   ｩ   ｪ   ｫ   ｬ  ｨ  ｭ  ｪ  ｮ
-            ｯ
-            ｯ
-    ｧ   ｨ   ｩ   ｪ   ｫ   ｬ  ｨ  ｭ  ｪ  ｮ
-            ｯ
-            ｯ
-    """
-    assert (
-        r2hs(long_romaji_specimen).split() == long_kana_specimen.split()
-    ), f"r2hs({repr(long_romaji_specimen)}) failed, expected: \n {repr(long_kana_specimen)}, but got:\n {repr(r2hs(long_romaji_specimen))}"
-    assert r2hs("Ra-men") == "ﾗｰﾒﾝ"
-    assert r2hs("cyocore-to") == "ﾁｮｺﾚｰﾄ"
-    assert r2hs("chokore-to") == "ﾁｮｺﾚｰﾄ"
-    assert r2hs("tyokore-to") == "ﾁｮｺﾚｰﾄ"
-    assert r2hs("chilyokore-to") == "ﾁｮｺﾚｰﾄ"
-    assert r2hs("KYANTO/BAI/MI-/RABU") == "ｷｬﾝﾄ･ﾊﾞｲ･ﾐｰ･ﾗﾌﾞ"
-    assert r2hs("byu-t'ifuru/sande-") == "ﾋﾞｭｰﾃｨﾌﾙ･ｻﾝﾃﾞｰ"
-    assert r2hs("BarakuZ/Obama") == "ﾊﾞﾗｸ･ｵﾊﾞﾏ"
-    assert r2hs("Pa-sonaru/Conpyu-ta-") == "ﾊﾟｰｿﾅﾙ･ｺﾝﾋﾟｭｰﾀｰ"
-    assert r2hs("Da/Vinchi=DaVinchi") == "ﾀﾞ･ｳﾞｨﾝﾁ=ﾀﾞｳﾞｨﾝﾁ"
-    assert r2hs("VARISU") == "ｳﾞｧﾘｽ"
-    assert r2hs("I-SU") == "ｲｰｽ"
-    assert r2hs("I^su") == "ｲｰｽ"
-    assert r2hs("a-123") == "ｱｰ123"
-    assert r2hs("az-123") == "ｱ-123"
-    assert r2hs("\b") == "\b"
-    assert r2hs("\x7f") == "\x7f"
-    assert r2hs("a\b-") == "ｱ\b-"
-    assert r2hs("a\x7f-") == "ｱ\x7f-"
-    assert r2hs("a -") == "ｱ -"
-    assert r2hs("a \b-") == "ｱ \bｰ"
-    assert r2hs("a \x7f-") == "ｱ \x7fｰ"
-    assert r2hs("a\n\b-") == "ｱ\n\b-"
-    assert r2hs("a\r\x7f-") == "ｱ\r\x7f-"
-    assert r2hs("k\ba\b-") == "ｱ\b-"
-    assert r2hs("k\ba\x7f-") == "ｱ\x7f-"
-    assert r2hs("k\ba -") == "ｱ -"
-    assert r2hs("k\ba \b-") == "ｱ \bｰ"
-    assert r2hs("k\ba \x7f-") == "ｱ \x7fｰ"
-    assert r2hs("ak\b\b-") == "ｱ\b-"
-    assert r2hs("ak\x7fk\x7f-") == "ｱｰ"
-    assert r2hs("a k\b-") == "ｱ -"
-    assert r2hs("a k\b\b-") == "ｱ \bｰ"
-    assert r2hs("a k\x7f\x7f-") == "ｱ \x7fｰ"
-    assert r2hs("k\ba\bk\b-") == "ｱ\b-"
-    assert r2hs("k\ba\x7fk\x7f-") == "ｱ\x7f-"
-    assert r2hs("k\ba k\b-") == "ｱ -"
-    assert r2hs("k\ba \bk\b-") == "ｱ \bｰ"
-    assert r2hs("k\ba \x7fk\x7f-") == "ｱ \x7fｰ"
-    assert r2hs("ki") == "ｷ"
-    assert r2hs("kya") == "ｷｬ"
-    assert r2hs("kyu") == "ｷｭ"
-    assert r2hs("ya") == "ﾔ"
-    assert r2hs("ki\b") == "ｷ\b"
-    assert r2hs("kya\b") == "ｷｬ\b"
-    assert r2hs("kyu\b") == "ｷｭ\b"
-    assert r2hs("ya\b") == "ﾔ\b"
-    assert r2hs("\bki") == "\bｷ"
-    assert r2hs("\bkya") == "\bｷｬ"
-    assert r2hs("\bkyu") == "\bｷｭ"
-    assert r2hs("\bya") == "\bﾔ"
-    assert r2hs("\bki\b") == "\bｷ\b"
-    assert r2hs("\bkya\b") == "\bｷｬ\b"
-    assert r2hs("\bkyu\b") == "\bｷｭ\b"
-    assert r2hs("\bya\b") == "\bﾔ\b"
-    assert r2hs("k\bi") == "ｲ"
-    assert r2hs("k\bya") == "ﾔ"
-    assert r2hs("ky\ba") == "ｶ"
-    assert r2hs("k\byu") == "ﾕ"
-    assert r2hs("ky\bu") == "ｸ"
-    assert r2hs("ky\bya") == "ｷｬ"
-    assert r2hs("ky\byu") == "ｷｭ"
-    assert r2hs("ky\b\ba") == "ｱ"
-    assert r2hs("ky\b\bu") == "ｳ"
-    assert r2hs("ky\b\bya") == "ﾔ"
-    assert r2hs("ky\b\byu") == "ﾕ"
-    assert r2hs("ﾌ-") == "ﾌｰ"
-    assert r2hs("fu-") == "ﾌｰ"
-    assert r2hs("f\b-") == "-"
-    assert r2hs("f\b-") == "-"
-    assert r2hs("fw\bu") == "ﾌ"
-    assert r2hs("fw\bwu") == "ﾌｩ"
-    assert r2hs("f\bfyafw\byufy\byofw\b\bfy\b\b-") == "ﾌｬﾌｭﾌｮｰ"
-    assert r2hs("qu") == "ｸ"
-    assert r2hs("q\bu") == "ｳ"
-    assert r2hs("kwu") == "ｸｩ"
-    assert r2hs("kw\bu") == "ｸ"
-    assert r2hs("konnnichiha") == "ｺﾝﾆﾁﾊ"
-    assert r2hs("kon'nichiha") == "ｺﾝﾆﾁﾊ"
-    assert r2hs("kon'nitiha") == "ｺﾝﾆﾁﾊ"
-    assert r2hs("colnnitiha") == "ｺﾝﾆﾁﾊ"
-    assert r2hs("coxnnitiha") == "ｺﾝﾆﾁﾊ"
-    assert r2hs("aaiiuueeoo") == "ｱｱｲｲｳｳｴｴｵｵ"
-    assert r2hs("a-i-u-e-o-") == "ｱｰｲｰｳｰｴｰｵｰ"
-    assert r2hs("wwhawwhiwwhuwwhewwho") == "ｯｳｧｯｳｨｯｳｯｳｪｯｳｫ"
-    assert r2hs("vvavvivvuvvevvo") == "ｯｳﾞｧｯｳﾞｨｯｳﾞｯｳﾞｪｯｳﾞｫ"
-    assert r2hs("ttyattyittyuttyettyo") == "ｯﾁｬｯﾁｨｯﾁｭｯﾁｪｯﾁｮ"
-    assert r2hs("ccyaccyiccyuccyeccyo") == "ｯﾁｬｯﾁｨｯﾁｭｯﾁｪｯﾁｮ"
-    assert r2hs("ffaffiffuffeffo") == "ｯﾌｧｯﾌｨｯﾌｯﾌｪｯﾌｫ"
-    assert r2hs("bbabbibbubbebbo") == "ｯﾊﾞｯﾋﾞｯﾌﾞｯﾍﾞｯﾎﾞ"
-    assert r2hs("pphapphipphuppheppho") == "ｯﾌﾟｧｯﾌﾟｨｯﾌﾟｩｯﾌﾟｪｯﾌﾟｫ"
-    assert r2hs("bbyabbyibbyubbyebbyo") == "ｯﾋﾞｬｯﾋﾞｨｯﾋﾞｭｯﾋﾞｪｯﾋﾞｮ"
-    assert r2hs("ppyappyippyuppyeppyo") == "ｯﾋﾟｬｯﾋﾟｨｯﾋﾟｭｯﾋﾟｪｯﾋﾟｮ"
-    assert r2hs("pphapphipphuppheppho") == "ｯﾌﾟｧｯﾌﾟｨｯﾌﾟｩｯﾌﾟｪｯﾌﾟｫ"
-    assert r2hs("yyayyiyyuyyeyyo") == "ｯﾔｯｲｯﾕｯｲｪｯﾖ"
-    assert r2hs("yaayiiyuuyeeyoo") == "ﾔｱｲｲﾕｳｲｪｴﾖｵ"
-    assert r2hs("ya-yi-yu-ye-yo-") == "ﾔｰｲｰﾕｰｲｪｰﾖｰ"
-    assert (
-        r2hs(
-            """
-      fa   fi   fu   fe   fo     fya       fyu       fyo     fwa  fwi  fwu  fwe  fwo
-     ffa  ffi  ffu  ffe  ffo    ffya      ffyu      ffyo    ffwa ffwi ffwu ffwe ffwo
-    """
-        ).split()
-        == """
-      ﾌｧ   ﾌｨ   ﾌ   ﾌｪ   ﾌｫ      ﾌｬ        ﾌｭ        ﾌｮ      ﾌｧ   ﾌｨ   ﾌｩ   ﾌｪ   ﾌｫ
-     ｯﾌｧ  ｯﾌｨ  ｯﾌ  ｯﾌｪ  ｯﾌｫ     ｯﾌｬ       ｯﾌｭ       ｯﾌｮ     ｯﾌｧ  ｯﾌｨ  ｯﾌｩ  ｯﾌｪ  ｯﾌｫ
-    """.split()
-    )
-    assert (
-        r2hs(
-            """
-      va   vi   vu   ve   vo     vya  vyi  vyu  vye  vyo
-     vva  vvi  vvu  vve  vvo    vvya vvyi vvyu vvye vvyo
-    """
-        ).split()
-        == """
-     ｳﾞｧ  ｳﾞｨ  ｳﾞ   ｳﾞｪ  ｳﾞｫ     ｳﾞｬ  ｳﾞｨ  ｳﾞｭ  ｳﾞｪ  ｳﾞｮ
-    ｯｳﾞｧ ｯｳﾞｨ ｯｳﾞ  ｯｳﾞｪ ｯｳﾞｫ    ｯｳﾞｬ ｯｳﾞｨ ｯｳﾞｭ ｯｳﾞｪ ｯｳﾞｮ
-    """.split()
+            r2ks(long_romaji_specimen).split() == long_kana_specimen.split()
+        ), f"r2ks({repr(long_romaji_specimen)}) failed, expected: \n {repr(long_kana_specimen)}, but got:\n {repr(r2ks(long_romaji_specimen))}"
+        assert r2ks("Ra-men") == "ﾗｰﾒﾝ"
+        assert r2ks("cyocore-to") == "ﾁｮｺﾚｰﾄ"
+        assert r2ks("chokore-to") == "ﾁｮｺﾚｰﾄ"
+        assert r2ks("tyokore-to") == "ﾁｮｺﾚｰﾄ"
+        assert r2ks("chilyokore-to") == "ﾁｮｺﾚｰﾄ"
+        assert r2ks("KYANTO/BAI/MI-/RABU") == "ｷｬﾝﾄ･ﾊﾞｲ･ﾐｰ･ﾗﾌﾞ"
+        assert r2ks("byu-t'ifuru/sande-") == "ﾋﾞｭｰﾃｨﾌﾙ･ｻﾝﾃﾞｰ"
+        assert r2ks("BarakuZ/Obama") == "ﾊﾞﾗｸ･ｵﾊﾞﾏ"
+        assert r2ks("Pa-sonaru/Conpyu-ta-") == "ﾊﾟｰｿﾅﾙ･ｺﾝﾋﾟｭｰﾀｰ"
+        assert r2ks("Da/Vinchi=DaVinchi") == "ﾀﾞ･ｳﾞｨﾝﾁ=ﾀﾞｳﾞｨﾝﾁ"
+        assert r2ks("VARISU") == "ｳﾞｧﾘｽ"
+        assert r2ks("I-SU") == "ｲｰｽ"
+        assert r2ks("I^su") == "ｲｰｽ"
+        assert r2ks("a-123") == "ｱｰ123"
+        assert r2ks("az-123") == "ｱ-123"
+        assert r2ks("\b") == "\b"
+        assert r2ks("\x7f") == "\x7f"
+        assert r2ks("a\b-") == "ｱ\b-"
+        assert r2ks("a\x7f-") == "ｱ\x7f-"
+        assert r2ks("a -") == "ｱ -"
+        assert r2ks("a \b-") == "ｱ \bｰ"
+        assert r2ks("a \x7f-") == "ｱ \x7fｰ"
+        assert r2ks("a\n\b-") == "ｱ\n\b-"
+        assert r2ks("a\r\x7f-") == "ｱ\r\x7f-"
+        assert r2ks("k\ba\b-") == "ｱ\b-"
+        assert r2ks("k\ba\x7f-") == "ｱ\x7f-"
+        assert r2ks("k\ba -") == "ｱ -"
+        assert r2ks("k\ba \b-") == "ｱ \bｰ"
+        assert r2ks("k\ba \x7f-") == "ｱ \x7fｰ"
+        assert r2ks("ak\b\b-") == "ｱ\b-"
+        assert r2ks("ak\x7fk\x7f-") == "ｱｰ"
+        assert r2ks("a k\b-") == "ｱ -"
+        assert r2ks("a k\b\b-") == "ｱ \bｰ"
+        assert r2ks("a k\x7f\x7f-") == "ｱ \x7fｰ"
+        assert r2ks("k\ba\bk\b-") == "ｱ\b-"
+        assert r2ks("k\ba\x7fk\x7f-") == "ｱ\x7f-"
+        assert r2ks("k\ba k\b-") == "ｱ -"
+        assert r2ks("k\ba \bk\b-") == "ｱ \bｰ"
+        assert r2ks("k\ba \x7fk\x7f-") == "ｱ \x7fｰ"
+        assert r2ks("ki") == "ｷ"
+        assert r2ks("kya") == "ｷｬ"
+        assert r2ks("kyu") == "ｷｭ"
+        assert r2ks("ya") == "ﾔ"
+        assert r2ks("ki\b") == "ｷ\b"
+        assert r2ks("kya\b") == "ｷｬ\b"
+        assert r2ks("kyu\b") == "ｷｭ\b"
+        assert r2ks("ya\b") == "ﾔ\b"
+        assert r2ks("\bki") == "\bｷ"
+        assert r2ks("\bkya") == "\bｷｬ"
+        assert r2ks("\bkyu") == "\bｷｭ"
+        assert r2ks("\bya") == "\bﾔ"
+        assert r2ks("\bki\b") == "\bｷ\b"
+        assert r2ks("\bkya\b") == "\bｷｬ\b"
+        assert r2ks("\bkyu\b") == "\bｷｭ\b"
+        assert r2ks("\bya\b") == "\bﾔ\b"
+        assert r2ks("k\bi") == "ｲ"
+        assert r2ks("k\bya") == "ﾔ"
+        assert r2ks("ky\ba") == "ｶ"
+        assert r2ks("k\byu") == "ﾕ"
+        assert r2ks("ky\bu") == "ｸ"
+        assert r2ks("ky\bya") == "ｷｬ"
+        assert r2ks("ky\byu") == "ｷｭ"
+        assert r2ks("ky\b\ba") == "ｱ"
+        assert r2ks("ky\b\bu") == "ｳ"
+        assert r2ks("ky\b\bya") == "ﾔ"
+        assert r2ks("ky\b\byu") == "ﾕ"
+        assert r2ks("ﾌ-") == "ﾌｰ"
+        assert r2ks("fu-") == "ﾌｰ"
+        assert r2ks("f\b-") == "-"
+        assert r2ks("f\b-") == "-"
+        assert r2ks("fw\bu") == "ﾌ"
+        assert r2ks("fw\bwu") == "ﾌｩ"
+        assert r2ks("f\bfyafw\byufy\byofw\b\bfy\b\b-") == "ﾌｬﾌｭﾌｮｰ"
+        assert r2ks("qu") == "ｸ"
+        assert r2ks("q\bu") == "ｳ"
+        assert r2ks("kwu") == "ｸｩ"
+        assert r2ks("kw\bu") == "ｸ"
+        assert r2ks("konnnichiha") == "ｺﾝﾆﾁﾊ"
+        assert r2ks("kon'nichiha") == "ｺﾝﾆﾁﾊ"
+        assert r2ks("kon'nitiha") == "ｺﾝﾆﾁﾊ"
+        assert r2ks("colnnitiha") == "ｺﾝﾆﾁﾊ"
+        assert r2ks("coxnnitiha") == "ｺﾝﾆﾁﾊ"
+        assert r2ks("aaiiuueeoo") == "ｱｱｲｲｳｳｴｴｵｵ"
+        assert r2ks("a-i-u-e-o-") == "ｱｰｲｰｳｰｴｰｵｰ"
+        assert r2ks("wwhawwhiwwhuwwhewwho") == "ｯｳｧｯｳｨｯｳｯｳｪｯｳｫ"
+        assert r2ks("vvavvivvuvvevvo") == "ｯｳﾞｧｯｳﾞｨｯｳﾞｯｳﾞｪｯｳﾞｫ"
+        assert r2ks("ttyattyittyuttyettyo") == "ｯﾁｬｯﾁｨｯﾁｭｯﾁｪｯﾁｮ"
+        assert r2ks("ccyaccyiccyuccyeccyo") == "ｯﾁｬｯﾁｨｯﾁｭｯﾁｪｯﾁｮ"
+        assert r2ks("ffaffiffuffeffo") == "ｯﾌｧｯﾌｨｯﾌｯﾌｪｯﾌｫ"
+        assert r2ks("bbabbibbubbebbo") == "ｯﾊﾞｯﾋﾞｯﾌﾞｯﾍﾞｯﾎﾞ"
+        assert r2ks("pphapphipphuppheppho") == "ｯﾌﾟｧｯﾌﾟｨｯﾌﾟｩｯﾌﾟｪｯﾌﾟｫ"
+        assert r2ks("bbyabbyibbyubbyebbyo") == "ｯﾋﾞｬｯﾋﾞｨｯﾋﾞｭｯﾋﾞｪｯﾋﾞｮ"
+        assert r2ks("ppyappyippyuppyeppyo") == "ｯﾋﾟｬｯﾋﾟｨｯﾋﾟｭｯﾋﾟｪｯﾋﾟｮ"
+        assert r2ks("pphapphipphuppheppho") == "ｯﾌﾟｧｯﾌﾟｨｯﾌﾟｩｯﾌﾟｪｯﾌﾟｫ"
+        assert r2ks("yyayyiyyuyyeyyo") == "ｯﾔｯｲｯﾕｯｲｪｯﾖ"
+        assert r2ks("yaayiiyuuyeeyoo") == "ﾔｱｲｲﾕｳｲｪｴﾖｵ"
+        assert r2ks("ya-yi-yu-ye-yo-") == "ﾔｰｲｰﾕｰｲｪｰﾖｰ"
+        assert (
+            r2ks(
+                """
+          fa   fi   fu   fe   fo     fya       fyu       fyo     fwa  fwi  fwu  fwe  fwo
+         ffa  ffi  ffu  ffe  ffo    ffya      ffyu      ffyo    ffwa ffwi ffwu ffwe ffwo
+        """
+            ).split()
+            == """
+          ﾌｧ   ﾌｨ   ﾌ   ﾌｪ   ﾌｫ      ﾌｬ        ﾌｭ        ﾌｮ      ﾌｧ   ﾌｨ   ﾌｩ   ﾌｪ   ﾌｫ
+         ｯﾌｧ  ｯﾌｨ  ｯﾌ  ｯﾌｪ  ｯﾌｫ     ｯﾌｬ       ｯﾌｭ       ｯﾌｮ     ｯﾌｧ  ｯﾌｨ  ｯﾌｩ  ｯﾌｪ  ｯﾌｫ
+        """.split()
+        )
+        assert (
+            r2ks(
+                """
+          va   vi   vu   ve   vo     vya  vyi  vyu  vye  vyo
+         vva  vvi  vvu  vve  vvo    vvya vvyi vvyu vvye vvyo
+        """
+            ).split()
+            == """
+         ｳﾞｧ  ｳﾞｨ  ｳﾞ   ｳﾞｪ  ｳﾞｫ     ｳﾞｬ  ｳﾞｨ  ｳﾞｭ  ｳﾞｪ  ｳﾞｮ
+        ｯｳﾞｧ ｯｳﾞｨ ｯｳﾞ  ｯｳﾞｪ ｯｳﾞｫ    ｯｳﾞｬ ｯｳﾞｨ ｯｳﾞｭ ｯｳﾞｪ ｯｳﾞｮ
+        """.split()
+        )
+        assert r2ks("nanyanannyanannnyan'nxnlnxxnllnxnnlnn~") == "ﾅﾆｬﾅﾝﾔﾅﾝﾆｬﾝﾝﾝﾝｯﾝｯﾝﾝﾝﾝﾝ~"
+
+        # some error handling tests
+        assert r2ks("abcdefghijklmnopqrstuvwxyz") == "ｱbcﾃﾞfgﾋjklmﾉpqrsﾂvwxyz"
+        assert (
+            r2ks("a b c d e f g h i j k l m n o p q r s t u v w x y z")
+            == "ｱ b c d ｴ f g h ｲ j k l m ﾝ ｵ p q r s t ｳ v w x y z"
+        )
+        assert (
+            r2ks("aabbccddeeffgghhiijjkkllmmnnooppqqrrssttuuvvwwxxyyzz")
+            == "ｱｱｯbｯcｯﾃﾞｴｯfｯgｯﾋｲｯjｯkｯlｯmﾝｵｵｯpｯqｯrｯsｯﾂｳｯvｯwｯxｯyｯz"
+        )
+        assert (
+            r2ks(
+                "aa bb cc dd ee ff gg hh ii jj kk ll mm nn oo pp qq rr ss tt uu vv ww xx yy zz"
+            )
+            == "ｱｱ ｯb ｯc ｯd ｴｴ ｯf ｯg ｯh ｲｲ ｯj ｯk ｯl ｯm ﾝ ｵｵ ｯp ｯq ｯr ｯs ｯt ｳｳ ｯv ｯw ｯx ｯy ｯz"
+        )
+
+        for cc in range(128):
+            ch = chr(cc)
+            if ch.lower() in PUNCT_A:
+                assert (
+                    r2ks(ch) == PUNCT_K[PUNCT_A.index(ch.lower())]
+                ), f"conversion failed for punctuation {ch}: got {r2ks(ch)}"
+            elif ch.lower() in AIUEO_R_SET:
+                assert (
+                    r2ks(ch) == AIUEO_K[AIUEO_R.index(ch.lower())]
+                ), f"conversion failed for vowel {ch}: got {r2ks(ch)}"
+            elif ch.lower() == "n":
+                assert (
+                    r2ks(ch) == NN_K
+                ), f"conversion failed for moraic {ch}: got {r2ks(ch)}"
+            elif ch.lower() == CHOUONPU_A:
+                assert (
+                    r2ks(ch) == CHOUONPU_K
+                ), f"conversion failed for chouonpu {ch}: got {r2ks(ch)}"
+            else:
+                assert r2ks(ch) == ch, f"conversion failed for {ch}: got {r2ks(ch)}"
+
+
+    for r2h_impl in (r2h, *generated):
+        for form, romaji, expected in (
+            ("halfwidth", "gakkou", "ｶﾞｯｺｳ"),
+            ("katakana", "gakkou", "ガッコウ"),
+            ("hiragana", "gakkou", "がっこう"),
+            ("katakana", "kaz;", "ガ"),
+            ("katakana", "haz:", "パ"),
+            ("katakana", "Pa-sonaru/Conpyu-ta-", "パーソナル・コンピューター"),
+            ("hiragana", "byu-t'ifuru/sande-", "びゅーてぃふる・さんでー"),
+            ("katakana", "VARISU", "ヴァリス"),
+            ("hiragana", "VARISU", "ゔぁりす"),
+            ("katakana", "waz;woz;", "ヷヺ"),
+            ("hiragana", "waz;woz;", "わ゛を゛"),
+            ("katakana", "az;z:", "ア゛゜"),
+            ("hiragana", "kaz:", "か゜"),
+            ("katakana", "[ka.ki,]", "「カ。キ、」"),
+            ("hiragana", "ka-123", "かー123"),
+            ("katakana", "ka\bz;", "カ\b゛"),
+            ("hiragana", "kax\bz;", "が"),
+            ("katakana", "kakikukeko", "カキクケコ"),
+            ("katakana", "ka", "カ"),
+            ("katakana", "", ""),
+        ):
+            assert (
+                r2hs(romaji, r2h=r2h_impl, form=form) == expected
+            ), f"r2hs({repr(romaji)}, form={repr(form)}) failed, expected: \n {repr(expected)}, but got:\n {repr(r2hs(romaji, r2h=r2h_impl, form=form))}"
+
+    assert pending_romaji("", "") == ""
+    assert erase_backspaces("kya\b\bi") == "ki"
+    assert display_width("ｶカa") == 4
+
+    assert max(R2H_MAX_IBUF, R2H_MAX_STATE, R2H_MAX_OBUF) <= 16
+    adversarial_r = (
+        "bcdfghjklmpqrstvwxz" * 4,
+        "xtxtsltlts'hwyt'yd'yqyqw" * 2,
+        "kkkkkkkkkkkkkkkkkkkkkkkkkkkkkk\b\b\bkkkkkkkkkkz;z:z" * 2,
     )
-    assert r2hs("nanyanannyanannnyan'nxnlnxxnllnxnnlnn~") == "ﾅﾆｬﾅﾝﾔﾅﾝﾆｬﾝﾝﾝﾝｯﾝｯﾝﾝﾝﾝﾝ~"
+    for r2h_impl in (r2h, *generated):
+        for s in adversarial_r:
+            chars = iter(s)
+            ibuf, state, obuf, flags = "", "", "", 0
+            while True:
+                ch, ibuf, state, obuf, flags = r2h_impl(
+                    ibuf=ibuf,
+                    state=state,
+                    obuf=obuf,
+                    flags=flags,
+                    getch=lambda: next(chars, ""),
+                )
+                assert (
+                    len(ibuf) <= R2H_MAX_IBUF
+                    and len(state) <= R2H_MAX_STATE
+                    and len(obuf) <= R2H_MAX_OBUF
+                    and flags < 1 << R2H_OUTPUT_FORM_SHIFT
+                ), f"{r2h_impl.__name__} buffers or flags grew beyond their bounds for {repr(s[:24])}..."
+                if ch == "":
+                    break
+    codec_r = "kyakka nn tt\b\bo z;z:, Ra-men/Pa-sonaru xtuhuxa zya-"
+    codec_b = codec_r.encode("utf-8")
+    for name, form in R2H_CODEC_NAMES.items():
+        expected = r2hs(codec_r, r2h=r2h_compiled, form=form)
+        assert codec_b.decode(name) == expected and codec_r.encode(name) == expected.encode()
+        for size in (1, 2, 3, 7):
+            chunks = [codec_b[i : i + size] for i in range(0, len(codec_b), size)]
+            assert "".join(codecs.iterdecode(chunks, name)) == expected, f"{name} decoding failed in chunks of {size}"
+            chunks = [codec_r[i : i + size] for i in range(0, len(codec_r), size)]
+            assert b"".join(codecs.iterencode(chunks, name)) == expected.encode()
+    for conversion in (("", "", "", 0), ("", "", "", 0xFF), ("k", UNUSED_R2R + "a", "", "\udc80", 1 << 36)):
+        assert r2h_codec_state(r2h_codec_state_int(conversion), len(conversion)) == conversion
 
-    # some error handling tests
-    assert r2hs("abcdefghijklmnopqrstuvwxyz") == "ｱbcﾃﾞfgﾋjklmﾉpqrsﾂvwxyz"
-    assert (
-        r2hs("a b c d e f g h i j k l m n o p q r s t u v w x y z")
-        == "ｱ b c d ｴ f g h ｲ j k l m ﾝ ｵ p q r s t ｳ v w x y z"
+    spans_text = "Hello {{kon'nichiha}}, {{}}world{{-tt}} {{sekai {{nn"
+    spans_expected = "Hello ｺﾝﾆﾁﾊ, world-ｯt {{sekai {{nn"
+    assert "".join(r2h_spans([spans_text])) == spans_expected
+    for size in (1, 2, 5):
+        chunks = [spans_text[i : i + size] for i in range(0, len(spans_text), size)]
+        assert "".join(r2h_spans(chunks)) == spans_expected, f"r2h_spans failed in chunks of {size}"
+    assert "".join(r2h_spans(["{{ka}} <ka>"], delimiters=("<", ">"), form="hiragana")) == "{{ka}} か"
+    long_span = "{{" + "ka" * R2H_SPAN_MAX + "}}"
+    chunks = [long_span[i : i + 4096] for i in range(0, len(long_span), 4096)]
+    assert "".join(r2h_spans(chunks + ["{{ka}}"])) == long_span + "ｶ"
+
+    stats = R2HStats()
+    for ch in "kyakkq\b\bx":
+        stats.count_input(ch)
+    for ch in r2hs("kyakkq\b\bx") + "ア":
+        stats.count_output(ch)
+    report = stats.report()
+    assert {k: report[k] for k in ("input_chars", "output_chars", "kana", "fallbacks", "backspaces")} == dict(
+        input_chars=9, output_chars=5, kana=4, fallbacks=1, backspaces=2
+    ), report
+    chunk_stats = R2HStats()
+    chunk_stats.count_input_chunk("kyakkq\b\bx")
+    chunk_stats.count_output_chunk(r2hs("kyakkq\b\bx") + "ア")
+    assert {k: v for k, v in chunk_stats.report().items() if k not in ("elapsed", "input_chars_per_second")} == {
+        k: v for k, v in report.items() if k not in ("elapsed", "input_chars_per_second")
+    }
+    assert set(report["input_chars_per_second"]) == {"overall", "last_1s", "last_10s", "last_60s"}
+
+    assert r2h_replay("ka1234567890" + BACKSPACE_A * 10 + "-") == "ｶｰ"
+    assert r2h_replay(["kya", "kk", "a ", "ky\b", "\bo-\x7f", "\n"]) == "ｷｬｯｶ ｵ\n"
+    replay_r = ("kon'nichiha sekai. kyakka \b\bk- " * 3) + "abc\b\b\b\b\b-"
+    assert r2h_replay(replay_r) == r2h_replay(list(replay_r))
+
+    assert validate("kon'nichiha sekai") == []
+    assert validate("konnichiwa qxz sekai") == [(11, 14)]
+    assert validate("abcdefg") == [(1, 3), (5, 7)]
+    assert validate("ABC kya kk") == [(1, 3), (9, 10)]
+    for s in ("abcdefg", "kyakka qq zz", "n'nn t'yt'y xtsxts", "mm\b\bmm\b\bq KYAKKA Qq"):
+        assert bool(validate(s)) == any(c.isascii() and c.isalpha() for c in r2hs(s))
+        assert r2h_recognize(s) == r2h_check_spans(s, r2h_table), s
+    assert validate("\u212aq") == [(1, 2)]  # KELVIN SIGN converts like k, but is not left as romaji
+    # engine registry
+    assert get_engine("compiled") is r2h_compiled
+    assert get_engine(r2h_table) is r2h_table
+    assert get_engine(f"{__name__}:r2h_table") is r2h_table
+    for name in ("nonesuch", f"{__name__}:nonesuch", "nonesuch_module:r2h"):
+        try:
+            get_engine(name)
+        except ValueError:
+            pass
+        else:
+            assert False, name
+    assert r2hs("kana", r2h="table") == R2HConverter("fast")("kana") == "ｶﾅ"
+    assert R2HConverter("compiled", form="hiragana")("kana") == "かな"
+    assert R2HConverter("simple").validate("kanaq") == [(4, 5)]
+    # input to output alignment
+    for form, romaji, spans in (
+        ("halfwidth", "kyakka n'a", ("kya", "", "k", "ka", " ", "n'", "a")),
+        (
+            "halfwidth",
+            "Ra-men\bn kyt\b\bka",
+            ("Ra", "-", "me", "n\bn", " ", "k", "yt\b\bka"),
+        ),
+        ("hiragana", "gagiga", ("ga", "gi", "ga")),
+        ("katakana", "kaki", ("ka", "ki")),
+    ):
+        alignment = array.array("I")
+        kana = r2hs(romaji, r2h=r2h_compiled, form=form, alignment=alignment)
+        assert kana == r2hs(romaji, r2h=r2h_compiled, form=form)
+        assert len(alignment) == len(kana) and list(alignment) == sorted(alignment)
+        starts = [0, *alignment]
+        assert spans == tuple(
+            romaji[starts[k] : starts[k + 1]] for k in range(len(kana))
+        )
+    # early-commit speculative output
+    for keys in (
+        "kon'nichiha, Ra-men nka kyakka",
+        "ka\bki n\bni kyt\b\bka x\x7f",
+        "shinbun zz;",
+    ):
+        speculation = R2HSpeculation(r2h_compiled)
+        shown = "".join(speculation.feed(key) for key in keys)
+        shown += speculation.feed("", True)
+        assert erase_backspaces(shown) == erase_backspaces(r2hs(keys, r2h=r2h_compiled))
+    assert speculation.feed("n") == "ﾝ" and speculation.feed("a") == "\bﾅ"
+    assert speculation.report()["corrections"] > 0
+
+    # site-specific rules
+    assert r2h_rule_prefixes("~") == 0 and r2h_rule_prefixes("kq'") == 1
+    for romaji in ("ka", "kw", "kx", "kqa", "nq", "..", "-", "~a"):
+        try:
+            r2h_rule_prefixes(romaji)
+        except ValueError:
+            pass
+        else:
+            assert False, romaji
+    for rules in (
+        {"~": "~"},
+        {"~": ""},
+        {"": "ｰ"},
+        {"~ ": "ｰ"},
+        {"~~~~~": "ｰ"},
+        {"~": "ｰ", "~X": "ｰ"},
+        {"<": "｢", "ka": "ｶ"},
+    ):
+        try:
+            register_rules(rules)
+        except ValueError:
+            pass
+        else:
+            assert False, rules
+    assert not R2R_EXTENSION_RULES[0] and r2hs("<~>") == "<~>"  # `integration_test()` adds rules, which rebuilds the tables
+
+    # packed session state
+    sessions = R2HSessionManager(2, r2h="table")
+    texts = ["kon'nichiha, Ra-men", "kyakka nn zz; t\bkkyo-"]
+    converted = ["", ""]
+    for i in range(0, 32, 3):
+        chunks = [(j, text[i : i + 3]) for j, text in enumerate(texts)]
+        for j, new in enumerate(sessions.feed_many(chunks)):
+            converted[j] += new
+    for j, new in enumerate(sessions.drain([0, 1])):
+        converted[j] += new
+    assert converted == [r2hs(text) for text in texts]
+    assert not any(sessions.sizes) and sessions.nbytes() == 2 * (R2H_SESSION_SLOT + 9)
+    session = sessions.open()
+    assert session == 2 and sessions.feed(session, "kyo", True) == "ｷｮ"
+    sessions.store(session, "ky" * R2H_SESSION_SLOT, "", "", "", 1)
+    assert sessions.load(session) == ("ky" * R2H_SESSION_SLOT, "", "", "", 1)
+    sessions.store(session, "", UNUSED_R2R + "a", UNUSED_R2R + "k", "", 1)
+    assert sessions.load(session) == ("", UNUSED_R2R + "a", UNUSED_R2R + "k", "", 1)
+    assert not sessions.overflow and sessions.close(session) == "ｶ"
+    for use in (sessions.close, sessions.load, lambda session_id: sessions.feed(session_id, "ka")):
+        try:
+            use(session)
+        except ValueError:
+            pass
+        else:
+            assert False, "closed session used"
+    assert sessions.open() == session and len(sessions) == 3
+    assert sessions.open() == 3 and sessions.feed(session, "ka", True) == "ｶ"
+    assert R2HSessionManager(1, form="hiragana").feed(0, "kana-", True) == "かなー"
+
+    # field-selective CSV and JSON Lines
+    sink = io.StringIO()
+    r2h_csv(
+        io.StringIO('id,name,note\n1,"Ra-men, kyo",ka\n2,ra-men,"a\r\nb"\n3\n'),
+        sink,
+        ["name"],
     )
-    assert (
-        r2hs("aabbccddeeffgghhiijjkkllmmnnooppqqrrssttuuvvwwxxyyzz")
-        == "ｱｱｯbｯcｯﾃﾞｴｯfｯgｯﾋｲｯjｯkｯlｯmﾝｵｵｯpｯqｯrｯsｯﾂｳｯvｯwｯxｯyｯz"
+    assert sink.getvalue() == 'id,name,note\n1,ﾗｰﾒﾝ､ ｷｮ,ka\n2,ﾗｰﾒﾝ,"a\r\nb"\n3\n'
+    try:
+        r2h_csv(io.StringIO("id,name\n"), io.StringIO(), ["kana"])
+    except ValueError:
+        pass
+    else:
+        assert False, "missing field"
+    sink = io.StringIO()
+    r2h_jsonl(
+        io.StringIO('{"a": "kana", "b": "kana", "c": 1}\r\n\n[]\n{"a":["kana"]}\n{"a":"123","c":1.0}\n{"a":"ka"}'),
+        sink,
+        ["a", "z"],
+        form="hiragana",
     )
-    assert (
-        r2hs(
-            "aa bb cc dd ee ff gg hh ii jj kk ll mm nn oo pp qq rr ss tt uu vv ww xx yy zz"
+    assert sink.getvalue() == '{"a": "かな", "b": "kana", "c": 1}\r\n\n[]\n{"a":["kana"]}\n{"a":"123","c":1.0}\n{"a": "か"}'
+    cache = {None: R2H_RULES_VERSION, "kana": "cached"}
+    assert r2h_values(["kana", "ka", "ka"], cache) == ["cached", "ｶ", "ｶ"] and len(cache) == 3
+
+
+def integration_test():
+    """
+    slower checks using threads, processes, pipes, files, and timing; run by `--selftest` rather than at import
+    """
+    smoketest()  # including the cached engines, which importing only checks when they are generated
+
+    # the recognizer used by `validate()` finds the same spans as the conversion
+    rng = random.Random(0)
+    recognizer_r = "aiueokKsStTnNhHmMyYrRwWgGzZdDbBpPjJfFvcCqQxXlL'-/.,[]~\b\x7f ;:\tｱ1é"
+    for _ in range(2000):
+        s = "".join(rng.choice(recognizer_r) for _ in range(rng.randrange(40)))
+        assert r2h_recognize(s) == r2h_check_spans(s, r2h_table), repr(s)
+
+    # the decoder state at every position fits in a `tell()` cookie and can be restored
+    codec_r = "kyakka nn tt\b\bo z;z:, Ra-men/Pa-sonaru xtuhuxa zya-"
+    codec_b = codec_r.encode("utf-8")
+    expected = r2hs(codec_r, r2h=r2h_compiled)
+    for i in range(len(codec_b)):
+        decoder, restored = codecs.getincrementaldecoder("r2h")(), codecs.getincrementaldecoder("r2h")()
+        head = decoder.decode(codec_b[:i])
+        assert decoder.getstate()[1] < 1 << 31, f"r2h decoder state at {i} is too large for tell()"
+        restored.setstate(decoder.getstate())
+        assert head + restored.decode(codec_b[i:], final=True) == expected, f"r2h decoder state was not restored at {i}"
+
+    # the engines keep all their state in their arguments, so concurrent conversions must not interfere
+    lines = ["kon'nichiha sekai", "kyakka t'yu nn Ra-men\b\bxtsu", "Pa-sonaru/Conpyu-ta-", "zz; xtsu"] * 8
+    for r2h_impl in (r2h_compiled, r2h_table):
+        expected = [r2hs(line, r2h=r2h_impl) for line in lines]
+        assert r2hs_batch(lines * 4, r2h=r2h_impl, workers=8) == expected * 4
+        assert r2hs_batch(lines, r2h=r2h_impl, form="hiragana", workers=8) == [
+            r2hs(line, r2h=r2h_impl, form="hiragana") for line in lines
+        ]
+
+    for keys, expected in (
+        ("ka", "ｶ"),
+        ("kya\nfu", "ｷｬ\nﾌ"),
+        ("ka\bki", "ｶ\b\x1b[Kｷ"),
+        ("kak\x04ki", "ｶk"),
+    ):
+        infd, keys_fd = os.pipe()
+        outfd, screen_fd = os.pipe()
+        os.write(keys_fd, keys.encode("utf-8"))
+        os.close(keys_fd)
+        latencies = []
+        r2h_interactive(infd=infd, outfd=screen_fd, latencies=latencies)
+        os.close(infd)
+        os.close(screen_fd)
+        with os.fdopen(outfd, encoding="utf-8") as screen:
+            assert screen.read() == expected, f"r2h_interactive failed for {repr(keys)}"
+        assert latencies and "n=" in latency_summary(latencies)
+
+    with tempfile.TemporaryDirectory() as tree:
+        path = os.path.join(tree, "codec.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("kyakka nn tt\b\bo z;z:, Ra-men/Pa-sonaru xtuhuxa zya-\n" * 400)
+        with open(path, encoding="r2h") as f:
+            for size in (1, 7, 5000, 20):
+                f.read(size)
+                position = f.tell()
+                text = f.read(40)
+                f.seek(position)
+                assert f.read(40) == text, f"seek({position}) failed"
+        src, dst = os.path.join(tree, "src"), os.path.join(tree, "dst")
+        os.makedirs(os.path.join(src, "sub"))
+        for relpath, romaji in (("a.txt", "kyakka\r\n"), (os.path.join("sub", "b.txt"), "nn")):
+            with open(os.path.join(src, relpath), "w", newline="") as f:
+                f.write(romaji)
+        assert r2h_tree(src, dst, workers=1) == (["a.txt", os.path.join("sub", "b.txt")], [], [])
+        with open(os.path.join(dst, "a.txt"), encoding="utf-8", newline="") as f:
+            assert f.read() == "ｷｬｯｶ\r\n"
+        assert r2h_tree(src, dst, workers=1) == ([], ["a.txt", os.path.join("sub", "b.txt")], [])
+        os.remove(os.path.join(src, "a.txt"))
+        assert r2h_tree(src, dst, workers=1) == ([], [os.path.join("sub", "b.txt")], ["a.txt"])
+        assert not os.path.exists(os.path.join(dst, "a.txt"))
+
+    # engine registry
+    assert get_engine("auto") in R2H_ENGINES.values()
+    assert check_engine(r2h_table, repeat=1) is not None
+    assert check_engine(functools.partial(r2h_output_form, form="hiragana"), repeat=1) is None
+
+    # threaded pipeline
+    romaji = "kyakka t'yu nn Ra-men\b\bxtsu" * 8
+    sink = io.StringIO()
+    stats = R2HStats()
+    r2h_pipeline(io.StringIO(romaji), sink, stats=stats, chunk_size=7)
+    assert sink.getvalue() == r2hs(romaji, r2h=r2h_compiled)
+    assert (stats.input_chars, stats.output_chars) == (len(romaji), len(sink.getvalue()))
+    sink = io.StringIO()
+    carried = r2h_pipeline(io.StringIO("ka"), sink, chunk_size=7)
+    r2h_pipeline(io.StringIO("\b-"), sink, chunk_size=7, **dict(zip(("ibuf", "state", "obuf", "flags"), carried)))
+    assert sink.getvalue() == "ｶ\bｰ"  # the kana state carries over the end of the first file, as it does when converting a character at a time
+
+    class FailingSink(io.StringIO):
+        def write(self, s):
+            raise OSError("disk full")
+
+    try:
+        r2h_pipeline(io.StringIO(romaji), FailingSink(), chunk_size=7)
+    except OSError as e:
+        assert str(e) == "disk full"
+    else:
+        assert False, "sink error not raised"
+
+    # shadow comparison
+    def misconverting(**kwargs):
+        ch, *conversion = r2h_table(**kwargs)
+        return ("ﾗ" if ch == "ﾒ" else ch), *conversion
+
+    for candidate, divergences in ((r2h_table, 0), (misconverting, 1)):
+        log = io.StringIO()
+        shadow = R2HShadow(candidate, primary=r2h_compiled, log=log)
+        assert shadow.stream() is not r2h_compiled
+        assert r2hs("Ra-men", r2h=shadow.stream()) == "ﾗｰﾒﾝ"
+        assert shadow.close()["divergences"] == divergences
+        if divergences:
+            divergence = json.loads(log.getvalue().splitlines()[0])["divergence"]
+            assert (divergence["context"], divergence["candidate"][0]) == ("me", "ﾗ")
+    shadow = R2HShadow(r2h_table, sample=0, log=log)
+    assert shadow.stream() is r2h
+    assert shadow.close()["sampled"] == 0
+
+    # sqlite functions
+    try:
+        import sqlite3
+    except ImportError:
+        sqlite3 = None
+    if sqlite3 is not None:
+        connection = sqlite3.connect(":memory:")
+        convert = register_sqlite(connection)
+        assert connection.execute(
+            "SELECT r2h('kana'), r2h('kana', 'hiragana'), r2h(NULL), r2h('kana')"
+        ).fetchone() == ("ｶﾅ", "かな", None, "ｶﾅ")
+        assert convert.cache_info().misses == 2
+        connection.execute("CREATE TABLE t (g, romaji)")
+        connection.executemany(
+            "INSERT INTO t VALUES (?, ?)",
+            [(1, "kon"), (1, "'ni"), (1, "chiha"), (2, "ga"), (2, "k"), (2, "ka")],
         )
-        == "ｱｱ ｯb ｯc ｯd ｴｴ ｯf ｯg ｯh ｲｲ ｯj ｯk ｯl ｯm ﾝ ｵｵ ｯp ｯq ｯr ｯs ｯt ｳｳ ｯv ｯw ｯx ｯy ｯz"
-    )
+        assert connection.execute(
+            "SELECT g, r2h_stream(romaji), r2h_stream(romaji, 'hiragana') FROM t GROUP BY g"
+        ).fetchall() == [(1, "ｺﾝﾆﾁﾊ", "こんにちは"), (2, "ｶﾞｯｶ", "がっか")]
+        connection.close()
 
-    for cc in range(128):
-        ch = chr(cc)
-        if ch.lower() in PUNCT_A:
-            assert (
-                r2hs(ch) == PUNCT_K[PUNCT_A.index(ch.lower())]
-            ), f"conversion failed for punctuation {ch}: got {r2hs(ch)}"
-        elif ch.lower() in AIUEO_R_SET:
-            assert (
-                r2hs(ch) == AIUEO_K[AIUEO_R.index(ch.lower())]
-            ), f"conversion failed for vowel {ch}: got {r2hs(ch)}"
-        elif ch.lower() == "n":
-            assert (
-                r2hs(ch) == NN_K
-            ), f"conversion failed for moraic {ch}: got {r2hs(ch)}"
-        elif ch.lower() == CHOUONPU_A:
-            assert (
-                r2hs(ch) == CHOUONPU_K
-            ), f"conversion failed for chouonpu {ch}: got {r2hs(ch)}"
-        else:
-            assert r2hs(ch) == ch, f"conversion failed for {ch}: got {r2hs(ch)}"
+    # site-specific rules, rebuilding the dispatch tables while another thread converts text they do not affect
+    def cached_tables():
+        return (
+            r2h_cache_path("r2h_compiled", r2h_cache_digest(), ".marshal"),
+            r2h_cache_path("r2h_tables", r2h_cache_digest(), ".bin"),
+        )
 
+    def convert_meanwhile():
+        while not rebuilt.is_set():
+            for r2h_impl in (r2h, r2h_compiled, r2h_table):
+                converted.append(r2hs("kon'nichiha Ra-men", r2h=r2h_impl))
 
-smoketest()
+    values_cache = {}
+    assert r2h_values(["ka~"], values_cache) == ["ｶ~"] and validate("kq'") == [(0, 2)]
+    if sqlite3 is not None:
+        connection = sqlite3.connect(":memory:")
+        register_sqlite(connection)
+        assert connection.execute("SELECT r2h('ka~')").fetchone() == ("ｶ~",)
+    rebuilt, converted = threading.Event(), []
+    meanwhile = threading.Thread(target=convert_meanwhile)
+    meanwhile.start()
+    try:
+        register_rules({"~": "ｰ", "kq'": "ｸｧ"})
+        try:
+            for r2h_impl in (r2h, r2h_compiled, r2h_table):
+                assert r2hs("ka~ kq'KQ'kqa kq~", r2h=r2h_impl) == "ｶｰ ｸｧｸｧkｸｧ kqｰ", r2h_impl
+                assert r2hs("kq\bkq'", r2h=r2h_impl) == r2hs("kkq'", r2h=r2h_impl) == "ｯｸｧ", r2h_impl
+            # cached conversions made before the rules were added are forgotten
+            assert r2h_values(["ka~"], values_cache) == ["ｶｰ"] and validate("kq'") == []
+            if sqlite3 is not None:
+                assert connection.execute("SELECT r2h('ka~')").fetchone() == ("ｶｰ",)
+            cached = cached_tables()
+        finally:
+            clear_rules()
+    finally:
+        rebuilt.set()
+        meanwhile.join()
+    assert converted and set(converted) == {"ｺﾝﾆﾁﾊ ﾗｰﾒﾝ"}, set(converted)
+    if sqlite3 is not None:
+        assert connection.execute("SELECT r2h('ka~')").fetchone() == ("ｶ~",)
+        connection.close()
+    for r2h_impl in (r2h_compiled, r2h_table):
+        assert r2hs("ka~ kq'", r2h=r2h_impl) == "ｶ~ kq'", r2h_impl
+    # the tables with and without the rules stay cached side by side
+    cached += cached_tables()
+    if os.access(os.path.dirname(cached[0]), os.W_OK):
+        assert all(os.path.exists(path) for path in cached), cached
 
-import sys
-import unicodedata
+
+if R2H_SHARED and (R2H_SHARED_USED == set(R2H_SHARED)):
+    # workers using shared tables rely on the publishing process having run `smoketest()`, and only check that the tables they attached to are intact
+    for r2h_impl in (r2h_compiled, r2h_table):
+        assert r2hs(R2H_SHARED_CHECK, r2h=r2h_impl) == r2hs(R2H_SHARED_CHECK), (
+            f"{r2h_impl.__name__} is broken in the tables shared through ${R2H_SHARED_ENV}"
+        )
+else:
+    smoketest(
+        generated=[  # cached engines were checked before they were cached
+            engine
+            for engine, kind in ((r2h_compiled, "r2h_compiled-"), (r2h_table, "r2h_tables-"))
+            if any(os.path.basename(path).startswith(kind) for path in R2H_CACHE_UNCHECKED)
+        ]
+    )
+for cache_path, data in R2H_CACHE_UNCHECKED.items():
+    write_r2h_cache(cache_path, data)
+R2H_CACHE_UNCHECKED = None
+
+import argparse
 
 
 def main():
@@ -1449,22 +5014,393 @@ def main():
     When invoked with no arguments, this acts as a filter from stdin to stdout.
     When invoked with arguments, each is treated as a filename and filtered to stdout.
     The special filename `-` refers to stdin.
+    `--form katakana` or `--form hiragana` selects fullwidth output instead of halfwidth katakana.
+    `--interactive` converts keystrokes from the terminal as they are typed, showing unconverted romaji as preedit text.
+    `--wrap -- COMMAND ARGS...` runs COMMAND in a pseudo-terminal, converting the keystrokes typed for it and passing its output through unchanged.
+    `--early` with `--wrap` passes on the likely output for romaji still pending straight away, correcting it with backspaces if needed.
+    `--tree SRC --out DST` converts a directory tree, skipping files unchanged since the last conversion.
+    `--spans` only converts romaji between `{{` and `}}`, or the delimiters given with `--delimiters OPEN CLOSE`.
+    `--stats` keeps conversion counters when filtering, and dumps them as JSON to stderr on SIGUSR1 and at exit.
+    `--replay` replays keystroke logs, applying backspaces to the converted text.
+    `--check` only reports the spans of each line which would be left unconverted.
+    Filenames ending in `.gz`, `.bz2`, or `.xz` are decompressed, and `--output FILE` writes to FILE instead of stdout, compressed likewise.
+    `--shadow NAME` compares engine NAME with the conversion engine on a sample of the files filtered, logging divergences as JSON.
+    `--engine NAME` selects the conversion engine, by default `compiled`; `auto` picks the fastest one passing a self-check.
+    `--selftest` runs the slower self-checks which importing this module skips.
+    """
+    parser = argparse.ArgumentParser(
+        description="convert word processor-like romaji to halfwidth katakana"
+    )
+    parser.add_argument(
+        "filenames",
+        metavar="FILENAME",
+        nargs="*",
+        default=["-"],
+        help="files to convert to stdout; `-` refers to stdin (default)",
+    )
+    parser.add_argument(
+        "--form",
+        choices=OUTPUT_FORMS,
+        default="halfwidth",
+        help="output halfwidth katakana (default), fullwidth katakana, or hiragana",
+    )
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="convert keystrokes from the terminal as they are typed; Ctrl-D ends",
+    )
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="with --interactive or --wrap, report keystroke latency on stderr at exit",
+    )
+    parser.add_argument(
+        "--wrap",
+        action="store_true",
+        help="run the command given after `--` in place of filenames in a pseudo-terminal, converting keystrokes typed for it",
+    )
+    parser.add_argument(
+        "--early",
+        action="store_true",
+        help="with --wrap, pass on the likely output for pending romaji straight away, correcting it with backspaces; reports the correction rate on stderr at exit",
+    )
+    parser.add_argument(
+        "--tree",
+        metavar="SRC",
+        help="convert every file under the directory SRC to the same path under --out, skipping unchanged files",
+    )
+    parser.add_argument(
+        "--out", metavar="DST", help="output directory for --tree"
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        help="with --tree, the number of worker processes (default: one per CPU); with --csv or --jsonl, convert each batch of records with N worker processes",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="convert only the fields named by --fields of CSV records, copying the rest unchanged",
+    )
+    parser.add_argument(
+        "--fields",
+        metavar="NAME,...",
+        help="with --csv, comma-separated names of the fields to convert, from the header row",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="convert only the string values of the top-level keys named by --keys of JSON Lines records, copying the rest unchanged",
+    )
+    parser.add_argument(
+        "--keys",
+        metavar="NAME,...",
+        help="with --jsonl, comma-separated keys whose values to convert",
+    )
+    parser.add_argument(
+        "--spans",
+        action="store_true",
+        help="only convert romaji between delimiters, copying everything else unchanged",
+    )
+    parser.add_argument(
+        "--delimiters",
+        metavar=("OPEN", "CLOSE"),
+        nargs=2,
+        help=f"delimiters for --spans (default: {' '.join(R2H_SPAN_DELIMITERS)}); implies --spans",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="when filtering, count characters converted, dumping the counts as JSON to stderr on SIGUSR1 and at exit",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="replay keystroke logs, writing the text they leave once every backspace has been applied",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check that each line converts cleanly, listing the spans left unconverted; exits with status 1 if any are",
+    )
+    parser.add_argument(
+        "--engine",
+        metavar="NAME",
+        default=R2H_ENGINE_DEFAULT,
+        help=f"conversion engine: one of {', '.join(R2H_ENGINES)} (default: {R2H_ENGINE_DEFAULT}), `module:attribute` for an engine defined elsewhere, or auto for the fastest engine passing a self-check",
+    )
+    parser.add_argument(
+        "--rule",
+        metavar="ROMAJI=KANA",
+        action="append",
+        default=[],
+        help="add a site-specific rule converting ROMAJI to the halfwidth katakana KANA, for example `--rule '~=ｰ'`; may be repeated",
+    )
+    parser.add_argument(
+        "--shadow",
+        metavar="NAME",
+        help="when filtering, also run engine NAME on a sample of the files in a background thread, logging where it diverges from --engine",
+    )
+    parser.add_argument(
+        "--shadow-sample",
+        metavar="FRACTION",
+        type=float,
+        default=1.0,
+        help="fraction of the files to compare with --shadow (default: 1)",
+    )
+    parser.add_argument(
+        "--shadow-log",
+        metavar="FILE",
+        help="append the --shadow log to FILE instead of stderr",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="write to FILE instead of stdout, compressed if it ends in .gz, .bz2, or .xz",
+    )
+    parser.add_argument(
+        "--selftest",
+        action="store_true",
+        help="run the slower self-checks skipped at import, using threads, processes, pipes, and temporary files, then exit",
+    )
+    args = parser.parse_args()
+    if args.selftest:
+        integration_test()
+        print("self-test passed", file=sys.stderr)
+        return
+    try:
+        if args.rule:
+            register_rules(
+                dict(rule.partition("=")[::2] for rule in args.rule)
+            )
+        base_engine = get_engine(args.engine)
+        if args.shadow is not None:
+            get_engine(args.shadow)
+    except ValueError as e:
+        parser.error(str(e))
+    if (args.tree is None) != (args.out is None):
+        parser.error("--tree and --out must be used together")
+    if args.csv == (args.fields is None) or args.jsonl == (args.keys is None):
+        parser.error("--csv and --fields, and --jsonl and --keys, must be used together")
+    if args.csv and args.jsonl:
+        parser.error("--csv and --jsonl cannot be used together")
+    if args.delimiters is not None and not all(args.delimiters):
+        parser.error("--delimiters must not be empty")
+    if args.output is not None:
+        for option, used in (
+            ("--wrap", args.wrap),
+            ("--interactive", args.interactive),
+            ("--tree", args.tree is not None),
+            ("--check", args.check),
+        ):
+            if used:
+                parser.error(f"--output cannot be used with {option}")
+    if args.early and not args.wrap:
+        parser.error("--early can only be used with --wrap")  # --interactive already shows pending romaji as preedit
+    if args.stats:
+        for option, used in (
+            ("--wrap", args.wrap),
+            ("--interactive", args.interactive),
+            ("--tree", args.tree is not None),
+            ("--check", args.check),
+            ("--replay", args.replay),
+            ("--spans", args.spans or (args.delimiters is not None)),
+            ("--csv", args.csv),
+            ("--jsonl", args.jsonl),
+        ):
+            if used:
+                parser.error(f"--stats cannot be used with {option}")
+    if args.tree is not None:
+        converted, unchanged, removed = r2h_tree(
+            args.tree, args.out, form=args.form, workers=args.jobs, r2h=args.engine
+        )
+        print(
+            f"{len(converted)} converted, {len(unchanged)} unchanged, {len(removed)} removed",
+            file=sys.stderr,
+        )
+        return
+    engine = base_engine
+    if args.form != "halfwidth":
+        engine = functools.partial(r2h_output_form, form=args.form, r2h=engine)
+    if args.wrap:
+        if args.filenames == ["-"]:
+            parser.error("--wrap requires a command, given after `--`")
+        restore = (
+            raw_terminal(sys.stdin.fileno(), signals=False)
+            if sys.stdin.isatty()
+            else lambda: None
+        )
+        latencies = []
+        speculation = R2HSpeculation(engine, erase=RUBOUT_A) if args.early else None
+        try:
+            status = r2h_wrap(
+                args.filenames,
+                infd=sys.stdin.fileno(),
+                outfd=sys.stdout.fileno(),
+                r2h=engine,
+                latencies=latencies,
+                speculation=speculation,
+            )
+        finally:
+            restore()
+        if speculation is not None:
+            print(f"early output: {json.dumps(speculation.report())}", file=sys.stderr)
+        if args.latency:
+            print(
+                f"keystroke-to-command latency: {latency_summary(latencies)}",
+                file=sys.stderr,
+            )
+        sys.exit(status if status >= 0 else 128 - status)
+    if args.interactive:
+        if not (sys.stdin.isatty() and sys.stdout.isatty()):
+            parser.error("--interactive requires a terminal")
+        latencies = []
+        restore = raw_terminal(sys.stdin.fileno())
+        try:
+            r2h_interactive(
+                infd=sys.stdin.fileno(),
+                outfd=sys.stdout.fileno(),
+                r2h=engine,
+                latencies=latencies,
+            )
+        finally:
+            restore()
+        if args.latency:
+            print(
+                f"keystroke-to-echo latency: {latency_summary(latencies)}",
+                file=sys.stderr,
+            )
+        return
+    if args.check:
+        failed = False
+        for filename in args.filenames:
+            with sys.stdin if filename == "-" else open_r2h_file(filename) as source:
+                for lineno, line in enumerate(source, 1):
+                    for start, end in validate(line, r2h=engine):
+                        failed = True
+                        print(
+                            f"{filename}:{lineno}:{1 + start}: unconverted {repr(line[start:end])}"
+                        )
+        sys.exit(1 if failed else 0)
+    if args.output is None:
+        filter_files(args, sys.stdout, engine, base_engine)
+        return
+    with open_r2h_file(args.output, "w") as sink:
+        filter_files(args, sink, engine, base_engine)
+
+
+def filter_files(args, sink, engine, base_engine):
+    """
+    the modes of `main()` which convert the named files to sink
     """
+    if args.replay:
+        for filename in args.filenames:
+            with sys.stdin if filename == "-" else open_r2h_file(filename) as source:
+                sink.write(
+                    r2h_replay(iter(lambda: source.read(1 << 16), ""), r2h=engine)
+                )
+        return
+    if args.csv or args.jsonl:
+        executor, segment = None, None
+        if (args.jobs or 1) > 1:
+            segment = share_r2h_tables()
+            executor = concurrent.futures.ProcessPoolExecutor(args.jobs)
+        try:
+            for filename in args.filenames:
+                with sys.stdin if filename == "-" else open_r2h_file(
+                    filename, newline=""
+                ) as source:
+                    if filename == "-":
+                        source.reconfigure(newline="")
+                    try:
+                        (r2h_csv if args.csv else r2h_jsonl)(
+                            source,
+                            sink,
+                            (args.fields or args.keys).split(","),
+                            r2h=base_engine if executor is None else args.engine,
+                            form=args.form,
+                            executor=executor,
+                        )
+                    except ValueError as e:  # a missing field, or invalid JSON
+                        sys.exit(f"{filename}: {e}")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+                unshare_r2h_tables(segment)
+        return
+    if args.spans or args.delimiters:
+        for filename in args.filenames:
+            with sys.stdin if filename == "-" else open_r2h_file(filename) as source:
+                for piece in r2h_spans(
+                    iter(lambda: source.read(1 << 16), ""),
+                    delimiters=args.delimiters or R2H_SPAN_DELIMITERS,
+                    r2h=base_engine,
+                    form=args.form,
+                ):
+                    sink.write(piece)
+        return
+    stats = R2HStats() if args.stats else None
+    if stats is not None and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: stats.dump())
+
+    def getch_from(source):
+        if stats is None:
+            return lambda: source.read(1)
+
+        def getch():
+            ch = source.read(1)
+            if ch:
+                stats.count_input(ch)
+            return ch
+
+        return getch
+
+    shadow_log = None if args.shadow_log is None else open(args.shadow_log, "a")
+    shadow = None
+    if args.shadow is not None:
+        shadow = R2HShadow(
+            args.shadow, primary=base_engine, sample=args.shadow_sample, log=shadow_log
+        )
+
+    def stream_engine():
+        if shadow is None:
+            return engine
+        stream = shadow.stream()
+        if args.form != "halfwidth":
+            stream = functools.partial(r2h_output_form, form=args.form, r2h=stream)
+        return stream
+
     ibuf, state, obuf, flags = "", "", "", 0
-    _, *filenames = sys.argv
-    filenames = filenames or ["-"]
-    for filename in filenames:
-        with sys.stdin if filename == "-" else open(filename, "r") as source:
+    for filename in args.filenames:
+        engine = stream_engine()
+        if filename != "-":  # stdin is converted a character at a time, as it is typed
+            with open_r2h_file(filename) as source:
+                ibuf, state, obuf, flags = r2h_pipeline(
+                    source,
+                    sink,
+                    r2h=engine,
+                    stats=stats,
+                    ibuf=ibuf,
+                    state=state,
+                    obuf=obuf,
+                    flags=flags,
+                )
+            continue
+        with sys.stdin as source:
+            getch = getch_from(source)
             while True:
-                ch, ibuf, state, obuf, flags = r2h(
+                ch, ibuf, state, obuf, flags = engine(
                     ibuf=ibuf,
                     state=state,
                     obuf=obuf,
                     flags=flags,
-                    getch=lambda: source.read(1),
+                    getch=getch,
                 )
                 if ch == "":
                     break
+                if stats is not None:
+                    stats.count_output(ch)
                 if False:
                     print(
                         dict(
@@ -1476,7 +5412,13 @@ def main():
                             flags=flags,
                         )
                     )
-                print(ch, end="", flush=True)
+                print(ch, end="", file=sink, flush=sink is sys.stdout)
+    if stats is not None:
+        stats.dump()
+    if shadow is not None:
+        shadow.close()
+    if shadow_log is not None:
+        shadow_log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,732 @@
+#!/usr/bin/env python3
+
+"""
+benchmarks for r2h.py
+
+usage: python3 r2h_bench.py [ BENCHMARKS[=SIZE]... ]
+
+when invoked with no arguments, all the benchmarks are run.
+a size after a benchmark name overrides its default input size.
+"""
+
+import array
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import random
+import select
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import r2h
+
+try:
+    import sqlite3
+except ImportError:  # not included in every Python build
+    sqlite3 = None
+
+ENGINES = dict(
+    r2h=r2h.r2h,
+    r2h_compiled=r2h.r2h_compiled,
+    r2h_table=r2h.r2h_table,
+)
+SAMPLE_R = (
+    "kon'nichiha, sekai. Ra-men/Pa-sonaru/Conpyu-ta-/byu-t'ifuru/sande- "
+    "KYANTO/BAI/MI-/RABU chokore-to xtuhuxa vvyu nn z; z: abcdefghijklmnopqrstuvwxyz\n"
+)
+WORKERS = 4
+KEYSTROKE_MODES = dict(  # r2h.py arguments for each I/O mode driven by bench_keystrokes()
+    filter=[],
+    interactive=["--interactive"],
+    wrap=["--wrap", "--", "cat"],
+    early=["--wrap", "--early", "--", "cat"],
+)
+KEYSTROKE_TIMEOUT = 1.0  # seconds to wait for the output of a keystroke before counting it as missed
+
+
+def deep_sizeof(value, seen=None):
+    """
+    approximate heap size of value and everything it refers to, in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    return size
+
+
+def proc_memory():
+    """
+    resident, proportional (shared pages divided among the processes sharing them), and private memory of this process in KiB
+
+    this reads /proc/self/smaps_rollup, so it only works on Linux.
+    """
+    fields = {}
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return dict(
+        rss=fields["Rss"],
+        pss=fields["Pss"],
+        uss=fields["Private_Clean"] + fields["Private_Dirty"],
+    )
+
+
+def engine_tables(name):
+    """
+    the rule tables used by the named engine, split into per-process (private) and shared parts
+
+    the return values are private_bytes, shared_bytes.
+    """
+    if name == "r2h_compiled":
+        namespace = r2h.r2h_compiled.__globals__
+        return deep_sizeof([namespace["R2R"], namespace["R2K"]]), 0
+    if name == "r2h_table":
+        class_map, *views = r2h.R2H_TABLES[:4]
+        return deep_sizeof(list(r2h.R2H_TABLES[4:])), class_map.nbytes + sum(
+            view.nbytes for view in views
+        )
+    return (
+        deep_sizeof(
+            [
+                value
+                for key, value in vars(r2h).items()
+                if key.isupper() and not key.startswith("R2H_")
+            ]
+        ),
+        0,
+    )
+
+
+def convert(engine, s):
+    return r2h.r2hs(s, r2h=engine)
+
+
+def footprint_worker(name):
+    convert(ENGINES[name], SAMPLE_R)
+    return proc_memory()
+
+
+def bench_throughput(repeat=20):
+    """
+    conversion speed of each engine, in input characters per second
+    """
+    s = SAMPLE_R * repeat
+    for name, engine in ENGINES.items():
+        t = time.perf_counter()
+        convert(engine, s)
+        elapsed = time.perf_counter() - t
+        print(f"throughput {name}: {len(s) / elapsed:,.0f} chars/s")
+
+
+def bench_footprint():
+    """
+    per-process memory footprint: rule table sizes for each engine, and the memory of freshly spawned worker processes using each engine
+    """
+    for name in ENGINES:
+        private_bytes, shared_bytes = engine_tables(name)
+        print(
+            f"footprint {name}: tables {private_bytes:,} bytes per process, {shared_bytes:,} bytes shared"
+        )
+    context = multiprocessing.get_context("spawn")
+    for name in ENGINES:
+        with context.Pool(WORKERS) as pool:
+            results = pool.map(footprint_worker, [name] * WORKERS)
+        print(
+            f"footprint {name}: {WORKERS} workers, per worker "
+            + ", ".join(
+                f"{field} {sum(result[field] for result in results) // WORKERS:,} KiB"
+                for field in ("rss", "pss", "uss")
+            )
+        )
+
+
+def stress_session(i, repeat=20):
+    """
+    stream one session a character at a time through alternating engines, returning its output
+    """
+    chars = iter(SAMPLE_R[i % len(SAMPLE_R) :] * repeat)
+    engine = (r2h.r2h_compiled, r2h.r2h_table)[i % 2]
+    o = []
+    ibuf, state, obuf, flags = "", "", "", 0
+    while True:
+        ch, ibuf, state, obuf, flags = engine(
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            getch=lambda: next(chars, ""),
+        )
+        if ch == "":
+            break
+        o += [ch]
+    return "".join(o)
+
+
+def bench_threads(sessions=64, workers=(1, 2, 4, 8)):
+    """
+    many concurrent sessions in a thread pool, checked against sequential conversion, and the scaling of `r2h.r2hs_batch()` with threads versus processes
+    """
+    print(
+        "threads: GIL "
+        + ("enabled" if getattr(sys, "_is_gil_enabled", lambda: True)() else "disabled")
+    )
+    expected = [stress_session(i) for i in range(sessions)]
+    with concurrent.futures.ThreadPoolExecutor(max(workers)) as pool:
+        assert list(pool.map(stress_session, range(sessions))) == expected
+    print(f"threads: {sessions} concurrent sessions matched sequential conversion")
+    strings = [SAMPLE_R * 10] * sessions
+    n = sum(len(s) for s in strings)
+    for n_workers in workers:
+        t = time.perf_counter()
+        r2h.r2hs_batch(strings, workers=n_workers)
+        thread_elapsed = time.perf_counter() - t
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+            executor.submit(int).result()  # exclude worker startup
+            t = time.perf_counter()
+            r2h.r2hs_batch(strings, workers=n_workers, executor=executor)
+            process_elapsed = time.perf_counter() - t
+        print(
+            f"threads: {n_workers} workers, threads {n / thread_elapsed:,.0f} chars/s, processes {n / process_elapsed:,.0f} chars/s"
+        )
+
+
+def spawn_workers(n_workers):
+    """
+    time to start a pool of freshly spawned worker processes until every one has converted something, and their memory use
+    """
+    context = multiprocessing.get_context("spawn")
+    t = time.perf_counter()
+    with context.Pool(n_workers) as pool:
+        results = pool.map(footprint_worker, ["r2h_table"] * n_workers, chunksize=1)
+        elapsed = time.perf_counter() - t
+    return elapsed, results
+
+
+def bench_shared(n_workers=WORKERS):
+    """
+    worker spawn time and memory with each worker loading its own tables, versus attaching to tables published through shared memory by `r2h.share_r2h_tables()`
+
+    sharing only saves spawn time; the per-worker memory is shown to check that it stays the same.
+    """
+    measured = {}
+    for mode in ("private", "shared"):
+        segment = r2h.share_r2h_tables() if mode == "shared" else None
+        try:
+            elapsed, results = spawn_workers(n_workers)
+        finally:
+            if segment is not None:
+                r2h.unshare_r2h_tables(segment)
+        memory = {
+            field: sum(result[field] for result in results) // n_workers
+            for field in ("rss", "pss", "uss")
+        }
+        measured[mode] = elapsed, memory
+        print(
+            f"shared {mode}: {n_workers} workers ready in {elapsed:.2f}s, per worker "
+            + ", ".join(f"{field} {size:,} KiB" for field, size in memory.items())
+        )
+    (private_elapsed, private_memory), (shared_elapsed, shared_memory) = measured.values()
+    print(
+        f"shared saving: spawn {private_elapsed / shared_elapsed:.1f}x faster, per worker "
+        + ", ".join(
+            f"{field} {private_memory[field] - shared_memory[field]:+,} KiB"
+            for field in private_memory
+        )
+    )
+
+
+ADVERSARIAL_R = dict(
+    consonants="bcdfghjklmpqrstvwxz",
+    alphabet="abcdefghijklmnopqrstuvwxyz",
+    retries="t'yd'yhwyxtsltsqw",
+    n="n",
+    backspaces="kyt\b\b",
+    voicing="z;z:z",
+)
+
+
+def bench_pathological(sizes=(1 << 12, 1 << 14, 1 << 16)):
+    """
+    per-character conversion cost on adversarial inputs of increasing size, which must stay flat since the work is linear in the input
+
+    sizes are in characters; an argument given on the command line is the largest size.
+    """
+    if isinstance(sizes, int):
+        sizes = (sizes >> 4, sizes >> 2, sizes)
+    for name, engine in ENGINES.items():
+        scale = 8 if engine is r2h.r2h else 1  # the reference engine is much slower
+        for corpus, unit in ADVERSARIAL_R.items():
+            costs = []
+            for size in sizes:
+                s = (unit * (1 + size // scale // len(unit)))[: size // scale]
+                t = time.perf_counter()
+                convert(engine, s)
+                costs += [(time.perf_counter() - t) / len(s)]
+            print(
+                f"pathological {name} {corpus}: "
+                + ", ".join(f"{cost * 1e6:.2f}" for cost in costs)
+                + f" us/char, ratio {max(costs) / min(costs):.2f}"
+            )
+            assert max(costs) < 3 * min(costs), f"{name} is not linear on {corpus}"
+
+
+def keystroke_log(keystrokes, seed=0):
+    """
+    synthetic keystroke log of words from `SAMPLE_R`, with some mistyped letters corrected by backspace
+    """
+    rng = random.Random(seed)
+    words = SAMPLE_R.split(" ")
+    parts, n = [], 0
+    while n < keystrokes:
+        word = rng.choice(words)
+        if rng.random() < 0.05:
+            word = word[:-1] + rng.choice("aiueo") + "\b" + word[-1]
+        parts += [word + " "]
+        n += len(word) + 1
+    return "".join(parts)[:keystrokes]
+
+
+def bench_replay(keystrokes=1 << 21):
+    """
+    keystroke log replay speed with `r2h.r2h_replay()`, against converting the same log with `r2h.r2hs()`
+    """
+    log = keystroke_log(keystrokes)
+    t = time.perf_counter()
+    r2h.r2h_replay(log)
+    elapsed = time.perf_counter() - t
+    print(f"replay r2h_replay: {len(log) / elapsed:,.0f} keystrokes/s")
+    sample = log[: 1 << 16]
+    t = time.perf_counter()
+    convert(r2h.r2h_compiled, sample)
+    elapsed = time.perf_counter() - t
+    print(f"replay r2hs: {len(sample) / elapsed:,.0f} keystrokes/s")
+
+
+def worst_case_r(seed=0):
+    """
+    endless synthetic input made of long runs of consonants which never convert, interrupted by partial conversions that fail and are retried
+    """
+    rng = random.Random(seed)
+    fragments = ["t'y", "d'y", "hwy", "xts", "lts", "qw", "kk", "z", "\b", "n"]
+    while True:
+        yield from "".join(rng.choice("bcdfghjklmpqrstvwxz") for _ in range(64))
+        yield from rng.choice(fragments)
+
+
+def bench_memory(chars=1 << 18, chunks=16):
+    """
+    stream synthetic worst-case input through each engine with `tracemalloc`, checking that peak memory stays flat as the input grows
+
+    the peak is measured separately for each of several equal chunks of the stream; every chunk after the first must stay within a small margin of the first.
+    """
+    for name, engine in ENGINES.items():
+        n = chars if engine is not r2h.r2h else chars // 8  # the reference engine is much slower
+        source = worst_case_r()
+        getch = lambda: next(source)
+        ibuf, state, obuf, flags = "", "", "", 0
+        peaks = []
+        tracemalloc.start()
+        t = time.perf_counter()
+        for _ in range(chunks):
+            tracemalloc.reset_peak()
+            for _ in range(n // chunks):
+                ch, ibuf, state, obuf, flags = engine(
+                    ibuf=ibuf, state=state, obuf=obuf, flags=flags, getch=getch
+                )
+            peaks += [tracemalloc.get_traced_memory()[1]]
+        elapsed = time.perf_counter() - t
+        tracemalloc.stop()
+        assert max(peaks[1:]) <= peaks[0] + 4096, f"memory {name}: peak grew {peaks}"
+        print(
+            f"memory {name}: {n:,} output chars in {elapsed:.1f}s, peak {max(peaks):,} bytes traced, flat across {chunks} chunks"
+        )
+
+
+def bench_alignment(repeat=200):
+    """
+    cost of recording the input to output alignment with `r2h.r2hs()`, against plain conversion and against the quadratic alternative of converting each prefix of a short input
+    """
+    for name, engine in ENGINES.items():
+        scale = 8 if engine is r2h.r2h else 1  # the reference engine is much slower
+        s = SAMPLE_R * max(1, repeat // scale)
+        t = time.perf_counter()
+        convert(engine, s)
+        plain = time.perf_counter() - t
+        t = time.perf_counter()
+        r2h.r2hs(s, r2h=engine, alignment=array.array("I"))
+        aligned = time.perf_counter() - t
+        print(
+            f"alignment {name}: {len(s) / aligned:,.0f} chars/s, {aligned / plain - 1:+.0%} over plain conversion"
+        )
+    s = SAMPLE_R * 2
+    t = time.perf_counter()
+    for i in range(len(s) + 1):
+        convert(r2h.r2h_compiled, s[:i])
+    prefixes = time.perf_counter() - t
+    t = time.perf_counter()
+    r2h.r2hs(s, r2h=r2h.r2h_compiled, alignment=array.array("I"))
+    aligned = time.perf_counter() - t
+    print(
+        f"alignment prefixes: {len(s)} chars, reconverting prefixes {prefixes * 1e3:.1f} ms, alignment {aligned * 1e3:.2f} ms"
+    )
+
+
+def bench_shadow(repeat=1000):
+    """
+    overhead of a sampled `r2h.R2HShadow` stream on the converting thread, in its CPU time and in wall time with the comparison thread running beside it
+    """
+    s = SAMPLE_R * repeat
+    t, cpu = time.perf_counter(), time.thread_time()
+    convert(r2h.r2h_compiled, s)
+    plain, plain_cpu = time.perf_counter() - t, time.thread_time() - cpu
+    with open(os.devnull, "w") as log:
+        shadow = r2h.R2HShadow(r2h.r2h_table, primary=r2h.r2h_compiled, log=log)
+        t, cpu = time.perf_counter(), time.thread_time()
+        convert(shadow.stream(), s)
+        shadowed, shadowed_cpu = time.perf_counter() - t, time.thread_time() - cpu
+        report = shadow.close()
+    print(
+        f"shadow hot path: {len(s):,} chars, {shadowed_cpu / plain_cpu - 1:+.0%} CPU time of the converting thread, {shadowed / plain - 1:+.0%} wall time with comparisons running"
+    )
+    print(
+        f"shadow comparisons: {report['segments']} segments, {report['dropped']} dropped, candidate time ratio {report['candidate_time_ratio']:.2f}"
+    )
+
+
+def romaji_table(rows, distinct=False, seed=0):
+    """
+    in-memory SQLite table of rows of romaji with an empty kana column; each value is a couple of words from `SAMPLE_R`, or with distinct, a run of random syllables, so that nearly every value is different
+    """
+    rng = random.Random(seed)
+    words = SAMPLE_R.split()
+    syllables = [s for s in r2h.expand_1_1_starts(*r2h.ALL_1_1_STARTS_R) if s.isalpha()]
+
+    def value():
+        if distinct:
+            return "".join(rng.choice(syllables) for _ in range(rng.randint(3, 8)))
+        return f"{rng.choice(words)} {rng.choice(words)}"
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (romaji TEXT, kana TEXT)")
+    connection.executemany(
+        "INSERT INTO t (romaji) VALUES (?)", ((value(),) for _ in range(rows))
+    )
+    return connection
+
+
+def distinct_romaji(chars, seed=0):
+    """
+    chars characters of words of random syllables, some with a stray consonant which is left unconverted, so that hardly any word repeats
+    """
+    rng = random.Random(seed)
+    syllables = [s for s in r2h.expand_1_1_starts(*r2h.ALL_1_1_STARTS_R) if s.isalpha()]
+    words, n = [], 0
+    while n < chars:
+        word = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 6)))
+        if rng.random() < 0.1:
+            word += rng.choice("bcdfghjklmpqrstvwxz")
+        words += [word]
+        n += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def bench_validate(chars=1 << 20):
+    """
+    `r2h.validate()` on text which hardly repeats a word, so that no cache helps: the recognizer of `r2h.r2h_recognize()`, against running the conversion with `r2h.r2h_check_spans()` as for engines it does not cover
+    """
+    text = distinct_romaji(chars)
+    r2h.r2h_recognizer()  # loaded, or built and cached, once per process
+    t = time.perf_counter()
+    recognized = r2h.r2h_recognize(text)
+    recognize = time.perf_counter() - t
+    print(f"validate recognizer: {len(text) / recognize:,.0f} chars/s")
+    r2h.r2h_check_cached.cache_clear()
+    t = time.perf_counter()
+    converted = r2h.r2h_check_spans(text, r2h.r2h_compiled)
+    elapsed = time.perf_counter() - t
+    assert recognized == converted
+    print(
+        f"validate conversion: {len(text) / elapsed:,.0f} chars/s, the recognizer is {elapsed / recognize:.1f}x faster ({len(recognized):,} spans left unconverted)"
+    )
+
+
+def bench_sqlite(rows=1 << 16):
+    """
+    converting a column of a table of rows with `UPDATE ... SET kana = r2h(romaji)` using `r2h.register_sqlite()`, against a Python loop converting and updating row by row, and one converting with the same size of cache and updating with `executemany()`, for a table of repetitive values and one of nearly all distinct values
+    """
+    if sqlite3 is None:
+        print("sqlite: skipped, this Python has no sqlite3 module")
+        return
+    for table, distinct in (("repetitive", False), ("distinct", True)):
+        connection = romaji_table(rows, distinct)
+        values = connection.execute("SELECT rowid, romaji FROM t").fetchall()
+        print(
+            f"sqlite {table}: {rows:,} rows, {len(set(romaji for _, romaji in values)):,} distinct values"
+        )
+        t = time.perf_counter()
+        for rowid, romaji in values:
+            connection.execute(
+                "UPDATE t SET kana = ? WHERE rowid = ?",
+                (r2h.r2hs(romaji, r2h=r2h.r2h_compiled), rowid),
+            )
+        connection.commit()
+        loop = time.perf_counter() - t
+        expected = connection.execute("SELECT kana FROM t ORDER BY rowid").fetchall()
+        print(f"sqlite {table} python loop: {loop:.2f}s, {rows / loop:,.0f} rows/s")
+        connection.execute("UPDATE t SET kana = NULL")
+        convert = functools.lru_cache(maxsize=r2h.R2H_SQLITE_CACHE_SIZE)(
+            functools.partial(r2h.r2hs, r2h=r2h.r2h_compiled)
+        )
+        t = time.perf_counter()
+        connection.executemany(
+            "UPDATE t SET kana = ? WHERE rowid = ?",
+            ((convert(romaji), rowid) for rowid, romaji in values),
+        )
+        connection.commit()
+        cached = time.perf_counter() - t
+        assert connection.execute("SELECT kana FROM t ORDER BY rowid").fetchall() == expected
+        print(
+            f"sqlite {table} cached python loop with executemany(): {cached:.2f}s, {rows / cached:,.0f} rows/s, {loop / cached:.1f}x the loop"
+        )
+        connection.execute("UPDATE t SET kana = NULL")
+        convert = r2h.register_sqlite(connection)
+        t = time.perf_counter()
+        connection.execute("UPDATE t SET kana = r2h(romaji)")
+        connection.commit()
+        elapsed = time.perf_counter() - t
+        assert connection.execute("SELECT kana FROM t ORDER BY rowid").fetchall() == expected
+        print(
+            f"sqlite {table} r2h(): {elapsed:.2f}s, {rows / elapsed:,.0f} rows/s, {loop / elapsed:.1f}x the loop, {cached / elapsed:.1f}x the cached loop, {convert.cache_info()}"
+        )
+        t = time.perf_counter()
+        (streamed,) = connection.execute(
+            "SELECT r2h_stream(romaji || ' ') FROM (SELECT romaji FROM t ORDER BY rowid)"
+        ).fetchone()
+        elapsed = time.perf_counter() - t
+        print(
+            f"sqlite {table} r2h_stream(): {rows:,} rows as one stream in {elapsed:.2f}s, {rows / elapsed:,.0f} rows/s, {len(streamed):,} chars"
+        )
+        connection.close()
+
+
+def keystroke_timings(keystrokes, seed=0):
+    """
+    (delay in seconds, key) pairs to replay: the recording in the file named by $R2H_KEYSTROKES, one JSON [delay, key] pair per line, or else synthetic typing of `keystroke_log()` with gaps of a few milliseconds
+    """
+    path = os.environ.get("R2H_KEYSTROKES")
+    if path:
+        with open(path) as recording:
+            return [tuple(json.loads(line)) for line in recording][:keystrokes]
+    rng = random.Random(seed)
+    return [
+        (min(0.05, rng.lognormvariate(-5, 0.5)), key)
+        for key in keystroke_log(keystrokes, seed)
+    ]
+
+
+def keystroke_outputs(keys):
+    """
+    whether each key in keys produces any output when converted as it is typed
+    """
+    pending, ibuf, state, obuf, flags = "", "", "", "", 0
+    outputs = []
+    for key in keys:
+        converted, pending, ibuf, state, obuf, flags = r2h.r2h_chunk(
+            key,
+            False,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=r2h.r2h_compiled,
+        )
+        outputs += [bool(converted)]
+    return outputs
+
+
+def drain(fd, deadline):
+    """
+    read and discard output from fd until deadline, returning the time the first of it arrived, or None
+    """
+    first = None
+    while True:
+        ready, _, _ = select.select([fd], [], [], max(0, deadline - time.perf_counter()))
+        if not ready:
+            return first
+        arrived = time.perf_counter()
+        try:
+            if not os.read(fd, 1 << 16):
+                return first
+        except OSError:  # EIO once the program has exited
+            return first
+        if first is None:
+            first = arrived
+            deadline = arrived  # only what is already there
+
+
+def measure_keystrokes(argv, timings, outputs):
+    """
+    run argv in a pseudo-terminal, type the keys of timings into it, and return the latencies in seconds from writing each key expected to produce output (per outputs) to the first byte of output after it, with the number of such keys which produced nothing within `KEYSTROKE_TIMEOUT`
+
+    the terminal starts out in raw mode, so that keys reach even the stdin filter as they are typed, and are not echoed by the terminal before the program has started.
+    """
+    master, slave = os.openpty()
+    r2h.raw_terminal(slave)
+    process = subprocess.Popen(
+        argv,
+        stdin=slave,
+        stdout=slave,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    os.close(slave)
+    latencies, missed = [], 0
+    try:
+        for _ in range(120):  # wait for it to start up; input before then may be flushed
+            os.write(master, b"a")
+            if drain(master, time.perf_counter() + 0.5) is not None:
+                break
+        else:
+            raise AssertionError(f"no output from {argv}")
+        drain(master, time.perf_counter() + 0.5)
+        due = time.perf_counter()
+        for (delay, key), output in zip(timings, outputs):
+            due += delay
+            drain(master, due)
+            written = time.perf_counter()
+            os.write(master, key.encode("utf-8"))
+            if output:
+                first = None
+                while first is None and time.perf_counter() < written + KEYSTROKE_TIMEOUT:
+                    first = drain(master, written + KEYSTROKE_TIMEOUT)
+                if first is None:
+                    missed += 1
+                else:
+                    latencies += [first - written]
+            due = max(due, time.perf_counter())
+    finally:
+        process.kill()
+        process.wait()
+        os.close(master)
+    return latencies, missed
+
+
+def bench_keystrokes(keystrokes=400):
+    """
+    keystroke latency of r2h.py through a pseudo-terminal for each engine and I/O mode: the time from typing a key to the first byte of resulting output, as percentiles
+
+    the keys are synthetic typing with backspaces and `-` after kana, or a recording (see `keystroke_timings()`).
+    """
+    timings = keystroke_timings(keystrokes)
+    converting = keystroke_outputs([key for _, key in timings])
+    for mode, arguments in KEYSTROKE_MODES.items():
+        outputs = converting
+        if mode in ("interactive", "early"):  # preedit or speculative output for every key
+            outputs = [True] * len(timings)
+        for name in r2h.R2H_ENGINES:
+            latencies, missed = measure_keystrokes(
+                [sys.executable, r2h.__file__, "--engine", name, *arguments],
+                timings,
+                outputs,
+            )
+            print(
+                f"keystrokes {mode} {name}: {r2h.latency_summary(latencies)} missed={missed}"
+            )
+
+
+def bench_sessions(sessions=100_000, rounds=4):
+    """
+    memory and feed rate of `r2h.R2HSessionManager` with many sessions part way through converting, against keeping a tuple of conversion state for each session
+    """
+    rng = random.Random(0)
+    words = SAMPLE_R.split()
+    batches = [
+        [(i, rng.choice(words)[: rng.randrange(1, 6)]) for i in range(sessions)]
+        for _ in range(rounds)
+    ]
+    manager = r2h.R2HSessionManager(sessions)
+    t = time.perf_counter()
+    for batch in batches:
+        manager.feed_many(batch)
+    elapsed = time.perf_counter() - t
+    pending = sum(1 for size in manager.sizes if size)
+    print(
+        f"sessions manager: {sessions:,} sessions ({pending:,} with pending romaji) in {manager.nbytes() / sessions:.1f} bytes each, {len(manager.overflow)} overflowed, {rounds * sessions / elapsed:,.0f} feeds/s"
+    )
+    states = [("", "", "", "", 0)] * sessions
+    t = time.perf_counter()
+    for batch in batches:
+        for i, text in batch:
+            pending, ibuf, state, obuf, flags = states[i]
+            _, *states[i] = r2h.r2h_chunk(
+                text,
+                False,
+                pending=pending,
+                ibuf=ibuf,
+                state=state,
+                obuf=obuf,
+                flags=flags,
+                r2h=r2h.r2h_compiled,
+            )
+    elapsed = time.perf_counter() - t
+    print(
+        f"sessions tuples: {sessions:,} sessions in {deep_sizeof(states) / sessions:.1f} bytes each, {rounds * sessions / elapsed:,.0f} feeds/s"
+    )
+    t = time.perf_counter()
+    drained = manager.drain(range(sessions))
+    elapsed = time.perf_counter() - t
+    print(f"sessions drain: {sessions / elapsed:,.0f} sessions/s")
+    for (pending, ibuf, state, obuf, flags), flushed in zip(states, drained):
+        assert flushed == r2h.r2h_chunk(
+            "",
+            True,
+            pending=pending,
+            ibuf=ibuf,
+            state=state,
+            obuf=obuf,
+            flags=flags,
+            r2h=r2h.r2h_compiled,
+        )[0]
+
+
+BENCHMARKS = dict(
+    throughput=bench_throughput,
+    footprint=bench_footprint,
+    threads=bench_threads,
+    memory=bench_memory,
+    shared=bench_shared,
+    replay=bench_replay,
+    pathological=bench_pathological,
+    alignment=bench_alignment,
+    shadow=bench_shadow,
+    validate=bench_validate,
+    sqlite=bench_sqlite,
+    keystrokes=bench_keystrokes,
+    sessions=bench_sessions,
+)
+
+
+def main():
+    _, *names = sys.argv
+    for name in names or BENCHMARKS:
+        name, _, size = name.partition("=")
+        BENCHMARKS[name](*([int(float(size))] if size else []))
+
+
+if __name__ == "__main__":
+    main()